@@ -0,0 +1,164 @@
+"""
+Vectorized CTC forced alignment against the per-frame loops it replaced.
+
+Builds synthetic log-softmax emissions for a set of segments (each a random character
+sequence laid out over its frames, plus noise) and aligns them with the reference
+frame-by-frame get_trellis/backtrack from the torchaudio tutorial and with whisperx's
+batched trellis and array backtrack. Checks that trellises, paths, frame scores and merged
+characters are identical, then reports the time of each. Needs torch and whisperx.
+
+    python -m benchmarks.alignment
+    python -m benchmarks.alignment --segments 2000 --seconds 10
+"""
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+# wav2vec2 emissions come at 50 frames per second over a vocabulary of about 32 symbols
+FRAMES_PER_SECOND = 50
+VOCABULARY = 32
+CHARS_PER_SECOND = 14
+
+
+def make_emissions(count, seconds, seed=0):
+    """(emission, tokens) pairs; segment lengths vary between half and one and a half `seconds`"""
+    import torch
+    rng = np.random.default_rng(seed)
+    segments = []
+    for _ in range(count):
+        duration = seconds * rng.uniform(0.5, 1.5)
+        num_frame = max(int(duration * FRAMES_PER_SECOND), 2)
+        num_tokens = max(min(int(duration * CHARS_PER_SECOND), num_frame - 1), 1)
+        tokens = rng.integers(1, VOCABULARY, num_tokens)
+        logits = rng.normal(0, 1, (num_frame, VOCABULARY)).astype(np.float32)
+        # Each character is emitted on its own stretch of frames, blanks in between
+        bounds = np.sort(rng.choice(np.arange(1, num_frame), num_tokens - 1, replace=False)) if num_tokens > 1 else []
+        for frames, token in zip(np.split(np.arange(num_frame), bounds), tokens):
+            logits[frames[:max(len(frames) // 2, 1)], token] += 6
+            logits[frames[max(len(frames) // 2, 1):], 0] += 6
+        segments.append((torch.log_softmax(torch.from_numpy(logits), dim=-1), tokens.tolist()))
+    return segments
+
+
+def reference_trellis(emission, tokens, blank_id=0):
+    import torch
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+    trellis = torch.empty((num_frame + 1, num_tokens + 1))
+    trellis[0, 0] = 0
+    trellis[1:, 0] = torch.cumsum(emission[:, 0], 0)
+    trellis[0, -num_tokens:] = -float("inf")
+    trellis[-num_tokens:, 0] = float("inf")
+    for t in range(num_frame):
+        trellis[t + 1, 1:] = torch.maximum(
+            trellis[t, 1:] + emission[t, blank_id],
+            trellis[t, :-1] + emission[t, tokens],
+        )
+    return trellis
+
+
+@dataclass
+class Point:
+    token_index: int
+    time_index: int
+    score: float
+
+
+def reference_backtrack(trellis, emission, tokens, blank_id=0):
+    import torch
+    j = trellis.size(1) - 1
+    t_start = torch.argmax(trellis[:, j]).item()
+    path = []
+    for t in range(t_start, 0, -1):
+        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
+        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
+        prob = emission[t - 1, tokens[j - 1] if changed > stayed else 0].exp().item()
+        path.append(Point(j - 1, t - 1, prob))
+        if changed > stayed:
+            j -= 1
+            if j == 0:
+                break
+    else:
+        return None
+    return path[::-1]
+
+
+def reference_merge_repeats(path):
+    """(token, start, end, score) of each run, as the original merge_repeats computed them"""
+    i1, i2 = 0, 0
+    runs = []
+    while i1 < len(path):
+        while i2 < len(path) and path[i1].token_index == path[i2].token_index:
+            i2 += 1
+        score = sum(path[k].score for k in range(i1, i2)) / (i2 - i1)
+        runs.append((path[i1].token_index, path[i1].time_index, path[i2 - 1].time_index + 1, score))
+        i1 = i2
+    return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Vectorized CTC alignment against the per-frame loops')
+    parser.add_argument('--segments', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=6, help='Average segment length')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+    try:
+        import torch  # noqa: F401
+        from whisperx import alignment
+    except ImportError as e:
+        print(f'skipped: {e}')
+        return 0
+
+    segments = make_emissions(args.segments, args.seconds)
+    emissions = [emission for emission, _ in segments]
+    tokens_list = [tokens for _, tokens in segments]
+
+    t_start = time.perf_counter()
+    reference = []
+    for emission, tokens in segments:
+        trellis = reference_trellis(emission, tokens)
+        reference.append((trellis, reference_backtrack(trellis, emission, tokens)))
+    reference_seconds = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    trellises = alignment.get_trellis_batch(emissions, tokens_list)
+    paths = [alignment.backtrack(trellis, emission, tokens)
+             for trellis, emission, tokens in zip(trellises, emissions, tokens_list)]
+    vectorized_seconds = time.perf_counter() - t_start
+
+    for i, ((trellis, path), new_trellis, new_path) in enumerate(zip(reference, trellises, paths)):
+        assert np.array_equal(trellis.numpy(), new_trellis), f'segment {i}: trellis differs'
+        assert (path is None) == (new_path is None), f'segment {i}: backtrack failure differs'
+        if path is None:
+            continue
+        assert [p.token_index for p in path] == new_path.token_index.tolist(), f'segment {i}: tokens differ'
+        assert [p.time_index for p in path] == new_path.time_index.tolist(), f'segment {i}: frames differ'
+        # Scores are exp() of the same float32 values; vectorized and scalar exp may differ in the last bit
+        assert np.allclose([p.score for p in path], new_path.score, rtol=1e-6, atol=0), f'segment {i}: scores differ'
+        runs = [(s.start, s.end) for s in alignment.merge_repeats(new_path, 'x' * len(tokens_list[i]))]
+        assert runs == [(start, end) for _, start, end, _ in reference_merge_repeats(path)], \
+            f'segment {i}: characters differ'
+
+    frames = sum(emission.shape[0] for emission in emissions)
+    results = {
+        'segments': args.segments,
+        'frames': frames,
+        'reference_seconds': reference_seconds,
+        'vectorized_seconds': vectorized_seconds,
+        'speedup': reference_seconds / vectorized_seconds,
+    }
+    print(f'{args.segments} segments, {frames} frames: identical alignments')
+    print(f'reference {reference_seconds:.2f}s, vectorized {vectorized_seconds:.2f}s, '
+          f'speedup {results["speedup"]:.1f}x')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
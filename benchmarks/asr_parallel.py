@@ -0,0 +1,100 @@
+"""
+Process-parallel CPU transcription against the single-process WhisperX path.
+
+Transcribes a speech track looped from the LJSpeech test clips on CPU, once with the int8
+model in this process and once split over ASR worker processes, both from the same VAD
+chunks and language. Reports wall time, speed relative to real time and how many segments
+came out with identical text. Needs whisperx; the model is downloaded on first use.
+Worker startup (model loading) is excluded from the timing.
+
+    python -m benchmarks.asr_parallel
+    python -m benchmarks.asr_parallel --seconds 600 --processes 4 --threads 2 --model medium
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+from loguru import logger
+
+from benchmarks import fixtures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process-parallel against single-process CPU transcription')
+    parser.add_argument('--seconds', type=float, default=300)
+    parser.add_argument('--model', default='small')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=0, help='Threads per worker (default: cores / processes)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    try:
+        import whisperx  # noqa: F401
+    except ImportError as e:
+        print(f'skipped: {e}')
+        return 0
+
+    from tools import step021_asr_whisperx as asr
+    from tools.audio_store import audio_store
+    asr.CPU_THREADS = args.threads
+    download_root = 'models/ASR/whisper'
+    folder = os.path.join(fixtures.FIXTURE_DIR, 'work', 'asr-parallel')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    wav_path = os.path.join(folder, 'audio_vocals.wav')
+    fixtures.write_speech_wav(wav_path, args.seconds)
+    audio, _ = audio_store.load(wav_path, 16000, 1)
+
+    model = asr.load_whisper_model(args.model, download_root, 'cpu')
+    vad_segments = model.detect_speech(audio, asr.CHUNK_SIZE)
+    language = model.detect_language(audio)
+
+    t_start = time.perf_counter()
+    single = model.transcribe(audio, batch_size=args.batch_size, language=language, chunk_size=asr.CHUNK_SIZE,
+                              vad_segments=vad_segments)
+    single_seconds = time.perf_counter() - t_start
+
+    # Start the workers and load their models outside the timed run
+    asr._transcribe_parallel(model, audio, wav_path, vad_segments[:args.processes], language,
+                             args.model, download_root, args.batch_size, args.processes)
+    t_start = time.perf_counter()
+    parallel = asr._transcribe_parallel(model, audio, wav_path, vad_segments, language,
+                                        args.model, download_root, args.batch_size, args.processes)
+    parallel_seconds = time.perf_counter() - t_start
+    shutil.rmtree(folder, ignore_errors=True)
+
+    assert [(s['start'], s['end']) for s in single['segments']] == \
+           [(s['start'], s['end']) for s in parallel['segments']], 'segments out of order'
+    identical = sum(a['text'] == b['text'] for a, b in zip(single['segments'], parallel['segments']))
+    results = {
+        'audio_seconds': args.seconds,
+        'chunks': len(vad_segments),
+        'processes': args.processes,
+        'threads_per_process': asr._cpu_threads(args.processes),
+        'single_seconds': single_seconds,
+        'parallel_seconds': parallel_seconds,
+        'single_realtime_speed': args.seconds / single_seconds,
+        'parallel_realtime_speed': args.seconds / parallel_seconds,
+        'speedup': single_seconds / parallel_seconds,
+        'identical_segments': identical,
+    }
+    print(f'{args.seconds:.0f}s of speech, {len(vad_segments)} chunks, {args.processes} processes x '
+          f'{results["threads_per_process"]} threads')
+    print(f'single {single_seconds:.1f}s ({results["single_realtime_speed"]:.1f}x realtime), '
+          f'parallel {parallel_seconds:.1f}s ({results["parallel_realtime_speed"]:.1f}x realtime), '
+          f'speedup {results["speedup"]:.2f}x')
+    print(f'{identical}/{len(vad_segments)} segments with identical text')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
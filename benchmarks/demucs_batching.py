@@ -0,0 +1,106 @@
+"""
+Throughput of cross-video batched Demucs separation against one video at a time.
+
+Separates several short synthetic songs twice: one after the other with one window per
+batch, then concurrently through the SeparationScheduler so their windows share batches.
+Works on CPU as well as GPU. Needs torch and demucs; the model is downloaded on first use.
+
+    python -m benchmarks.demucs_batching
+    python -m benchmarks.demucs_batching --videos 8 --seconds 20 --device cuda --batch-windows 16
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+from loguru import logger
+
+from benchmarks import fixtures
+
+
+def prepare(count, seconds):
+    folders = []
+    root = os.path.join(fixtures.FIXTURE_DIR, 'work', 'demucs-batching')
+    shutil.rmtree(root, ignore_errors=True)
+    for i in range(count):
+        folder = os.path.join(root, f'video{i}')
+        os.makedirs(folder)
+        fixtures.write_mix_wav(os.path.join(folder, 'audio.wav'), seconds, seed=i)
+        folders.append(folder)
+    return folders
+
+
+def clean(folders):
+    for folder in folders:
+        for name in ('audio_vocals.wav', 'audio_instruments.wav'):
+            if os.path.exists(os.path.join(folder, name)):
+                os.remove(os.path.join(folder, name))
+
+
+def run(folders, scheduler, args, concurrent):
+    def separate(folder):
+        scheduler.separate(os.path.join(folder, 'audio.wav'), os.path.join(folder, 'audio_vocals.wav'),
+                           os.path.join(folder, 'audio_instruments.wav'), args.model, args.device, args.shifts)
+
+    clean(folders)
+    t_start = time.perf_counter()
+    if concurrent:
+        threads = [threading.Thread(target=separate, args=(folder,)) for folder in folders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for folder in folders:
+            separate(folder)
+    return time.perf_counter() - t_start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cross-video batched Demucs separation throughput')
+    parser.add_argument('--videos', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=15, help='Length of each video')
+    parser.add_argument('--model', default='htdemucs_ft')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--shifts', type=int, default=0)
+    parser.add_argument('--batch-windows', type=int, default=8)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    try:
+        import demucs  # noqa: F401
+        import torch  # noqa: F401
+    except ImportError as e:
+        print(f'skipped: {e}')
+        return 0
+
+    from tools import step010_demucs_vr
+    # Short windows so that every video contributes several of them
+    step010_demucs_vr.CHUNK_SECONDS = min(step010_demucs_vr.CHUNK_SECONDS, max(args.seconds / 2, 8.0))
+    step010_demucs_vr.load_model(args.model, args.device)
+    folders = prepare(args.videos, args.seconds)
+    audio_seconds = args.videos * args.seconds
+
+    results = {}
+    print(f'{"mode":<12}{"seconds":>10}{"x realtime":>12}{"batches":>9}')
+    for mode, max_windows, concurrent in (('sequential', 1, False), ('batched', args.batch_windows, True)):
+        scheduler = step010_demucs_vr.SeparationScheduler(max_windows=max_windows)
+        seconds = run(folders, scheduler, args, concurrent)
+        results[mode] = {'seconds': seconds, 'realtime_speed': audio_seconds / seconds,
+                         'batches': scheduler.stats['batches'], 'windows': scheduler.stats['windows']}
+        print(f'{mode:<12}{seconds:>10.2f}{audio_seconds / seconds:>12.1f}{scheduler.stats["batches"]:>9}')
+    results['speedup'] = results['sequential']['seconds'] / results['batched']['seconds']
+    print(f'speedup {results["speedup"]:.2f}x')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
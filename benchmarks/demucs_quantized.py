@@ -0,0 +1,87 @@
+"""
+int8 dynamically quantized against float Demucs on CPU.
+
+Separates the same synthetic song with both models and reports runtime, speedup, the SDR
+proxy of each against the known vocals, and the difference between their outputs (SDR of
+the quantized vocals against the float vocals). Needs torch and demucs; the model is
+downloaded on first use.
+
+    python -m benchmarks.demucs_quantized
+    python -m benchmarks.demucs_quantized --seconds 120 --threads 8 --model htdemucs
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+from loguru import logger
+
+from benchmarks import fixtures
+
+
+def run_mode(folder, args, quantize):
+    from tools import step010_demucs_vr
+    step010_demucs_vr.CPU_QUANTIZE = quantize
+    for name in ('audio_vocals.wav', 'audio_instruments.wav'):
+        if os.path.exists(os.path.join(folder, name)):
+            os.remove(os.path.join(folder, name))
+    # Load (and quantize) outside the timed region, only separation is compared
+    step010_demucs_vr.load_model(args.model, 'cpu')
+    t_start = time.perf_counter()
+    step010_demucs_vr.separate_audio(folder, args.model, 'cpu', progress=False, shifts=args.shifts, gating=False)
+    seconds = time.perf_counter() - t_start
+    vocals, _ = fixtures.read_wav(os.path.join(folder, 'audio_vocals.wav'))
+    return seconds, vocals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Quantized against float Demucs on CPU')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--model', default='htdemucs_ft')
+    parser.add_argument('--shifts', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=0, help='Intra-op threads (default: all cores)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    try:
+        import demucs  # noqa: F401
+        import torch
+    except ImportError as e:
+        print(f'skipped: {e}')
+        return 0
+
+    from tools import step010_demucs_vr
+    step010_demucs_vr.CPU_THREADS = args.threads
+    torch.set_num_threads(args.threads or os.cpu_count() or 1)
+    folder = os.path.join(fixtures.FIXTURE_DIR, 'work', 'demucs-quantized')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    ref_vocals, _ = fixtures.write_mix_wav(os.path.join(folder, 'audio.wav'), args.seconds)
+
+    results = {}
+    outputs = {}
+    print(f'{"mode":<8}{"seconds":>10}{"x realtime":>12}{"vocals SDR":>12}')
+    for mode, quantize in (('float', False), ('int8', True)):
+        seconds, vocals = run_mode(folder, args, quantize)
+        outputs[mode] = vocals
+        results[mode] = {'seconds': seconds, 'realtime_speed': args.seconds / seconds,
+                         'vocals_sdr': fixtures.sdr(ref_vocals, vocals)}
+        print(f'{mode:<8}{seconds:>10.2f}{args.seconds / seconds:>12.2f}{results[mode]["vocals_sdr"]:>12.2f}')
+
+    results['speedup'] = results['float']['seconds'] / results['int8']['seconds']
+    results['int8_vs_float_sdr'] = fixtures.sdr(outputs['float'], outputs['int8'])
+    results['max_abs_difference'] = float(abs(outputs['float'] - outputs['int8']).max())
+    print(f'speedup {results["speedup"]:.2f}x, int8 vs float vocals SDR {results["int8_vs_float_sdr"]:.2f} dB, '
+          f'max abs difference {results["max_abs_difference"]:.4f}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Vocals-only (two-stem) against full Demucs separation on a synthetic song.
+
+Runs step010_demucs_vr.separate_audio both ways on the same fixture and reports the
+runtime and an SDR proxy of vocals and accompaniment against the known references, plus
+the SDR between the two modes' vocals. Needs torch and demucs; the model is downloaded on
+first use.
+
+    python -m benchmarks.demucs_two_stems
+    python -m benchmarks.demucs_two_stems --seconds 120 --model htdemucs_ft --device cuda --shifts 1
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+from loguru import logger
+
+from benchmarks import fixtures
+
+
+def run_mode(folder, model_name, device, shifts, two_stems):
+    from tools.step010_demucs_vr import load_model, separate_audio
+    for name in ('audio_vocals.wav', 'audio_instruments.wav'):
+        if os.path.exists(os.path.join(folder, name)):
+            os.remove(os.path.join(folder, name))
+    # Load outside the timed region, only separation is compared
+    load_model(model_name, device, two_stems=two_stems)
+    t_start = time.perf_counter()
+    separate_audio(folder, model_name, device, progress=False, shifts=shifts, two_stems=two_stems)
+    seconds = time.perf_counter() - t_start
+    vocals, _ = fixtures.read_wav(os.path.join(folder, 'audio_vocals.wav'))
+    instruments, _ = fixtures.read_wav(os.path.join(folder, 'audio_instruments.wav'))
+    return seconds, vocals, instruments
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Two-stem against four-stem Demucs separation')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--model', default='htdemucs_ft')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--shifts', type=int, default=1)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    try:
+        import demucs  # noqa: F401
+        import torch  # noqa: F401
+    except ImportError as e:
+        print(f'skipped: {e}')
+        return 0
+
+    folder = os.path.join(fixtures.FIXTURE_DIR, 'work', 'demucs-two-stems')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    ref_vocals, ref_accompaniment = fixtures.write_mix_wav(os.path.join(folder, 'audio.wav'), args.seconds)
+
+    results = {}
+    outputs = {}
+    print(f'{"mode":<12}{"seconds":>10}{"x realtime":>12}{"vocals SDR":>12}{"accomp. SDR":>13}')
+    for mode, two_stems in (('four-stem', False), ('two-stem', True)):
+        seconds, vocals, instruments = run_mode(folder, args.model, args.device, args.shifts, two_stems)
+        outputs[mode] = vocals
+        results[mode] = {
+            'seconds': seconds,
+            'realtime_speed': args.seconds / seconds,
+            'vocals_sdr': fixtures.sdr(ref_vocals, vocals),
+            'accompaniment_sdr': fixtures.sdr(ref_accompaniment, instruments),
+        }
+        r = results[mode]
+        print(f'{mode:<12}{r["seconds"]:>10.2f}{r["realtime_speed"]:>12.1f}{r["vocals_sdr"]:>12.2f}'
+              f'{r["accompaniment_sdr"]:>13.2f}')
+
+    speedup = results['four-stem']['seconds'] / results['two-stem']['seconds']
+    agreement = fixtures.sdr(outputs['four-stem'], outputs['two-stem'])
+    results['speedup'] = speedup
+    results['vocals_agreement_sdr'] = agreement
+    print(f'speedup {speedup:.2f}x, two-stem vocals vs four-stem vocals SDR {agreement:.2f} dB')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
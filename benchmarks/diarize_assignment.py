@@ -0,0 +1,133 @@
+"""
+Interval-index speaker assignment against the per-word pandas version it replaced.
+
+Builds a synthetic diarization (turns of several speakers, some overlapping) and an aligned
+transcript, assigns speakers with the original pandas loop from whisperx and with the new
+whisperx.diarize.assign_word_speakers, checks that every segment and word got the same
+speaker and reports both times. Needs pandas and whisperx.
+
+    python -m benchmarks.diarize_assignment                     # 10k words x 5k turns
+    python -m benchmarks.diarize_assignment --words 50000 --turns 20000
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+
+import numpy as np
+
+
+def make_inputs(num_words, num_turns, num_speakers=6, words_per_segment=12, seed=0):
+    """(diarize_df, transcript_result) covering the same stretch of time"""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    # About 2.5 words per second of speech, with pauses between segments
+    duration = num_words / 2.5 * 1.2
+    turn_start = np.sort(rng.uniform(0, duration, num_turns))
+    turn_end = turn_start + rng.uniform(0.3, 2.5 * duration / num_turns, num_turns)
+    diarize_df = pd.DataFrame({
+        'segment': None,
+        'label': np.arange(num_turns),
+        'speaker': [f'SPEAKER_{i:02d}' for i in rng.integers(0, num_speakers, num_turns)],
+        'start': turn_start,
+        'end': turn_end,
+    })
+
+    segments = []
+    t = 0.0
+    for first in range(0, num_words, words_per_segment):
+        words = []
+        for _ in range(min(words_per_segment, num_words - first)):
+            length = round(rng.uniform(0.1, 0.6), 3)
+            if rng.random() < 0.03:
+                # Unalignable words carry no timestamps
+                words.append({'word': 'x'})
+            else:
+                words.append({'word': 'w', 'start': round(t, 3), 'end': round(t + length, 3), 'score': 0.9})
+            t += length + rng.uniform(0.0, 0.2)
+        segments.append({'start': words[0].get('start', t), 'end': round(t, 3), 'text': '', 'words': words})
+        t += rng.uniform(0.2, 2.0)
+    return diarize_df, {'segments': segments}
+
+
+def reference_assign_word_speakers(diarize_df, transcript_result, fill_nearest=False):
+    transcript_segments = transcript_result["segments"]
+    for seg in transcript_segments:
+        diarize_df['intersection'] = np.minimum(diarize_df['end'], seg['end']) - np.maximum(diarize_df['start'], seg['start'])
+        diarize_df['union'] = np.maximum(diarize_df['end'], seg['end']) - np.minimum(diarize_df['start'], seg['start'])
+        if not fill_nearest:
+            dia_tmp = diarize_df[diarize_df['intersection'] > 0]
+        else:
+            dia_tmp = diarize_df
+        if len(dia_tmp) > 0:
+            speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+            seg["speaker"] = speaker
+        if 'words' in seg:
+            for word in seg['words']:
+                if 'start' in word:
+                    diarize_df['intersection'] = np.minimum(diarize_df['end'], word['end']) - np.maximum(diarize_df['start'], word['start'])
+                    diarize_df['union'] = np.maximum(diarize_df['end'], word['end']) - np.minimum(diarize_df['start'], word['start'])
+                    if not fill_nearest:
+                        dia_tmp = diarize_df[diarize_df['intersection'] > 0]
+                    else:
+                        dia_tmp = diarize_df
+                    if len(dia_tmp) > 0:
+                        speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+                        word["speaker"] = speaker
+    return transcript_result
+
+
+def speakers(result):
+    assigned = []
+    for seg in result['segments']:
+        assigned.append(seg.get('speaker'))
+        assigned.extend(word.get('speaker') for word in seg['words'])
+    return assigned
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Interval-index speaker assignment against the pandas loop')
+    parser.add_argument('--words', type=int, default=10000)
+    parser.add_argument('--turns', type=int, default=5000)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+    try:
+        import pandas  # noqa: F401
+        from whisperx.diarize import assign_word_speakers
+    except ImportError as e:
+        print(f'skipped: {e}')
+        return 0
+
+    diarize_df, transcript = make_inputs(args.words, args.turns)
+    reference_input = copy.deepcopy(transcript)
+
+    t_start = time.perf_counter()
+    reference = reference_assign_word_speakers(diarize_df.copy(), reference_input)
+    reference_seconds = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    result = assign_word_speakers(diarize_df, transcript)
+    interval_seconds = time.perf_counter() - t_start
+
+    expected, assigned = speakers(reference), speakers(result)
+    mismatches = sum(a != b for a, b in zip(expected, assigned))
+    results = {
+        'words': args.words,
+        'turns': args.turns,
+        'reference_seconds': reference_seconds,
+        'interval_seconds': interval_seconds,
+        'speedup': reference_seconds / interval_seconds,
+        'mismatches': mismatches,
+    }
+    print(f'{args.words} words x {args.turns} turns: {mismatches} mismatches')
+    print(f'pandas loop {reference_seconds:.2f}s, interval index {interval_seconds:.3f}s, '
+          f'speedup {results["speedup"]:.0f}x')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
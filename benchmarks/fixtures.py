@@ -0,0 +1,226 @@
+"""
+Synthetic fixtures for the offline benchmarks: noise WAVs, fake transcripts and a stub
+TTS backend, so the non-model code paths can be timed without GPUs, models or network,
+plus a synthetic song with known stems for the separation benchmarks and a speech track
+built from the LJSpeech test clips shipped with the TTS submodule for the ASR benchmarks.
+"""
+import json
+import os
+import random
+import shutil
+import wave
+
+import numpy as np
+
+# Fixture durations in seconds
+SCALES = {
+    '10m': 10 * 60,
+    '1h': 60 * 60,
+    '5h': 5 * 60 * 60,
+}
+SAMPLE_RATE = 24000
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.fixtures')
+SPEECH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'submodules', 'TTS', 'tests', 'data', 'ljspeech', 'wavs')
+
+_WORDS = ('the', 'model', 'river', 'signal', 'quickly', 'under', 'bright', 'machine', 'voice', 'seven',
+          'learning', 'across', 'video', 'small', 'after', 'dubbing', 'always', 'translate', 'open', 'data')
+_HANZI = '我们今天来看一下这个视频里面的内容非常有意思的地方就是模型可以自己学习声音'
+_ENDINGS = ('.', '?', '!', ',', '')
+
+
+def write_noise_wav(path, seconds, sample_rate=SAMPLE_RATE, seed=0, amplitude=0.1, chunk_seconds=60):
+    """Write mono 16-bit white noise, chunk by chunk so fixture generation stays small in memory"""
+    rng = np.random.default_rng(seed)
+    remaining = int(seconds * sample_rate)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        while remaining > 0:
+            n = min(remaining, chunk_seconds * sample_rate)
+            chunk = rng.normal(0, amplitude, n).clip(-1, 1)
+            f.writeframes((chunk * 32767).astype(np.int16).tobytes())
+            remaining -= n
+
+
+def tone(seconds, sample_rate=SAMPLE_RATE, frequency=220.0, amplitude=0.3):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def make_mix(seconds, sample_rate=44100, seed=0):
+    """
+    Synthetic song: a voice-like harmonic line with syllable envelopes and vibrato over
+    a bass line, chords and noise hi-hats. Returns (vocals, accompaniment) as mono float32,
+    the references for separation quality.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+    # Voice: pitch moving between notes every syllable, 5 harmonics with decaying weights
+    syllable = 0.35
+    notes = rng.choice([196.0, 220.0, 247.0, 262.0, 294.0], size=int(seconds / syllable) + 1)
+    pitch = notes[(t / syllable).astype(int)] * (1 + 0.01 * np.sin(2 * np.pi * 5.5 * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(k * phase) / k ** 1.5 for k in range(1, 6))
+    envelope = np.clip(np.sin(np.pi * (t % syllable) / syllable), 0, None) ** 0.5
+    envelope *= (rng.random(len(notes)) > 0.25)[(t / syllable).astype(int)]
+    vocals = 0.25 * voice * envelope
+
+    beat = 0.5
+    bass = 0.2 * np.sin(2 * np.pi * 55.0 * t) * np.exp(-4 * (t % beat))
+    chords = 0.05 * sum(np.sin(2 * np.pi * f * t) for f in (330.0, 415.3, 494.0))
+    hats = 0.05 * rng.normal(0, 1, n) * np.exp(-40 * ((t + beat / 2) % beat))
+    accompaniment = bass + chords + hats
+    return vocals.astype(np.float32), accompaniment.astype(np.float32)
+
+
+def write_mix_wav(path, seconds, sample_rate=44100, seed=0):
+    """Write make_mix as a 16-bit stereo audio.wav like the extract stage does; returns the references"""
+    vocals, accompaniment = make_mix(seconds, sample_rate, seed)
+    mix = np.clip(vocals + accompaniment, -1, 1)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.repeat(mix[:, None], 2, axis=1) * 32767).astype(np.int16).tobytes())
+    return vocals, accompaniment
+
+
+def write_speech_wav(path, seconds, sample_rate=16000, pause=0.8):
+    """Write mono 16-bit speech: the LJSpeech clips in order, separated by pauses, looped to `seconds`"""
+    from scipy.signal import resample_poly
+    clips = []
+    for name in sorted(os.listdir(SPEECH_DIR)):
+        if name.endswith('.wav'):
+            speech, rate = read_wav(os.path.join(SPEECH_DIR, name))
+            clips.append(resample_poly(speech, sample_rate, rate).astype(np.float32))
+    silence = np.zeros(int(pause * sample_rate), dtype=np.float32)
+    total = int(seconds * sample_rate)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        written = 0
+        while written < total:
+            for clip in clips:
+                chunk = np.concatenate([clip, silence])[:total - written]
+                f.writeframes((np.clip(chunk, -1, 1) * 32767).astype(np.int16).tobytes())
+                written += len(chunk)
+                if written >= total:
+                    break
+
+
+def read_wav(path):
+    """Mono float32 samples and sample rate of a 16-bit wav"""
+    with wave.open(path, 'rb') as f:
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16).reshape(-1, f.getnchannels())
+        return data.mean(axis=1).astype(np.float32) / 32768.0, f.getframerate()
+
+
+def sdr(reference, estimate):
+    """Signal-to-distortion ratio in dB, a quick proxy for separation quality"""
+    length = min(len(reference), len(estimate))
+    reference, estimate = reference[:length].astype(np.float64), estimate[:length].astype(np.float64)
+    return 10 * np.log10((np.sum(reference ** 2) + 1e-9) / (np.sum((reference - estimate) ** 2) + 1e-9))
+
+
+def make_transcript(seconds, seed=0, segment_seconds=4.0, num_speakers=3):
+    """
+    Fake ASR + translation output covering `seconds` of audio.
+    Roughly a third of the segments end without punctuation so merge_segments has work to do.
+    """
+    rnd = random.Random(seed)
+    transcript = []
+    start = 0.0
+    while start < seconds:
+        length = rnd.uniform(0.5, 2.0) * segment_seconds
+        end = min(start + length, seconds)
+        words = [rnd.choice(_WORDS) for _ in range(max(2, int(length * 2.5)))]
+        text = ' '.join(words).capitalize() + rnd.choice(_ENDINGS)
+        sentences = []
+        for _ in range(rnd.randint(1, 3)):
+            sentence = ''.join(rnd.choice(_HANZI) for _ in range(rnd.randint(4, 18)))
+            sentences.append(sentence + rnd.choice('，。？！'))
+        transcript.append({
+            'start': round(start, 3),
+            'end': round(end, 3),
+            'text': text,
+            'speaker': f'SPEAKER_{rnd.randrange(num_speakers):02d}',
+            'translation': ''.join(sentences),
+        })
+        start = end + rnd.uniform(0.0, 0.6)
+    return transcript
+
+
+def video_folder(scale, num_speakers=3):
+    """
+    Folder with the artifacts of one processed video at the given scale: audio_vocals.wav,
+    audio_instruments.wav, transcript.json, translation.json and SPEAKER/*.wav.
+    Fixtures are generated once and reused by later runs.
+    """
+    seconds = SCALES[scale]
+    folder = os.path.join(FIXTURE_DIR, scale)
+    done_marker = os.path.join(folder, '.complete')
+    if os.path.exists(done_marker):
+        return folder
+
+    os.makedirs(os.path.join(folder, 'SPEAKER'), exist_ok=True)
+    write_noise_wav(os.path.join(folder, 'audio_vocals.wav'), seconds, seed=1)
+    write_noise_wav(os.path.join(folder, 'audio_instruments.wav'), seconds, seed=2)
+    for i in range(num_speakers):
+        write_noise_wav(os.path.join(folder, 'SPEAKER', f'SPEAKER_{i:02d}.wav'), 10, seed=10 + i)
+
+    transcript = make_transcript(seconds, num_speakers=num_speakers)
+    with open(os.path.join(folder, 'transcript.json'), 'w', encoding='utf-8') as f:
+        json.dump([{key: line[key] for key in ('start', 'end', 'text', 'speaker')} for line in transcript],
+                  f, indent=2, ensure_ascii=False)
+    with open(os.path.join(folder, 'translation.json'), 'w', encoding='utf-8') as f:
+        json.dump(transcript, f, indent=2, ensure_ascii=False)
+    open(done_marker, 'w').close()
+    return folder
+
+
+def load_json(folder, name):
+    with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def work_folder(scale, name):
+    """
+    Scratch copy of a fixture folder for benchmarks that write into it.
+    Large WAVs are hard linked (they are only read), JSON files are copied.
+    """
+    source = video_folder(scale)
+    folder = os.path.join(FIXTURE_DIR, 'work', f'{name}-{scale}')
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(os.path.join(folder, 'SPEAKER'))
+    for root, _, files in os.walk(source):
+        for file in files:
+            if file.startswith('.'):
+                continue
+            src = os.path.join(root, file)
+            dst = os.path.join(folder, os.path.relpath(src, source))
+            if file.endswith('.json'):
+                shutil.copyfile(src, dst)
+            else:
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copyfile(src, dst)
+    return folder
+
+
+STUB_TTS_SECONDS = 2.5
+_stub_wav = None
+
+
+def stub_tts(text, output_path, speaker_wav=None, **kwargs):
+    """TTS backend replacement that writes a fixed-length tone for every line"""
+    global _stub_wav
+    from tools.utils import save_wav
+    if _stub_wav is None:
+        _stub_wav = tone(STUB_TTS_SECONDS)
+    save_wav(_stub_wav, output_path, SAMPLE_RATE)
@@ -0,0 +1,91 @@
+"""
+Cold-start benchmark: how long importing the pipeline entry points takes, and which heavy
+model libraries get imported along the way.
+
+Each module is imported in a fresh interpreter. Importing the pipeline must not pull in
+torch or any model library; those are loaded when a backend is first used.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --save-baselines
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.run_benchmarks import load_baselines, save_baselines
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = [
+    'tools.do_everything',
+    'tools.step010_demucs_vr',
+    'tools.step020_asr',
+    'tools.step030_translation',
+    'tools.step040_tts',
+    'tools.step050_synthesize_video',
+]
+HEAVY_MODULES = ['torch', 'torchaudio', 'demucs', 'whisperx', 'funasr', 'TTS', 'cosyvoice', 'modelscope',
+                 'pyannote', 'transformers', 'openai', 'librosa']
+
+_PROBE = """
+import json, sys, time
+t_start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - t_start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, repeat):
+    """Best import time of `module` over `repeat` fresh interpreters, and the heavy modules it imported"""
+    best, heavy = None, []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ImportError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else module)
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        best = data['seconds'] if best is None else min(best, data['seconds'])
+        heavy = data['heavy']
+    return {'seconds': best, 'heavy': heavy}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import-time benchmark for the pipeline entry points')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed slowdown before failing')
+    parser.add_argument('--save-baselines', action='store_true')
+    args = parser.parse_args(argv)
+
+    baselines = load_baselines()
+    results = {}
+    failed = False
+    print(f'{"module":<34}{"seconds":>10}{"vs base":>9}  heavy imports')
+    for module in MODULES:
+        key = f'import:{module}'
+        try:
+            result = measure(module, max(1, args.repeat))
+        except ImportError as e:
+            print(f'{module:<34}  skipped: {e}')
+            continue
+        results[key] = result
+        baseline = baselines.get(key)
+        ratio = f'{result["seconds"] / baseline["seconds"]:.2f}x' if baseline else 'new'
+        print(f'{module:<34}{result["seconds"]:>10.3f}{ratio:>9}  {", ".join(result["heavy"]) or "-"}')
+        if result['heavy']:
+            failed = True
+            print(f'  REGRESSION {key}: imports {", ".join(result["heavy"])} at import time')
+        if baseline and result['seconds'] > baseline['seconds'] * (1 + args.tolerance):
+            failed = True
+            print(f'  REGRESSION {key}: {result["seconds"]:.3f}s > baseline {baseline["seconds"]:.3f}s')
+
+    if args.save_baselines:
+        baselines.update({key: {'seconds': result['seconds']} for key, result in results.items()})
+        save_baselines(baselines)
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
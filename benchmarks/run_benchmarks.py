@@ -0,0 +1,222 @@
+"""
+Offline benchmarks for the non-model hot paths.
+
+Times transcript merging, speaker audio extraction, sentence splitting, SRT generation and
+TTS timeline assembly on synthetic 10 min / 1 h / 5 h fixtures, and compares wall time and
+peak memory against benchmarks/baselines.json. No GPU, model or network is needed; TTS is
+replaced by a stub that writes a fixed-length tone.
+
+    python -m benchmarks.run_benchmarks                      # 10m and 1h
+    python -m benchmarks.run_benchmarks --scales 10m,1h,5h --only timeline
+    python -m benchmarks.run_benchmarks --save-baselines     # record the current numbers
+
+Exits with status 1 when a benchmark is slower or uses more memory than its baseline
+by more than --tolerance.
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import sys
+import time
+
+from loguru import logger
+
+from benchmarks import fixtures
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+MB = 1024 ** 2
+# Memory growth below this is noise from the allocator, not a regression
+MEMORY_SLACK_MB = 32
+
+
+class Benchmark:
+    """
+    Args:
+        name: Benchmark name
+        prepare: Callable(scale) returning the state passed to run; not timed
+        run: Callable(state) doing the measured work
+        items: Callable(state) returning the number of items processed (lines, segments)
+    """
+
+    def __init__(self, name, prepare, run, items):
+        self.name = name
+        self.prepare = prepare
+        self.run = run
+        self.items = items
+
+
+def _transcript(scale):
+    return fixtures.load_json(fixtures.video_folder(scale), 'transcript.json')
+
+
+def _translation(scale):
+    return fixtures.load_json(fixtures.video_folder(scale), 'translation.json')
+
+
+def _merge_segments(transcript):
+    from tools.step020_asr import merge_segments
+    merge_segments(transcript)
+
+
+def _prepare_speaker_audio(scale):
+    return fixtures.work_folder(scale, 'speaker_audio'), _transcript(scale)
+
+
+def _generate_speaker_audio(state):
+    from tools.step020_asr import generate_speaker_audio
+    folder, transcript = state
+    generate_speaker_audio(folder, transcript)
+
+
+def _split_sentences(translation):
+    from tools.step030_translation import split_sentences
+    split_sentences(translation)
+
+
+def _split_text(translation):
+    from tools.step050_synthesize_video import split_text
+    split_text(translation)
+
+
+def _prepare_srt(scale):
+    return fixtures.work_folder(scale, 'srt'), _translation(scale)
+
+
+def _generate_srt(state):
+    from tools.step050_synthesize_video import generate_srt
+    folder, translation = state
+    generate_srt(translation, os.path.join(folder, 'subtitles.srt'))
+
+
+def _prepare_timeline(scale):
+    folder = fixtures.work_folder(scale, 'timeline')
+    return folder, fixtures.load_json(folder, 'translation.json')
+
+
+def _timeline(state):
+    from tools import backends, step040_tts
+    folder, _ = state
+    # Stand-in for XTTS so only the timeline assembly around it is measured
+    backends.register('tts', 'xtts', 'benchmarks.fixtures', 'stub_tts')
+    step040_tts._generate_wavs('xtts', folder, 'English', None)
+
+
+BENCHMARKS = [
+    Benchmark('merge_segments', lambda scale: copy.deepcopy(_transcript(scale)), _merge_segments, len),
+    Benchmark('generate_speaker_audio', _prepare_speaker_audio, _generate_speaker_audio,
+              lambda state: len(state[1])),
+    Benchmark('split_sentences', _translation, _split_sentences, len),
+    Benchmark('split_text', _translation, _split_text, len),
+    Benchmark('generate_srt', _prepare_srt, _generate_srt, lambda state: len(state[1])),
+    Benchmark('timeline', _prepare_timeline, _timeline, lambda state: len(state[1])),
+]
+
+
+def measure(benchmark, scale, repeat):
+    """Best wall time and largest peak RSS growth over `repeat` runs"""
+    from tools.metrics import PeakSampler
+    seconds, peak_bytes = None, 0
+    items = 0
+    for _ in range(repeat):
+        state = benchmark.prepare(scale)
+        items = benchmark.items(state)
+        gc.collect()
+        with PeakSampler(interval=0.01) as sampler:
+            rss_before = sampler.peak_rss
+            t_start = time.perf_counter()
+            benchmark.run(state)
+            elapsed = time.perf_counter() - t_start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        peak_bytes = max(peak_bytes, sampler.peak_rss - rss_before)
+        del state
+    audio_seconds = fixtures.SCALES[scale]
+    return {
+        'seconds': seconds,
+        'peak_mb': peak_bytes / MB,
+        'items': items,
+        'items_per_second': items / seconds if seconds else None,
+        'realtime_speed': audio_seconds / seconds if seconds else None,
+    }
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baselines(baselines):
+    with open(BASELINES_PATH, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(result, baseline, tolerance):
+    """List of regressions of result against baseline"""
+    regressions = []
+    if baseline is None:
+        return regressions
+    if result['seconds'] > baseline['seconds'] * (1 + tolerance):
+        regressions.append(f"time {result['seconds']:.3f}s > baseline {baseline['seconds']:.3f}s")
+    if result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance) + MEMORY_SLACK_MB:
+        regressions.append(f"memory {result['peak_mb']:.0f}MB > baseline {baseline['peak_mb']:.0f}MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the non-model hot paths')
+    parser.add_argument('--scales', default='10m,1h', help=f'Comma separated, from {", ".join(fixtures.SCALES)}')
+    parser.add_argument('--only', default='', help='Comma separated benchmark names')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark (5h fixtures run once)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before failing')
+    parser.add_argument('--save-baselines', action='store_true', help='Store these results as the baselines')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    scales = [scale for scale in args.scales.split(',') if scale]
+    only = {name for name in args.only.split(',') if name}
+    baselines = load_baselines()
+    results = {}
+    failed = False
+
+    print(f'{"benchmark":<24}{"scale":>6}{"seconds":>10}{"items/s":>12}{"x realtime":>12}{"peak MB":>10}'
+          f'{"vs base":>9}')
+    for scale in scales:
+        for benchmark in BENCHMARKS:
+            if only and benchmark.name not in only:
+                continue
+            key = f'{benchmark.name}@{scale}'
+            try:
+                result = measure(benchmark, scale, 1 if scale == '5h' else max(1, args.repeat))
+            except ImportError as e:
+                print(f'{benchmark.name:<24}{scale:>6}  skipped: {e}')
+                continue
+            results[key] = result
+            baseline = baselines.get(key)
+            ratio = f'{result["seconds"] / baseline["seconds"]:.2f}x' if baseline else 'new'
+            print(f'{benchmark.name:<24}{scale:>6}{result["seconds"]:>10.3f}{result["items_per_second"]:>12.0f}'
+                  f'{result["realtime_speed"]:>12.0f}{result["peak_mb"]:>10.1f}{ratio:>9}')
+            for regression in compare(result, baseline, args.tolerance):
+                failed = True
+                print(f'  REGRESSION {key}: {regression}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baselines:
+        baselines.update({key: {'seconds': result['seconds'], 'peak_mb': result['peak_mb']}
+                          for key, result in results.items()})
+        save_baselines(baselines)
+        print(f'Saved {len(results)} baselines to {BASELINES_PATH}')
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+In-memory WSOLA against the audiostretchy file round trip used before for TTS lines.
+
+Stretches a set of synthetic voice-like lines with random speed factors in the range
+adjust_audio_length uses and reports lines per second for:
+
+    audiostretchy   write the line, stretch_audio to *_adjusted.wav, read it back
+    stretch         tools.time_stretch.stretch, one line at a time
+    stretch_batch   tools.time_stretch.stretch_batch over all lines
+
+plus the output length error against the requested duration. The audiostretchy row is
+skipped when it is not installed (pip install audiostretchy).
+
+    python -m benchmarks.time_stretch
+    python -m benchmarks.time_stretch --lines 1000 --json stretch.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from benchmarks import fixtures
+
+SAMPLE_RATE = 24000
+
+
+def make_lines(count, seed=0):
+    """Voice-like lines of 0.5-6 s cut from make_mix vocals, with ratios in [0.6, 1.1]"""
+    rng = np.random.default_rng(seed)
+    vocals, _ = fixtures.make_mix(8, SAMPLE_RATE, seed)
+    lines = []
+    for _ in range(count):
+        length = int(rng.uniform(0.5, 6) * SAMPLE_RATE)
+        start = rng.integers(0, len(vocals) - length)
+        lines.append(vocals[start:start + length])
+    return lines, rng.uniform(0.6, 1.1, count)
+
+
+def run_audiostretchy(lines, ratios, folder):
+    from audiostretchy.stretch import stretch_audio
+    from scipy.io import wavfile
+    outputs = []
+    for i, (wav, ratio) in enumerate(zip(lines, ratios)):
+        path = os.path.join(folder, f'{i:04d}.wav')
+        target = path.replace('.wav', '_adjusted.wav')
+        wavfile.write(path, SAMPLE_RATE, (wav * 32767).astype(np.int16))
+        stretch_audio(path, target, ratio=ratio, sample_rate=SAMPLE_RATE)
+        _, stretched = wavfile.read(target)
+        outputs.append(stretched.astype(np.float32) / 32768)
+    return outputs
+
+
+def run_stretch(lines, ratios):
+    from tools.time_stretch import stretch
+    return [stretch(wav, ratio, SAMPLE_RATE) for wav, ratio in zip(lines, ratios)]
+
+
+def run_stretch_batch(lines, ratios):
+    from tools.time_stretch import stretch_batch
+    return stretch_batch(lines, ratios, SAMPLE_RATE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='In-memory WSOLA against the audiostretchy round trip')
+    parser.add_argument('--lines', type=int, default=300)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    lines, ratios = make_lines(args.lines)
+    audio_seconds = sum(len(wav) for wav in lines) / SAMPLE_RATE
+    folder = os.path.join(fixtures.FIXTURE_DIR, 'work', 'time-stretch')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+
+    modes = [('audiostretchy', lambda: run_audiostretchy(lines, ratios, folder)),
+             ('stretch', lambda: run_stretch(lines, ratios)),
+             ('stretch_batch', lambda: run_stretch_batch(lines, ratios))]
+    results = {}
+    print(f'{"mode":<16}{"seconds":>10}{"lines/s":>10}{"x realtime":>12}{"max length error ms":>22}')
+    for mode, run in modes:
+        try:
+            t_start = time.perf_counter()
+            outputs = run()
+            seconds = time.perf_counter() - t_start
+        except ImportError as e:
+            print(f'{mode:<16}skipped: {e}')
+            continue
+        error = max(abs(len(out) - len(wav) * ratio) for out, wav, ratio in zip(outputs, lines, ratios))
+        results[mode] = {'seconds': seconds, 'lines_per_second': args.lines / seconds,
+                         'realtime_speed': audio_seconds / seconds,
+                         'max_length_error_ms': 1000 * error / SAMPLE_RATE}
+        print(f'{mode:<16}{seconds:>10.2f}{args.lines / seconds:>10.1f}{audio_seconds / seconds:>12.1f}'
+              f'{results[mode]["max_length_error_ms"]:>22.2f}')
+    shutil.rmtree(folder, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
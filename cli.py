@@ -0,0 +1,455 @@
+"""
+Headless batch runner for Linly-Dubbing.
+
+    python cli.py run -c config.yaml https://www.bilibili.com/video/BV1kr421M7vz/ my_video.mp4
+    python cli.py run -c config.yaml --jobs 2 --urls-file urls.txt
+    python cli.py resume -c config.yaml --jobs 2
+    python cli.py status -o videos
+
+    python cli.py submit -c config.yaml --broker redis://queue-host:6379/0 https://...
+    python cli.py worker -c config.yaml --broker redis://queue-host:6379/0 --stages separate,asr,tts
+    python cli.py worker -c config.yaml --broker redis://queue-host:6379/0 --stages translate,synthesize
+
+The config file (YAML or JSON) uses the same keys as the settings tab of the GUI, e.g.
+
+    video_folder: videos
+    asr_model: WhisperX
+    translation_method: LLM
+    tts_method: EdgeTTS
+    max_workers: 2
+
+Progress is written to stdout as JSON lines (one event per line); logs go to stderr.
+With --jobs N, videos are spread over N worker processes, each loading its own models.
+With submit/worker, each stage of each video is a task on a broker and worker nodes run
+only the stages they declare; all nodes must share the output folder.
+Exit status is 0 when every video succeeded, 1 when any failed and 2 on usage errors.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loguru import logger
+
+# (settings tab key, do_everything argument, default), defaults as in the one-click tab
+SETTINGS = [
+    ('video_folder', 'root_folder', 'videos'),
+    ('resolution', 'resolution', '1080p'),
+    ('video_count', 'num_videos', 5),
+    ('model', 'demucs_model', 'htdemucs_ft'),
+    ('device', 'device', 'auto'),
+    ('shifts', 'shifts', int(os.getenv('DEMUCS_SHIFTS', '5'))),
+    ('asr_model', 'asr_method', 'WhisperX'),
+    ('whisperx_size', 'whisper_model', 'large'),
+    ('batch_size', 'batch_size', 32),
+    ('separate_speakers', 'diarization', True),
+    ('min_speakers', 'whisper_min_speakers', None),
+    ('max_speakers', 'whisper_max_speakers', None),
+    ('translation_method', 'translation_method', 'LLM'),
+    ('target_language_translation', 'translation_target_language', '简体中文'),
+    ('tts_method', 'tts_method', 'EdgeTTS'),
+    ('target_language_tts', 'tts_target_language', '中文'),
+    ('edge_tts_voice', 'voice', 'zh-CN-XiaoxiaoNeural'),
+    ('add_subtitles', 'subtitles', True),
+    ('speed_factor', 'speed_up', 1.00),
+    ('frame_rate', 'fps', 30),
+    ('background_music', 'background_music', None),
+    ('bg_music_volume', 'bgm_volume', 0.5),
+    ('video_volume', 'video_volume', 1.0),
+    ('output_resolution', 'target_resolution', '1080p'),
+    ('max_workers', 'max_workers', 1),
+    ('max_retries', 'max_retries', 3),
+]
+_RUN_OPTIONS = ('num_videos', 'max_workers', 'max_retries')
+
+_print_lock = threading.Lock()
+
+
+def emit(event, **fields):
+    """Write one machine-readable progress event to stdout"""
+    record = {'time': round(time.time(), 3), 'event': event}
+    record.update(fields)
+    with _print_lock:
+        sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        sys.stdout.flush()
+
+
+def load_config(path):
+    if path is None:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            config = yaml.safe_load(f) or {}
+        else:
+            config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f'{path}: expected a mapping of settings')
+    return config
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def resolve_options(config, overrides=()):
+    """Map settings-tab keys to do_everything arguments, applying defaults and --set overrides"""
+    config = dict(config)
+    for override in overrides:
+        key, _, value = override.partition('=')
+        config[key.strip()] = parse_value(value)
+    known = {key for key, _, _ in SETTINGS}
+    for key in config:
+        if key not in known:
+            logger.warning(f'Ignoring unknown setting: {key}')
+    return {name: config.get(key, default) for key, name, default in SETTINGS}
+
+
+def make_job_settings(options):
+    from tools.do_everything import make_settings
+    return make_settings(**{name: value for name, value in options.items() if name not in _RUN_OPTIONS})
+
+
+def collect_inputs(args):
+    inputs = list(args.inputs)
+    if args.urls_file:
+        with open(args.urls_file, 'r', encoding='utf-8') as f:
+            inputs.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return inputs
+
+
+def expand_inputs(inputs, options):
+    """Turn URLs (videos, playlists, channels) and local files into job infos"""
+    from tools.do_everything import import_local_video
+    from tools.step000_video_downloader import get_info_list_from_url
+
+    infos = []
+    for item in inputs:
+        if os.path.isfile(item):
+            infos.append(import_local_video(item, options['root_folder']))
+            continue
+        try:
+            for info in get_info_list_from_url(item, options['num_videos']):
+                if info is None:
+                    logger.warning(f'Skipping unavailable video in {item}')
+                    continue
+                infos.append(info)
+        except Exception as e:
+            emit('input_failed', input=item, error=str(e))
+    return infos
+
+
+def video_name(info):
+    return info.get('title', info.get('id')) if isinstance(info, dict) else info
+
+
+# ---- worker processes ----------------------------------------------------------------
+
+_worker_queue = None
+_worker_stores = {}
+
+
+def _init_worker(queue):
+    global _worker_queue
+    _worker_queue = queue
+
+
+def _run_video(index, info, settings, max_retries):
+    """Process one video in a worker process; models stay resident in this process across videos"""
+    from tools.do_everything import initialize_models, job_store_path, new_job, run_job
+    from tools.job_store import JobStore
+
+    root_folder = settings['root_folder']
+    if root_folder not in _worker_stores:
+        _worker_stores[root_folder] = JobStore(job_store_path(root_folder))
+    job_store = _worker_stores[root_folder]
+
+    def progress(percent, message):
+        _worker_queue.put({'event': 'progress', 'index': index, 'video': video_name(info),
+                           'percent': percent, 'message': message, 'pid': os.getpid()})
+
+    initialize_models(settings['tts_method'], settings['asr_method'], settings['diarization'])
+    job = new_job(info, settings, job_store)
+    success, output_video, message = run_job(job, max_retries, progress, job_store)
+    return index, success, output_video, message
+
+
+def _forward_events(queue):
+    while True:
+        event = queue.get()
+        if event is None:
+            return
+        emit(event.pop('event'), **event)
+
+
+def run_in_processes(tasks, jobs, max_retries):
+    """Spread (info, settings) tasks over `jobs` worker processes"""
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    queue = manager.Queue()
+    forwarder = threading.Thread(target=_forward_events, args=(queue,), daemon=True)
+    forwarder.start()
+    results = [None] * len(tasks)
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                                 initializer=_init_worker, initargs=(queue,)) as executor:
+            futures = {executor.submit(_run_video, index, info, settings, max_retries): index
+                       for index, (info, settings) in enumerate(tasks)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    _, success, output_video, message = future.result()
+                except Exception as e:
+                    success, output_video, message = False, None, f'Worker failed: {e}'
+                results[index] = (tasks[index][0], success, output_video, message)
+                report(index, *results[index])
+    finally:
+        queue.put(None)
+        forwarder.join()
+        manager.shutdown()
+    return results
+
+
+# ---- in-process execution ------------------------------------------------------------
+
+def run_in_process(tasks, max_workers, max_retries):
+    """Run all tasks in this process through the stage pipeline"""
+    from tools.do_everything import (initialize_models, job_store_path, new_job, run_jobs_pipelined)
+    from tools.job_store import JobStore
+
+    def progress(percent, message):
+        emit('progress', percent=percent, message=message)
+
+    stores = {}
+    try:
+        jobs = []
+        for info, settings in tasks:
+            root_folder = settings['root_folder']
+            if root_folder not in stores:
+                stores[root_folder] = JobStore(job_store_path(root_folder))
+            jobs.append(new_job(info, settings, stores[root_folder]))
+        for settings in {json.dumps(job['settings'], sort_keys=True, default=str) for job in jobs}:
+            settings = json.loads(settings)
+            initialize_models(settings['tts_method'], settings['asr_method'], settings['diarization'])
+
+        results = []
+        # The job store is per output folder, so run each folder's jobs together
+        for root_folder, job_store in stores.items():
+            folder_jobs = [job for job in jobs if job['settings']['root_folder'] == root_folder]
+            results.extend(run_jobs_pipelined(folder_jobs, max_workers, max_retries, progress, job_store))
+        for index, result in enumerate(results):
+            report(index, *result)
+        return results
+    finally:
+        for job_store in stores.values():
+            job_store.close()
+
+
+def report(index, info, success, output_video, message):
+    if success:
+        emit('video_done', index=index, video=video_name(info), output_video=output_video)
+    else:
+        emit('video_failed', index=index, video=video_name(info), error=message)
+
+
+def execute(tasks, jobs, max_workers, max_retries):
+    from tools.metrics import serve_prometheus
+    serve_prometheus()
+    emit('start', videos=len(tasks), jobs=jobs)
+    t_start = time.time()
+    if not tasks:
+        results = []
+    elif jobs > 1 and len(tasks) > 1:
+        results = run_in_processes(tasks, min(jobs, len(tasks)), max_retries)
+    else:
+        results = run_in_process(tasks, max_workers, max_retries)
+    succeeded = sum(1 for _, success, _, _ in results if success)
+    emit('summary', succeeded=succeeded, failed=len(results) - succeeded,
+         seconds=round(time.time() - t_start, 3))
+    return 0 if succeeded == len(results) else 1
+
+
+# ---- commands ------------------------------------------------------------------------
+
+def cmd_run(args, options):
+    inputs = collect_inputs(args)
+    if not inputs:
+        logger.error('No URLs or video files given')
+        return 2
+    settings = make_job_settings(options)
+    infos = expand_inputs(inputs, options)
+    tasks = [(info, settings) for info in infos]
+    code = execute(tasks, args.jobs, options['max_workers'], options['max_retries'])
+    return code if infos else 1
+
+
+def cmd_resume(args, options):
+    from tools.do_everything import job_store_path
+    from tools.job_store import JobStore
+
+    job_store = JobStore(job_store_path(options['root_folder']))
+    try:
+        job_store.requeue_interrupted()
+        pending = job_store.list_jobs('pending')
+        if args.include_failed:
+            pending += job_store.list_jobs('failed')
+    finally:
+        job_store.close()
+    tasks = [(stored['info'], stored['settings']) for stored in pending]
+    return execute(tasks, args.jobs, options['max_workers'], options['max_retries'])
+
+
+def cmd_status(args, options):
+    if args.broker:
+        from tools.broker import open_broker
+        broker = open_broker(args.broker, options['root_folder'])
+        try:
+            emit('queues', stages=broker.counts())
+        finally:
+            broker.close()
+        return 0
+
+    from tools.do_everything import job_store_path
+    from tools.job_store import JobStore
+
+    path = job_store_path(options['root_folder'])
+    if not os.path.exists(path):
+        emit('status', jobs=[])
+        return 0
+    job_store = JobStore(path)
+    try:
+        for job in job_store.list_jobs():
+            emit('job', id=job['id'], video=video_name(job['info']), status=job['status'], stage=job['stage'],
+                 attempts=job['attempts'], folder=job['folder'], output_video=job['output_video'],
+                 error=(job['error'] or '').splitlines()[0] if job['error'] else None)
+    finally:
+        job_store.close()
+    return 0
+
+
+def cmd_submit(args, options):
+    from tools.broker import open_broker, submit_videos
+
+    inputs = collect_inputs(args)
+    if not inputs:
+        logger.error('No URLs or video files given')
+        return 2
+    settings = make_job_settings(options)
+    infos = expand_inputs(inputs, options)
+    broker = open_broker(args.broker, options['root_folder'])
+    try:
+        task_ids = submit_videos(broker, infos, settings)
+    finally:
+        broker.close()
+    emit('submitted', videos=len(task_ids), tasks=task_ids)
+    return 0 if infos else 1
+
+
+def cmd_worker(args, options):
+    from tools.broker import open_broker, run_worker
+    from tools.do_everything import VIDEO_STAGES
+    from tools.metrics import serve_prometheus
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()] if args.stages \
+        else [key for key, _, _, _ in VIDEO_STAGES]
+
+    def progress(event, task, message):
+        emit(event, task=task['id'], stage=task['stage'], video=video_name(task['payload']['info']),
+             **({'error': message.splitlines()[0]} if event == 'task_failed' else {'next': message}))
+
+    serve_prometheus()
+    broker = open_broker(args.broker, options['root_folder'])
+    try:
+        done, failed = run_worker(broker, stages, root_folder=args.output, worker=args.name,
+                                  max_retries=options['max_retries'], poll_interval=args.poll_interval,
+                                  idle_exit=args.exit_when_idle, progress_callback=progress)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    except KeyboardInterrupt:
+        logger.info('Worker stopped')
+        return 0
+    finally:
+        broker.close()
+    emit('summary', done=done, failed=failed)
+    return 0 if not failed else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Linly-Dubbing headless batch runner')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def common(sub):
+        sub.add_argument('-c', '--config', help='YAML or JSON settings file (settings tab keys)')
+        sub.add_argument('-o', '--output', help='Output folder, overrides video_folder')
+        sub.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                         help='Override one setting, e.g. --set tts_method=xtts')
+        sub.add_argument('--log-level', default='INFO')
+
+    run = subparsers.add_parser('run', help='Dub videos from URLs or local files')
+    common(run)
+    run.add_argument('inputs', nargs='*', help='Video, playlist or channel URLs and local .mp4 files')
+    run.add_argument('--urls-file', help='File with one URL or path per line')
+    run.add_argument('-j', '--jobs', type=int, default=1,
+                     help='Worker processes; each loads its own models (default: 1, in-process)')
+    run.set_defaults(func=cmd_run)
+
+    resume = subparsers.add_parser('resume', help='Resume unfinished jobs recorded in the output folder')
+    common(resume)
+    resume.add_argument('-j', '--jobs', type=int, default=1)
+    resume.add_argument('--include-failed', action='store_true', help='Also retry jobs that failed')
+    resume.set_defaults(func=cmd_resume)
+
+    status = subparsers.add_parser('status', help='List the jobs recorded in the output folder')
+    common(status)
+    status.add_argument('--broker', help='Show the task queues of this broker instead')
+    status.set_defaults(func=cmd_status)
+
+    submit = subparsers.add_parser('submit', help='Queue videos on a broker for stage workers')
+    common(submit)
+    submit.add_argument('inputs', nargs='*', help='Video, playlist or channel URLs and local .mp4 files')
+    submit.add_argument('--urls-file', help='File with one URL or path per line')
+    submit.add_argument('--broker', help='redis://host:port/db or a SQLite file '
+                                         '(default: broker.sqlite3 in the output folder)')
+    submit.set_defaults(func=cmd_submit)
+
+    worker = subparsers.add_parser('worker', help='Run pipeline stages taken from a broker')
+    common(worker)
+    worker.add_argument('--broker', help='redis://host:port/db or a SQLite file '
+                                         '(default: broker.sqlite3 in the output folder)')
+    worker.add_argument('--stages', help='Comma separated stages this node serves, from '
+                                         'download,separate,asr,translate,tts,synthesize (default: all)')
+    worker.add_argument('--name', help='Worker name shown on claimed tasks (default: host:pid)')
+    worker.add_argument('--poll-interval', type=float, default=2.0)
+    worker.add_argument('--exit-when-idle', action='store_true', help='Stop once no task is pending')
+    worker.set_defaults(func=cmd_worker)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level.upper())
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, ImportError) as e:
+        logger.error(f'Failed to read config: {e}')
+        return 2
+    options = resolve_options(config, args.set)
+    if args.output:
+        options['root_folder'] = args.output
+    if getattr(args, 'jobs', 1) < 1:
+        logger.error('--jobs must be at least 1')
+        return 2
+    return args.func(args, options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,7 +15,6 @@ setup(
         "scipy",
         "python-dotenv",
         "openai",
-        "audiostretchy>=0.1.0",
         "modelscope",
         "funasr",
         "accelerate>=0.20.0",
@@ -0,0 +1,141 @@
+"""
+The vectorized trellis, backtrack and merge_repeats in whisperx.alignment against the
+frame-by-frame originals from the torchaudio forced alignment tutorial, on real tensors.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+alignment = pytest.importorskip("whisperx.alignment")
+
+VOCABULARY = 32
+
+
+def reference_trellis(emission, tokens, blank_id=0):
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+    trellis = torch.empty((num_frame + 1, num_tokens + 1))
+    trellis[0, 0] = 0
+    trellis[1:, 0] = torch.cumsum(emission[:, 0], 0)
+    trellis[0, -num_tokens:] = -float("inf")
+    trellis[-num_tokens:, 0] = float("inf")
+    for t in range(num_frame):
+        trellis[t + 1, 1:] = torch.maximum(
+            trellis[t, 1:] + emission[t, blank_id],
+            trellis[t, :-1] + emission[t, tokens],
+        )
+    return trellis
+
+
+@dataclass
+class Point:
+    token_index: int
+    time_index: int
+    score: float
+
+
+def reference_backtrack(trellis, emission, tokens, blank_id=0):
+    j = trellis.size(1) - 1
+    t_start = torch.argmax(trellis[:, j]).item()
+    path = []
+    for t in range(t_start, 0, -1):
+        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
+        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
+        prob = emission[t - 1, tokens[j - 1] if changed > stayed else 0].exp().item()
+        path.append(Point(j - 1, t - 1, prob))
+        if changed > stayed:
+            j -= 1
+            if j == 0:
+                break
+    else:
+        return None
+    return path[::-1]
+
+
+def reference_merge_repeats(path, transcript):
+    i1, i2 = 0, 0
+    segments = []
+    while i1 < len(path):
+        while i2 < len(path) and path[i1].token_index == path[i2].token_index:
+            i2 += 1
+        score = sum(path[k].score for k in range(i1, i2)) / (i2 - i1)
+        segments.append((transcript[path[i1].token_index], path[i1].time_index, path[i2 - 1].time_index + 1, score))
+        i1 = i2
+    return segments
+
+
+def make_segment(rng, num_frame, num_tokens, clean):
+    """Log-softmax emission and tokens; clean segments emit each token on its own frames"""
+    tokens = rng.integers(1, VOCABULARY, num_tokens)
+    logits = rng.normal(0, 1, (num_frame, VOCABULARY)).astype(np.float32)
+    if clean:
+        bounds = np.sort(rng.choice(np.arange(1, num_frame), num_tokens - 1, replace=False))
+        for frames, token in zip(np.split(np.arange(num_frame), bounds), tokens):
+            logits[frames[:max(len(frames) // 2, 1)], token] += 6
+    return torch.log_softmax(torch.from_numpy(logits), dim=-1), tokens.tolist()
+
+
+def make_segments(seed, count=40):
+    rng = np.random.default_rng(seed)
+    segments = []
+    for _ in range(count):
+        num_frame = int(rng.integers(2, 120))
+        clean = rng.random() < 0.5
+        if clean:
+            num_tokens = int(rng.integers(1, num_frame))
+        else:
+            # Noise with about as many tokens as frames, or more: backtrack fails on many of these
+            num_tokens = int(rng.integers(max(1, num_frame * 3 // 4), num_frame + 6))
+        segments.append(make_segment(rng, num_frame, num_tokens, clean))
+    return segments
+
+
+def check_against_reference(seed):
+    """Compare every segment of one random set; returns how many backtracks failed"""
+    segments = make_segments(seed)
+    emissions = [emission for emission, _ in segments]
+    tokens_list = [tokens for _, tokens in segments]
+    trellises = alignment.get_trellis_batch(emissions, tokens_list)
+    failures = 0
+    for emission, tokens, trellis in zip(emissions, tokens_list, trellises):
+        expected_trellis = reference_trellis(emission, tokens)
+        assert np.array_equal(trellis, expected_trellis.numpy())
+        assert torch.equal(alignment.get_trellis(emission, tokens), expected_trellis)
+
+        expected = reference_backtrack(expected_trellis, emission, tokens)
+        path = alignment.backtrack(trellis, emission, tokens)
+        assert (path is None) == (expected is None)
+        if expected is None:
+            failures += 1
+            continue
+        assert path.token_index.tolist() == [p.token_index for p in expected]
+        assert path.time_index.tolist() == [p.time_index for p in expected]
+        np.testing.assert_allclose(path.score, [p.score for p in expected], rtol=1e-6, atol=0)
+
+        transcript = "".join(chr(ord("a") + token % 26) for token in tokens)
+        merged = alignment.merge_repeats(path, transcript)
+        reference = reference_merge_repeats(expected, transcript)
+        assert [(s.label, s.start, s.end) for s in merged] == [r[:3] for r in reference]
+        np.testing.assert_allclose([s.score for s in merged], [r[3] for r in reference], rtol=1e-6)
+    return failures
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_alignment_matches_reference(seed):
+    check_against_reference(seed)
+
+
+def test_backtrack_failures_match_reference():
+    # The random sets include segments the original backtrack gives up on
+    assert sum(check_against_reference(seed) for seed in range(5)) > 0
+
+
+def test_backtrack_accepts_tensor_trellis():
+    rng = np.random.default_rng(0)
+    emission, tokens = make_segment(rng, 50, 10, clean=True)
+    trellis = alignment.get_trellis(emission, tokens)
+    path = alignment.backtrack(trellis, emission, tokens)
+    expected = reference_backtrack(reference_trellis(emission, tokens), emission, tokens)
+    assert path.time_index.tolist() == [p.time_index for p in expected]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+diarize = pytest.importorskip("whisperx.diarize")
+
+
+def reference_assign_word_speakers(diarize_df, transcript_result):
+    """The per-row pandas implementation assign_word_speakers replaced (fill_nearest=False)"""
+    for seg in transcript_result["segments"]:
+        diarize_df['intersection'] = np.minimum(diarize_df['end'], seg['end']) - np.maximum(diarize_df['start'], seg['start'])
+        dia_tmp = diarize_df[diarize_df['intersection'] > 0]
+        if len(dia_tmp) > 0:
+            speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+            seg["speaker"] = speaker
+        if 'words' in seg:
+            for word in seg['words']:
+                if 'start' in word:
+                    diarize_df['intersection'] = np.minimum(diarize_df['end'], word['end']) - np.maximum(diarize_df['start'], word['start'])
+                    dia_tmp = diarize_df[diarize_df['intersection'] > 0]
+                    if len(dia_tmp) > 0:
+                        speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+                        word["speaker"] = speaker
+    return transcript_result
+
+
+def make_case(seed):
+    """
+    Diarization turns and a transcript. Times sit on a coarse grid so that speakers often
+    tie on their total overlap, and some turns span most of the track.
+    """
+    rng = np.random.default_rng(seed)
+    step = rng.choice([0.5, 0.25, 0.001])
+    num_turns = int(rng.integers(0, 60))
+    starts = np.round(rng.uniform(0, 100, num_turns) / step) * step
+    durations = np.round(rng.exponential(3, num_turns) / step) * step
+    long_turns = rng.random(num_turns) < 0.05
+    durations[long_turns] = np.round(rng.uniform(50, 200, long_turns.sum()) / step) * step
+    speakers = [f'SPEAKER_{i:02d}' for i in rng.integers(0, 5, num_turns)]
+    diarize_df = pd.DataFrame({'start': starts, 'end': starts + durations, 'speaker': speakers})
+
+    segments = []
+    for _ in range(int(rng.integers(0, 30))):
+        start = float(np.round(rng.uniform(-5, 105) / step) * step)
+        end = start + float(np.round(rng.uniform(-1, 10) / step) * step)
+        words = [{'word': 'w', 'start': start + i * 0.5, 'end': start + i * 0.5 + 0.5}
+                 for i in range(int(rng.integers(0, 6)))]
+        words.append({'word': '1'})
+        segments.append({'start': start, 'end': end, 'words': words})
+    return diarize_df, {'segments': segments}
+
+
+def assigned_speakers(transcript_result):
+    speakers = []
+    for seg in transcript_result['segments']:
+        speakers.append(seg.get('speaker'))
+        speakers.extend(word.get('speaker') for word in seg['words'])
+    return speakers
+
+
+@pytest.mark.parametrize("max_candidates", [diarize.MAX_CANDIDATES, 1, 7])
+@pytest.mark.parametrize("seed", range(40))
+def test_assign_word_speakers_matches_pandas(seed, max_candidates, monkeypatch):
+    monkeypatch.setattr(diarize, "MAX_CANDIDATES", max_candidates)
+    diarize_df, transcript = make_case(seed)
+    _, reference_transcript = make_case(seed)
+    expected = assigned_speakers(reference_assign_word_speakers(diarize_df.copy(), reference_transcript))
+    assert assigned_speakers(diarize.assign_word_speakers(diarize_df, transcript)) == expected
+
+
+def test_ties_go_to_first_speaker():
+    diarize_df = pd.DataFrame({'start': [0.0, 1.0, 0.5], 'end': [1.0, 2.0, 1.0],
+                               'speaker': ['SPEAKER_01', 'SPEAKER_00', 'SPEAKER_02']})
+    transcript = {'segments': [{'start': 0.0, 'end': 2.0, 'words': [{'word': 'a', 'start': 0.5, 'end': 1.5}]}]}
+    expected = assigned_speakers(reference_assign_word_speakers(
+        diarize_df.copy(), {'segments': [{'start': 0.0, 'end': 2.0, 'words': [{'word': 'a', 'start': 0.5, 'end': 1.5}]}]}))
+    assert assigned_speakers(diarize.assign_word_speakers(diarize_df, transcript)) == expected
@@ -175,33 +175,25 @@ def align(
     
     aligned_segments: List[SingleAlignedSegment] = []
     
-    # 2. Get prediction matrix from alignment model & align
-    for sdx, segment in enumerate(transcript):
-        
+    blank_id = 0
+    for char, code in model_dictionary.items():
+        if char == '[pad]' or char == '<pad>':
+            blank_id = code
+
+    # 2. Get prediction matrix from alignment model
+    def prepare(segment):
+        """(emission, tokens, text_clean, num_channels) of a segment, or None if it cannot be aligned"""
         t1 = segment["start"]
         t2 = segment["end"]
-        text = segment["text"]
-
-        aligned_seg: SingleAlignedSegment = {
-            "start": t1,
-            "end": t2,
-            "text": text,
-            "words": [],
-        }
-
-        if return_char_alignments:
-            aligned_seg["chars"] = []
 
         # check we can align
         if len(segment["clean_char"]) == 0:
             print(f'Failed to align segment ("{segment["text"]}"): no characters in this segment found in model dictionary, resorting to original...')
-            aligned_segments.append(aligned_seg)
-            continue
+            return None
 
         if t1 >= MAX_DURATION:
             print(f'Failed to align segment ("{segment["text"]}"): original start time longer than audio duration, skipping...')
-            aligned_segments.append(aligned_seg)
-            continue
+            return None
 
         text_clean = "".join(segment["clean_char"])
         tokens = [model_dictionary[c] for c in text_clean]
@@ -230,13 +222,44 @@ def align(
             emissions = torch.log_softmax(emissions, dim=-1)
 
         emission = emissions[0].cpu().detach()
+        return emission, tokens, text_clean, waveform_segment.size(0)
+
+    def prepared_segments():
+        """
+        (prepared segment, trellis) per segment. Emissions and trellises exist for one group of
+        TRELLIS_BATCH_SIZE segments at a time, so memory does not grow with the audio length.
+        """
+        segments = list(transcript)
+        for group_start in range(0, len(segments), TRELLIS_BATCH_SIZE):
+            items = [prepare(segment) for segment in segments[group_start:group_start + TRELLIS_BATCH_SIZE]]
+            alignable = [item for item in items if item is not None]
+            trellises = iter(get_trellis_batch([item[0] for item in alignable], [item[1] for item in alignable],
+                                               blank_id))
+            for item in items:
+                yield item, (next(trellises) if item is not None else None)
+
+    # 3. Align, one group of segments at a time
+    for sdx, (segment, (item, trellis)) in enumerate(zip(transcript, prepared_segments())):
+        
+        t1 = segment["start"]
+        t2 = segment["end"]
+        text = segment["text"]
+
+        aligned_seg: SingleAlignedSegment = {
+            "start": t1,
+            "end": t2,
+            "text": text,
+            "words": [],
+        }
+
+        if return_char_alignments:
+            aligned_seg["chars"] = []
 
-        blank_id = 0
-        for char, code in model_dictionary.items():
-            if char == '[pad]' or char == '<pad>':
-                blank_id = code
+        if item is None:
+            aligned_segments.append(aligned_seg)
+            continue
 
-        trellis = get_trellis(emission, tokens, blank_id)
+        emission, tokens, text_clean, num_channels = item
         path = backtrack(trellis, emission, tokens, blank_id)
 
         if path is None:
@@ -247,7 +270,7 @@ def align(
         char_segments = merge_repeats(path, text_clean)
 
         duration = t2 -t1
-        ratio = duration * waveform_segment.size(0) / (trellis.size(0) - 1)
+        ratio = duration * num_channels / (trellis.shape[0] - 1)
 
         # assign timestamps to aligned characters
         char_segments_arr = []
@@ -353,33 +376,74 @@ def align(
 """
 source: https://pytorch.org/tutorials/intermediate/forced_alignment_with_torchaudio_tutorial.html
 """
+# Segments whose trellises are filled together
+TRELLIS_BATCH_SIZE = 32
+
+
 def get_trellis(emission, tokens, blank_id=0):
-    num_frame = emission.size(0)
-    num_tokens = len(tokens)
-
-    # Trellis has extra diemsions for both time axis and tokens.
-    # The extra dim for tokens represents <SoS> (start-of-sentence)
-    # The extra dim for time axis is for simplification of the code.
-    trellis = torch.empty((num_frame + 1, num_tokens + 1))
-    trellis[0, 0] = 0
-    trellis[1:, 0] = torch.cumsum(emission[:, 0], 0)
-    trellis[0, -num_tokens:] = -float("inf")
-    trellis[-num_tokens:, 0] = float("inf")
-
-    for t in range(num_frame):
-        trellis[t + 1, 1:] = torch.maximum(
-            # Score for staying at the same token
-            trellis[t, 1:] + emission[t, blank_id],
-            # Score for changing to the next token
-            trellis[t, :-1] + emission[t, tokens],
-        )
-    return trellis
+    return torch.from_numpy(get_trellis_batch([emission], [tokens], blank_id)[0])
+
+
+def get_trellis_batch(emissions, tokens_list, blank_id=0):
+    """
+    Trellises of several segments, filled together: segments of similar length are padded
+    into one array and each time step updates all of them with one vectorized operation.
+    Each segment gets exactly the values of filling its trellis alone, frame by frame.
+    Returns float32 numpy arrays of shape (num_frame + 1, num_tokens + 1).
+    """
+    trellises = [None] * len(emissions)
+    order = sorted(range(len(emissions)), key=lambda i: emissions[i].shape[0])
+    for group_start in range(0, len(order), TRELLIS_BATCH_SIZE):
+        group = order[group_start:group_start + TRELLIS_BATCH_SIZE]
+        num_frames = [emissions[i].shape[0] for i in group]
+        num_tokens = [len(tokens_list[i]) for i in group]
+        max_frame, max_tokens = max(num_frames), max(num_tokens)
+
+        # Blank and token emissions gathered once instead of once per frame
+        blank = np.zeros((len(group), max_frame), dtype=np.float32)
+        token_emission = np.zeros((len(group), max_frame, max_tokens), dtype=np.float32)
+        trellis = np.empty((len(group), max_frame + 1, max_tokens + 1), dtype=np.float32)
+        for row, i in enumerate(group):
+            emission = emissions[i]
+            tokens = tokens_list[i]
+            num_frame, num_token = num_frames[row], num_tokens[row]
+            blank[row, :num_frame] = emission[:, blank_id].numpy()
+            token_emission[row, :num_frame, :num_token] = emission[:, tokens].numpy()
+            # Trellis has extra diemsions for both time axis and tokens.
+            # The extra dim for tokens represents <SoS> (start-of-sentence)
+            # The extra dim for time axis is for simplification of the code.
+            view = trellis[row, :num_frame + 1, :num_token + 1]
+            view[0, 0] = 0
+            view[1:, 0] = torch.cumsum(emission[:, 0], 0).numpy()
+            view[0, -num_token:] = -np.inf
+            view[-num_token:, 0] = np.inf
+            # Padding rows and columns never feed into a segment's own cells
+            trellis[row, num_frame + 1:, 0] = 0
+            trellis[row, 0, num_token + 1:] = -np.inf
+
+        for t in range(max_frame):
+            np.maximum(
+                # Score for staying at the same token
+                trellis[:, t, 1:] + blank[:, t, None],
+                # Score for changing to the next token
+                trellis[:, t, :-1] + token_emission[:, t],
+                out=trellis[:, t + 1, 1:],
+            )
+        for row, i in enumerate(group):
+            trellises[i] = trellis[row, :num_frames[row] + 1, :num_tokens[row] + 1].copy()
+    return trellises
+
 
 @dataclass
-class Point:
-    token_index: int
-    time_index: int
-    score: float
+class Path:
+    """Alignment path as arrays, one entry per frame: token index, frame index and frame probability"""
+    token_index: np.ndarray
+    time_index: np.ndarray
+    score: np.ndarray
+
+    def __len__(self):
+        return len(self.time_index)
+
 
 def backtrack(trellis, emission, tokens, blank_id=0):
     # Note:
@@ -389,33 +453,42 @@ def backtrack(trellis, emission, tokens, blank_id=0):
     # the corresponding index in emission is `T-1`.
     # Similarly, when referring to token index `J` in trellis,
     # the corresponding index in transcript is `J-1`.
-    j = trellis.size(1) - 1
-    t_start = torch.argmax(trellis[:, j]).item()
-
-    path = []
-    for t in range(t_start, 0, -1):
-        # 1. Figure out if the current position was stay or change
-        # Note (again):
-        # `emission[J-1]` is the emission at time frame `J` of trellis dimension.
-        # Score for token staying the same from time frame J-1 to T.
-        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
-        # Score for token changing from C-1 at T-1 to J at T.
-        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
-
-        # 2. Store the path with frame-wise probability.
-        prob = emission[t - 1, tokens[j - 1] if changed > stayed else 0].exp().item()
-        # Return token index and time index in non-trellis coordinate.
-        path.append(Point(j - 1, t - 1, prob))
-
-        # 3. Update the token
-        if changed > stayed:
-            j -= 1
-            if j == 0:
-                break
-    else:
-        # failed
-        return None
-    return path[::-1]
+    trellis = trellis.numpy() if torch.is_tensor(trellis) else trellis
+    scores = emission.numpy()
+    j = trellis.shape[1] - 1
+    t_start = int(np.argmax(trellis[:, j]))
+    tokens = np.asarray(tokens, dtype=np.int64)
+
+    # Whether the path changed token into trellis cell (t, j), for all cells at once:
+    # changed[t - 1, j - 1] compares the score for token J-1 at T-1 changing to J at T
+    # with the score for staying at J from T-1 to T.
+    changed = (trellis[:t_start, :-1] + scores[:t_start, tokens]) > \
+        (trellis[:t_start, 1:] + scores[:t_start, blank_id, None])
+
+    # Walk back one token at a time: stay at token J until the last frame where it was entered
+    token_index, time_start, time_end = [], [], []
+    t = t_start
+    while j > 0:
+        entered = np.flatnonzero(changed[:t, j - 1])
+        if len(entered) == 0:
+            # failed
+            return None
+        t_change = int(entered[-1]) + 1
+        token_index.append(j - 1)
+        time_start.append(t_change - 1)
+        time_end.append(t)
+        t = t_change - 1
+        j -= 1
+
+    token_index, time_start, time_end = token_index[::-1], np.array(time_start[::-1]), np.array(time_end[::-1])
+    lengths = time_end - time_start
+    path_tokens = np.repeat(token_index, lengths)
+    path_times = np.arange(time_start[0], time_end[-1])
+    # Frame-wise probability: of the token where it changed, of emission 0 where it stayed
+    columns = np.zeros(len(path_times), dtype=np.int64)
+    columns[np.cumsum(lengths) - lengths] = tokens[token_index]
+    probs = emission[torch.from_numpy(path_times), torch.from_numpy(columns)].exp().numpy()
+    return Path(path_tokens, path_times, probs)
 
 # Merge the labels
 @dataclass
@@ -433,21 +506,23 @@ class Segment:
         return self.end - self.start
 
 def merge_repeats(path, transcript):
-    i1, i2 = 0, 0
+    """Characters of the path: one segment per run of frames on the same token"""
+    run_starts = np.flatnonzero(np.diff(path.token_index, prepend=-1))
+    run_ends = np.append(run_starts[1:], len(path))
+    token_index = path.token_index.tolist()
+    time_index = path.time_index.tolist()
+    scores = path.score.tolist()
     segments = []
-    while i1 < len(path):
-        while i2 < len(path) and path[i1].token_index == path[i2].token_index:
-            i2 += 1
-        score = sum(path[k].score for k in range(i1, i2)) / (i2 - i1)
+    for i1, i2 in zip(run_starts.tolist(), run_ends.tolist()):
+        score = sum(scores[i1:i2]) / (i2 - i1)
         segments.append(
             Segment(
-                transcript[path[i1].token_index],
-                path[i1].time_index,
-                path[i2 - 1].time_index + 1,
+                transcript[token_index[i1]],
+                time_index[i1],
+                time_index[i2 - 1] + 1,
                 score,
             )
         )
-        i1 = i2
     return segments
 
 def merge_words(segments, separator="|"):
@@ -6,6 +6,10 @@ import torch
 
 from .audio import load_audio, SAMPLE_RATE
 
+# Most (interval, turn) candidate pairs expanded at once; one long turn makes every later
+# interval a candidate of it, so the intervals are resolved in chunks of about this many pairs
+MAX_CANDIDATES = 1 << 20
+
 
 class DiarizationPipeline:
     def __init__(
@@ -33,6 +37,108 @@ class DiarizationPipeline:
 
 
 def assign_word_speakers(diarize_df, transcript_result, fill_nearest=False):
+    """
+    Give every segment and aligned word the speaker with the most overlap with it. Without
+    fill_nearest all segments and words are resolved at once against a sorted interval index
+    of the diarization turns, with the same sums and tie-breaking as the per-row pandas
+    groupby; fill_nearest scores every turn, including non-overlapping ones, per row.
+    """
+    if fill_nearest:
+        return _assign_word_speakers_nearest(diarize_df, transcript_result)
+    queries = []
+    for seg in transcript_result["segments"]:
+        queries.append(seg)
+        if 'words' in seg:
+            queries.extend(word for word in seg['words'] if 'start' in word)
+    starts = np.array([query['start'] for query in queries], dtype=np.float64)
+    ends = np.array([query['end'] for query in queries], dtype=np.float64)
+    for query, speaker in zip(queries, _dominant_speakers(diarize_df, starts, ends)):
+        if speaker is not None:
+            query["speaker"] = speaker
+    return transcript_result
+
+
+def _dominant_speakers(diarize_df, starts, ends):
+    """Speaker with the largest total overlap for each [start, end] interval, None without overlap"""
+    result = [None] * len(starts)
+    if len(diarize_df) == 0 or len(starts) == 0:
+        return result
+    turn_start = diarize_df['start'].to_numpy(dtype=np.float64)
+    turn_end = diarize_df['end'].to_numpy(dtype=np.float64)
+    # groupby orders speakers by label; the codes follow that order
+    labels, codes = np.unique(diarize_df['speaker'].to_numpy(), return_inverse=True)
+
+    # Turns sorted by start: those overlapping [s, e) lie between the first turn whose running
+    # maximum end passes s and the first turn starting at or after e
+    order = np.argsort(turn_start, kind='stable')
+    sorted_start = turn_start[order]
+    max_end = np.maximum.accumulate(turn_end[order])
+    lo = np.searchsorted(max_end, starts, side='right')
+    hi = np.searchsorted(sorted_start, ends, side='left')
+    counts = np.maximum(hi - lo, 0)
+    total = np.cumsum(counts)
+    first = 0
+    while first < len(starts):
+        done = total[first - 1] if first else 0
+        last = max(int(np.searchsorted(total, done + MAX_CANDIDATES, side='right')), first + 1)
+        chunk = np.arange(first, last)
+        query = np.repeat(chunk, counts[chunk])
+        offsets = np.arange(len(query)) - np.repeat(total[chunk] - counts[chunk] - done, counts[chunk])
+        turn = order[np.repeat(lo[chunk], counts[chunk]) + offsets]
+        _resolve_candidates(result, labels, codes, turn_start, turn_end, starts, ends, query, turn)
+        first = last
+    return result
+
+
+def _resolve_candidates(result, labels, codes, turn_start, turn_end, starts, ends, query, turn):
+    """Fill in the dominant speaker of the intervals in `query` from their candidate turns"""
+    intersection = np.minimum(turn_end[turn], ends[query]) - np.maximum(turn_start[turn], starts[query])
+    hit = intersection > 0
+    query, turn, intersection = query[hit], turn[hit], intersection[hit]
+    if len(query) == 0:
+        return
+
+    # Sum the overlaps per (interval, speaker) in DataFrame row order with the compensated
+    # summation pandas uses, so near-ties resolve exactly as before
+    code = codes[turn]
+    pair_order = np.lexsort((turn, code, query))
+    query, code, intersection = query[pair_order], code[pair_order], intersection[pair_order]
+    new_group = np.ones(len(query), dtype=bool)
+    new_group[1:] = (query[1:] != query[:-1]) | (code[1:] != code[:-1])
+    group = np.cumsum(new_group) - 1
+    group_start = np.flatnonzero(new_group)
+    position = np.arange(len(query)) - group_start[group]
+    sums = np.zeros(len(group_start))
+    compensation = np.zeros(len(group_start))
+    for rank in range(position.max() + 1):
+        index = np.flatnonzero(position == rank)
+        g = group[index]
+        y = intersection[index] - compensation[g]
+        t = sums[g] + y
+        c = t - sums[g] - y
+        c[np.isnan(c)] = 0
+        compensation[g] = c
+        sums[g] = t
+
+    # Largest sum per interval; the groups of an interval are in label order, as in groupby
+    group_query, group_code = query[group_start], code[group_start]
+    new_interval = np.ones(len(group_query), dtype=bool)
+    new_interval[1:] = group_query[1:] != group_query[:-1]
+    interval_start = np.flatnonzero(new_interval)
+    interval_end = np.append(interval_start[1:], len(group_query))
+    top = np.maximum.reduceat(sums, interval_start)
+    tied = np.add.reduceat(sums == top[np.cumsum(new_interval) - 1], interval_start) > 1
+    best = np.lexsort((group_code, -sums, group_query))[interval_start]
+    for g, a, b, is_tied in zip(best, interval_start, interval_end, tied):
+        if is_tied:
+            # Which of the tied speakers wins depends on the unstable sort of sort_values: ask it
+            result[group_query[a]] = pd.Series(sums[a:b], index=labels[group_code[a:b]]) \
+                .sort_values(ascending=False).index[0]
+        else:
+            result[group_query[a]] = labels[group_code[g]]
+
+
+def _assign_word_speakers_nearest(diarize_df, transcript_result, fill_nearest=True):
     transcript_segments = transcript_result["segments"]
     for seg in transcript_segments:
         # assign speaker to segment (if any)
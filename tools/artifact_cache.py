@@ -0,0 +1,326 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from loguru import logger
+
+from .metrics import count as count_metric
+
+# Shared content-addressed store, one directory per stage key
+CACHE_DIR = os.getenv('ARTIFACT_CACHE_DIR', 'cache/artifacts')
+# Set ARTIFACT_CACHE=0 to keep per-folder staleness tracking but disable the shared store
+CACHE_ENABLED = os.getenv('ARTIFACT_CACHE', '1') != '0'
+# Per-video record of which stage key produced which artifact
+MANIFEST_NAME = '.artifacts.json'
+# Per-video copies of the inputs a stage rewrites in place, as their producer wrote them
+PRISTINE_DIR = '.pristine'
+
+# Small text artifacts are copied rather than hard linked, since they get rewritten in place
+_COPY_EXTENSIONS = ('.json', '.srt', '.txt')
+
+_digest_memo = {}
+_folder_locks = {}
+_folder_locks_guard = threading.Lock()
+
+
+def _folder_lock(folder):
+    folder = os.path.abspath(folder)
+    with _folder_locks_guard:
+        if folder not in _folder_locks:
+            _folder_locks[folder] = threading.RLock()
+        return _folder_locks[folder]
+
+
+def _hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digest(path):
+    """
+    Content hash of a file or directory.
+    Results are memoised by (path, size, mtime) so unchanged files are hashed once per process.
+    """
+    if os.path.isdir(path):
+        entries = []
+        for name in sorted(os.listdir(path)):
+            entries.append(f'{name}:{file_digest(os.path.join(path, name))}')
+        return _hash_text('\n'.join(entries))
+
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _digest_memo.get(memo_key)
+    if digest is None:
+        digest = _sha256_file(path)
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def load_manifest(folder):
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable artifact manifest {manifest_path}: {e}')
+            manifest = {}
+    else:
+        manifest = {}
+    manifest.setdefault('stages', {})
+    manifest.setdefault('artifacts', {})
+    manifest.setdefault('digests', {})
+    manifest.setdefault('pristine', {})
+    return manifest
+
+
+def save_manifest(folder, manifest):
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    tmp_path = f'{manifest_path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def _content_digest(folder, name, manifest):
+    """Content digest of an input artifact, reusing the digest stored in the manifest when unchanged"""
+    path = os.path.join(folder, name)
+    if os.path.isdir(path):
+        return file_digest(path)
+    stat = os.stat(path)
+    recorded = manifest['digests'].get(name)
+    if recorded and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns:
+        return recorded['sha256']
+    digest = file_digest(path)
+    manifest['digests'][name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+
+def artifact_identity(folder, name, manifest):
+    """
+    Identity of an input artifact.
+    Artifacts produced by a cached stage are identified by the stage key that produced them,
+    everything else (downloads, uploads, legacy outputs) by content hash.
+    """
+    path = os.path.join(folder, name)
+    if not os.path.exists(path):
+        return 'missing'
+    producer = manifest['artifacts'].get(name)
+    if producer:
+        return producer
+    return 'sha256:' + _content_digest(folder, name, manifest)
+
+
+def stage_key(folder, stage, inputs, params, manifest=None):
+    """Hash of the stage name, the identities of its input artifacts and its parameters"""
+    if manifest is None:
+        manifest = load_manifest(folder)
+    payload = {
+        'stage': stage,
+        'inputs': {name: artifact_identity(folder, name, manifest) for name in sorted(inputs)},
+        'params': params,
+    }
+    return _hash_text(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def _store_path(key):
+    return os.path.join(CACHE_DIR, key[:2], key)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _link_or_copy(src, dst):
+    """Hard link src to dst when possible, falling back to a copy (e.g. across filesystems)"""
+    if os.path.isdir(src):
+        os.makedirs(dst, exist_ok=True)
+        for name in os.listdir(src):
+            _link_or_copy(os.path.join(src, name), os.path.join(dst, name))
+        return
+    _remove(dst)
+    if src.endswith(_COPY_EXTENSIONS):
+        shutil.copy2(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _copy(src, dst):
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def _store_outputs(folder, key, outputs):
+    """Copy the outputs of a stage into the shared store (atomically, first writer wins)"""
+    final_path = _store_path(key)
+    if os.path.isdir(final_path):
+        return
+    tmp_path = f'{final_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.makedirs(tmp_path)
+        for name in outputs:
+            _copy(os.path.join(folder, name), os.path.join(tmp_path, name))
+        os.rename(tmp_path, final_path)
+    except OSError as e:
+        if not os.path.isdir(final_path):
+            logger.warning(f'Failed to store artifacts for {folder}: {e}')
+    finally:
+        _remove(tmp_path)
+
+
+def _fetch_outputs(folder, key, outputs):
+    """Link the outputs of a stage from the shared store into the video folder"""
+    store_path = _store_path(key)
+    if not all(os.path.exists(os.path.join(store_path, name)) for name in outputs):
+        return False
+    for name in outputs:
+        _link_or_copy(os.path.join(store_path, name), os.path.join(folder, name))
+    return True
+
+
+def _keep_pristine(folder, name, manifest):
+    """Copy an input a stage is about to rewrite in place, unless this version is copied already"""
+    producer = manifest['artifacts'].get(name)
+    pristine = os.path.join(folder, PRISTINE_DIR, name)
+    if not producer or (manifest['pristine'].get(name) == producer and os.path.exists(pristine)):
+        return
+    os.makedirs(os.path.dirname(pristine), exist_ok=True)
+    _remove(pristine)
+    _copy(os.path.join(folder, name), pristine)
+    manifest['pristine'][name] = producer
+
+
+def _restore_input(folder, name, manifest):
+    """
+    Put back the pristine version of an input that a stage rewrites in place: the copy kept
+    in the video folder, or the one in the shared store.
+    """
+    producer = manifest['artifacts'].get(name)
+    if not producer or ':' not in producer:
+        return
+    stored = os.path.join(folder, PRISTINE_DIR, name)
+    if manifest['pristine'].get(name) != producer or not os.path.exists(stored):
+        stored = os.path.join(_store_path(producer.split(':', 1)[1]), name)
+    if os.path.exists(stored):
+        dst = os.path.join(folder, name)
+        _remove(dst)
+        _copy(stored, dst)
+
+
+def _record(folder, manifest, stage, key, inputs, outputs, complete):
+    manifest['stages'][stage] = {'key': key, 'outputs': list(outputs), 'complete': complete}
+    if complete:
+        for name in outputs:
+            # Inputs rewritten in place keep the identity of their original producer
+            if name not in inputs:
+                manifest['artifacts'][name] = f'{stage}:{key}'
+                manifest['digests'].pop(name, None)
+    save_manifest(folder, manifest)
+
+
+def stage_pending(folder, stage, inputs, params, outputs):
+    """True if cached_stage would have to run compute, i.e. the outputs are neither up to date nor stored"""
+    inputs = [name for name in inputs if os.path.exists(os.path.join(folder, name))]
+    with _folder_lock(folder):
+        manifest = load_manifest(folder)
+        key = stage_key(folder, stage, inputs, params, manifest)
+        record = manifest['stages'].get(stage)
+        if all(os.path.exists(os.path.join(folder, name)) for name in outputs):
+            if record is None or (record['key'] == key and record.get('complete')):
+                return False
+        return not (CACHE_ENABLED and all(os.path.exists(os.path.join(_store_path(key), name)) for name in outputs))
+
+
+def cached_stage(folder, stage, inputs, params, outputs, compute):
+    """
+    Run `compute` for one stage of one video folder unless its outputs are up to date.
+
+    The stage key hashes the identities of the input artifacts and the stage parameters, so
+    changing a model, a voice or an upstream artifact invalidates this stage and, through the
+    recorded identities, every stage downstream of it. Finished outputs are stored once in the
+    shared store and linked into other folders with the same inputs and parameters.
+
+    Args:
+        folder: Video folder
+        stage: Stage name, e.g. 'separate'
+        inputs: Artifact names (relative to folder) the stage reads
+        params: JSON-serialisable dict of parameters that influence the outputs
+        outputs: Artifact names (files or directories) the stage writes
+        compute: Callable doing the actual work
+
+    Returns:
+        (status, result): status is 'fresh' (outputs already up to date), 'hit' (linked from the
+        shared store) or 'computed'; result is the return value of compute, or None if it was skipped.
+    """
+    inputs = [name for name in inputs if os.path.exists(os.path.join(folder, name))]
+    with _folder_lock(folder):
+        manifest = load_manifest(folder)
+        key = stage_key(folder, stage, inputs, params, manifest)
+        record = manifest['stages'].get(stage)
+        outputs_exist = all(os.path.exists(os.path.join(folder, name)) for name in outputs)
+
+        if record is None and outputs_exist:
+            # Outputs from before the cache existed: adopt them instead of recomputing
+            logger.info(f'Adopting existing {stage} outputs in {folder}')
+            _record(folder, manifest, stage, key, inputs, outputs, complete=True)
+            count_metric('cache_fresh')
+            return 'fresh', None
+
+        if record is not None and record['key'] == key and record.get('complete') and outputs_exist:
+            logger.info(f'{stage} outputs up to date in {folder}')
+            count_metric('cache_fresh')
+            return 'fresh', None
+
+        if CACHE_ENABLED and _fetch_outputs(folder, key, outputs):
+            logger.info(f'{stage} outputs linked from artifact cache: {folder}')
+            _record(folder, manifest, stage, key, inputs, outputs, complete=True)
+            count_metric('cache_hit')
+            return 'hit', None
+
+        if record is not None and record['key'] != key:
+            # Parameters or inputs changed: drop the stale outputs before recomputing
+            logger.info(f'{stage} inputs or parameters changed, recomputing in {folder}')
+            for name in outputs:
+                if name not in inputs:
+                    _remove(os.path.join(folder, name))
+        for name in outputs:
+            if name in inputs:
+                # A stage that ran before may have rewritten it already
+                if record is not None:
+                    _restore_input(folder, name, manifest)
+                _keep_pristine(folder, name, manifest)
+        _record(folder, manifest, stage, key, inputs, outputs, complete=False)
+
+    count_metric('cache_miss')
+    result = compute()
+
+    with _folder_lock(folder):
+        manifest = load_manifest(folder)
+        if all(os.path.exists(os.path.join(folder, name)) for name in outputs):
+            if CACHE_ENABLED:
+                _store_outputs(folder, key, outputs)
+            _record(folder, manifest, stage, key, inputs, outputs, complete=True)
+        else:
+            logger.warning(f'{stage} did not produce all of {outputs} in {folder}')
+    return 'computed', result
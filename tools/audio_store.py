@@ -0,0 +1,304 @@
+"""
+Process-wide store of decoded audio. Every stage asks for the (path, sample rate, channels)
+variant it needs and the file is decoded and resampled once; later requests for the same
+variant are served from memory. Long variants are spilled to .npy files and memory-mapped,
+so a five hour track does not sit in RAM once per stage.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+from .media_io import decode_audio
+from .metrics import count, timed
+
+# In-memory budget for cached variants; memory-mapped variants count against SPILL_MAX_BYTES instead
+MAX_BYTES = float(os.getenv('AUDIO_STORE_MAX_GB', '2')) * 1024 ** 3
+# Variants longer than this are written to AUDIO_STORE_DIR and memory-mapped
+MMAP_SECONDS = float(os.getenv('AUDIO_STORE_MMAP_SECONDS', '600'))
+STORE_DIR = os.getenv('AUDIO_STORE_DIR', 'cache/audio')
+# Disk budget for the spilled variants; the least recently used spill files are deleted beyond it
+SPILL_MAX_BYTES = float(os.getenv('AUDIO_STORE_SPILL_GB', '20')) * 1024 ** 3
+# Unfinished spill files older than this are left over from a crashed process
+PART_MAX_AGE_SECONDS = 3600
+# Frames converted at a time when filling a variant
+BLOCK_SECONDS = 60
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _pcm_to_float(data):
+    """(frames, channels) or (frames,) samples of any wav dtype to float32 (channels, frames)"""
+    if data.ndim == 1:
+        data = data[:, None]
+    if data.dtype == np.uint8:
+        wav = (data.astype(np.float32) - 128) / 128
+    elif np.issubdtype(data.dtype, np.integer):
+        wav = data.astype(np.float32) / float(-np.iinfo(data.dtype).min)
+    else:
+        wav = data.astype(np.float32)
+    return wav.T
+
+
+def _decode(path):
+    """
+    Source samples and sample rate. WAV files are memory-mapped as stored, (frames, channels);
+    anything else is decoded through an ffmpeg pipe to float32 (channels, frames).
+    """
+    if path.lower().endswith('.wav'):
+        try:
+            sample_rate, data = wavfile.read(path, mmap=True)
+            return data, sample_rate, False
+        except ValueError:
+            # Compressed or extensible wav scipy does not read
+            pass
+    wav, sample_rate = decode_audio(path)
+    return wav, sample_rate, True
+
+
+def _mix(wav, channels):
+    if channels is None or channels == wav.shape[0]:
+        return wav
+    if channels == 1:
+        return wav.mean(axis=0, keepdims=True)
+    if wav.shape[0] == 1:
+        return np.repeat(wav, channels, axis=0)
+    raise ValueError(f'Cannot convert {wav.shape[0]} channels to {channels}')
+
+
+def _resampled_frames(frames, up, down):
+    return -(-frames * up // down)
+
+
+def _blocks(data, decoded, channels, up, down, block_seconds=BLOCK_SECONDS):
+    """
+    Convert, mix and resample the source block by block, yielding (output offset, samples).
+    Block starts are multiples of `down`, so each block maps to a whole number of output
+    frames; the blocks are resampled with a margin wider than the filter and the margin is
+    cut off again, which gives the same samples as resampling the whole track at once.
+    """
+    frames = data.shape[1] if decoded else data.shape[0]
+    block = max(int(block_seconds * 48000) // down, 1) * down
+    margin = (10 * max(up, down) // up // down + 2) * down if up != down else 0
+    for start in range(0, frames, block):
+        end = min(start + block, frames)
+        lo, hi = max(start - margin, 0), min(end + margin, frames)
+        wav = data[:, lo:hi] if decoded else _pcm_to_float(data[lo:hi])
+        wav = _mix(wav, channels)
+        if up != down:
+            wav = resample_poly(wav, up, down, axis=1)
+            skip = (start - lo) * up // down
+            wav = wav[:, skip:skip + _resampled_frames(end - start, up, down)]
+        yield start * up // down, wav.astype(np.float32, copy=False)
+
+
+def _source(path, sample_rate, channels):
+    """Decoded source with the resampling ratio and the (channels, frames) of the variant"""
+    data, source_rate, decoded = _decode(path)
+    sample_rate = sample_rate or source_rate
+    source_channels = data.shape[0] if decoded else (1 if data.ndim == 1 else data.shape[1])
+    source_frames = data.shape[1] if decoded else data.shape[0]
+    divisor = math.gcd(int(sample_rate), int(source_rate))
+    up, down = int(sample_rate) // divisor, int(source_rate) // divisor
+    return data, decoded, sample_rate, up, down, (channels or source_channels,
+                                                  _resampled_frames(source_frames, up, down))
+
+
+def _fill(output, data, decoded, channels, up, down):
+    for offset, wav in _blocks(data, decoded, channels, up, down):
+        output[:, offset:offset + wav.shape[1]] = wav
+
+
+class AudioStore:
+    """
+    Cache of decoded audio keyed by (file, sample rate, channels). Files are identified by
+    path, mtime and size, so a rewritten file is decoded again. Returned arrays are shared
+    between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, mmap_seconds=MMAP_SECONDS, store_dir=STORE_DIR,
+                 spill_max_bytes=SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_max_bytes = spill_max_bytes
+        self.mmap_seconds = mmap_seconds
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.key_locks = {}
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.swept = False
+
+    def load(self, path, sample_rate=None, channels=None):
+        """
+        Samples of `path` as float32 at `sample_rate` (native if None) with `channels`
+        (native if None), like librosa.load: shape (frames,) for mono, (channels, frames)
+        otherwise. Returns (samples, sample_rate).
+        """
+        real_path, mtime, size = _stamp(path)
+        key = (real_path, mtime, size, sample_rate, channels)
+        with self.lock:
+            entry = self._get(key)
+            if entry is None:
+                key_lock = self.key_locks.setdefault(key, threading.Lock())
+        if entry is not None:
+            count('audio_store_hit')
+            return entry
+        # Decode outside the store lock so other files are served meanwhile; one decode per key
+        with key_lock:
+            with self.lock:
+                entry = self._get(key)
+            if entry is None:
+                count('audio_store_miss')
+                with timed('audio', 'decode'):
+                    entry = self._load_variant(path, key)
+                self._put(key, entry)
+            else:
+                count('audio_store_hit')
+        with self.lock:
+            self.key_locks.pop(key, None)
+        return entry
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        with self.lock:
+            # A newer version of the file makes the older variants unreachable
+            for stale in [k for k in self.entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+                self._drop(stale)
+            self.entries[key] = entry
+            if isinstance(entry[0], np.memmap):
+                self.spill_bytes += entry[0].nbytes
+            else:
+                self.memory_bytes += entry[0].nbytes
+            while self.memory_bytes > self.max_bytes and len(self.entries) > 1:
+                self._drop(next(iter(self.entries)))
+            while self.spill_bytes > self.spill_max_bytes:
+                spilled = next((k for k, (wav, _) in self.entries.items()
+                                if k != key and isinstance(wav, np.memmap)), None)
+                if spilled is None:
+                    break
+                self._drop(spilled)
+
+    def _drop(self, key):
+        wav, _ = self.entries.pop(key)
+        if isinstance(wav, np.memmap):
+            self.spill_bytes -= wav.nbytes
+            spill_path = self._spill_path(key)
+            if os.path.exists(spill_path):
+                os.remove(spill_path)
+        else:
+            self.memory_bytes -= wav.nbytes
+
+    def _spill_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.store_dir, f'{digest}.npy')
+
+    def _sweep(self):
+        """
+        Delete what earlier processes left in the store directory: unfinished .part files and,
+        least recently used first, spill files beyond the disk budget. Runs once, before the
+        first spill of this process.
+        """
+        with self.lock:
+            if self.swept:
+                return
+            self.swept = True
+        spills = []
+        now = time.time()
+        for entry in os.scandir(self.store_dir):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith('.part'):
+                    if now - stat.st_mtime > PART_MAX_AGE_SECONDS:
+                        os.remove(entry.path)
+                elif entry.name.endswith('.npy'):
+                    spills.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                # Removed or still written by another process
+                pass
+        total = sum(size for _, size, _ in spills)
+        removed = 0
+        for _, size, spill_path in sorted(spills):
+            if total <= self.spill_max_bytes:
+                break
+            try:
+                os.remove(spill_path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info(f'Removed {removed} old spill files from {self.store_dir}')
+
+    def _load_variant(self, path, key):
+        data, decoded, sample_rate, up, down, (channels, frames) = _source(path, key[3], key[4])
+        spill_path = self._spill_path(key)
+        if frames > self.mmap_seconds * sample_rate:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._sweep()
+            if os.path.exists(spill_path):
+                # Reused from an earlier run; the modification time orders spills for the sweep
+                os.utime(spill_path)
+            else:
+                part_path = f'{spill_path}.{os.getpid()}.part'
+                output = np.lib.format.open_memmap(part_path, mode='w+', dtype=np.float32,
+                                                   shape=(channels, frames))
+                _fill(output, data, decoded, key[4], up, down)
+                output.flush()
+                del output
+                os.replace(part_path, spill_path)
+            logger.info(f'Memory-mapped {path} at {sample_rate} Hz, {channels} channels')
+            output = np.load(spill_path, mmap_mode='c')
+        else:
+            output = np.empty((channels, frames), dtype=np.float32)
+            _fill(output, data, decoded, key[4], up, down)
+        return (output[0] if channels == 1 else output), sample_rate
+
+    def stream(self, path, sample_rate=None, channels=None, block_seconds=5):
+        """
+        Iterate over the same samples as load() in blocks of about `block_seconds`, without
+        holding the whole variant in memory: a cached variant is sliced, anything else is
+        converted block by block from the memory-mapped source.
+        """
+        real_path, mtime, size = _stamp(path)
+        with self.lock:
+            entry = self._get((real_path, mtime, size, sample_rate, channels))
+        if entry is not None:
+            wav, sample_rate = entry
+            step = max(int(block_seconds * sample_rate), 1)
+            for start in range(0, wav.shape[-1], step):
+                yield wav[..., start:start + step]
+            return
+        data, decoded, sample_rate, up, down, (channels, _) = _source(path, sample_rate, channels)
+        for _, wav in _blocks(data, decoded, channels, up, down, block_seconds):
+            yield wav[0] if channels == 1 else wav
+
+    def invalidate(self, path):
+        """Forget every cached variant of `path`"""
+        real_path = os.path.realpath(path)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == real_path]:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._drop(key)
+
+
+audio_store = AudioStore()
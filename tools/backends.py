@@ -0,0 +1,87 @@
+import importlib
+import threading
+
+from loguru import logger
+
+
+class Backend:
+    """
+    An ASR, translation or TTS implementation living in its own step module.
+    The module (and with it torch, model libraries, API clients) is imported the first
+    time the backend is used, not when the pipeline is imported.
+
+    Args:
+        kind: 'asr', 'translation', 'tts', 'diarization' or 'language' (language detection for an ASR method)
+        name: Name shown in the UI and stored in the settings, e.g. 'WhisperX'
+        module: Module relative to the tools package, e.g. '.step021_asr_whisperx'
+        entry: Function doing the work
+        init: Optional function preloading the backend's models
+    """
+
+    def __init__(self, kind, name, module, entry, init=None):
+        self.kind = kind
+        self.name = name
+        self.module_name = module
+        self.entry = entry
+        self.init = init
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def module(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    logger.info(f'Loading {self.kind} backend {self.name}')
+                    self._module = importlib.import_module(self.module_name, __package__)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __call__(self, *args, **kwargs):
+        return getattr(self.module, self.entry)(*args, **kwargs)
+
+    def initialize(self):
+        """Preload the backend's models; no-op for API backends"""
+        if self.init is not None:
+            getattr(self.module, self.init)()
+
+
+_registry = {}
+
+
+def register(kind, name, module, entry, init=None):
+    _registry[(kind, name)] = Backend(kind, name, module, entry, init)
+
+
+def get(kind, name):
+    backend = _registry.get((kind, name))
+    if backend is None:
+        raise ValueError(f'Invalid {kind} method: {name}')
+    return backend
+
+
+def names(kind):
+    return [name for backend_kind, name in _registry if backend_kind == kind]
+
+
+register('asr', 'WhisperX', '.step021_asr_whisperx', 'whisperx_transcribe_audio', init='init_whisperx')
+register('asr', 'FunASR', '.step022_asr_funasr', 'funasr_transcribe_audio', init='init_funasr')
+register('language', 'WhisperX', '.step021_asr_whisperx', 'transcription_language')
+register('diarization', 'pyannote', '.step021_asr_whisperx', 'load_diarize_model', init='init_diarize')
+
+register('translation', 'OpenAI', '.step031_translation_openai', 'openai_response')
+register('translation', 'LLM', '.step032_translation_llm', 'llm_response')
+register('translation', 'Google Translate', '.step033_translation_translator', 'translator_response')
+register('translation', 'Bing Translate', '.step033_translation_translator', 'translator_response')
+register('translation', 'Ernie', '.step034_translation_ernie', 'ernie_response')
+register('translation', 'Qwen', '.step035_translation_qwen', 'qwen_response')
+register('translation', '阿里云-通义千问', '.step035_translation_qwen', 'qwen_response')
+register('translation', 'Ollama', '.step036_translation_ollama', 'ollama_response')
+
+register('tts', 'bytedance', '.step041_tts_bytedance', 'tts')
+register('tts', 'xtts', '.step042_tts_xtts', 'tts', init='init_TTS')
+register('tts', 'cosyvoice', '.step043_tts_cosyvoice', 'tts', init='init_cosyvoice')
+register('tts', 'EdgeTTS', '.step044_tts_edge_tts', 'tts')
@@ -0,0 +1,521 @@
+"""
+Task brokers for running the pipeline stages on several worker nodes.
+
+Every video becomes one task per stage. A worker claims tasks only for the stages it
+declares (e.g. a CPU-only box serves translate and synthesize, a GPU box separate, asr
+and tts), runs the stage and hands the video on to the next stage's queue. All nodes
+must see the same output tree (a shared or network file system); folders are passed
+relative to the output root so each node may mount it at its own path.
+
+Two brokers are provided: SQLiteBroker for a single host (or a shared file system with
+working locks) and RedisBroker for anything speaking the Redis protocol.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+from loguru import logger
+
+BROKER_NAME = 'broker.sqlite3'
+# A claimed task goes back to its queue when its worker stops renewing the lease
+LEASE_SECONDS = 300
+# Tasks whose worker died this many times are failed instead of requeued
+MAX_ATTEMPTS = 3
+
+
+class Broker:
+    """
+    Queue of stage tasks. A task is a dict {'id', 'stage', 'payload', 'attempts'}.
+    Claimed tasks are leased: a worker renews the lease while it runs the stage, and a
+    task whose lease expired (the worker crashed) is handed out again.
+    """
+
+    def submit(self, stage, payload):
+        """Queue a task for `stage`; returns its id"""
+        raise NotImplementedError
+
+    def claim(self, stages, worker, lease=LEASE_SECONDS):
+        """Claim the oldest pending task of one of `stages`, or None if there is none"""
+        raise NotImplementedError
+
+    def renew(self, task_id, lease=LEASE_SECONDS):
+        raise NotImplementedError
+
+    def complete(self, task_id, next_stage=None, payload=None, worker=None):
+        """
+        Finish a task, queueing `payload` for `next_stage` if given. With `worker`, only if that
+        worker still holds the task. Returns False if the task was no longer running under it
+        (its lease expired and it was requeued), in which case nothing is queued.
+        """
+        raise NotImplementedError
+
+    def fail(self, task_id, error, worker=None):
+        """Mark a task failed; like complete, returns False if `worker` no longer holds it"""
+        raise NotImplementedError
+
+    def release(self, task_id):
+        """Put a claimed task back into its queue (worker shutting down)"""
+        raise NotImplementedError
+
+    def requeue_expired(self, max_attempts=MAX_ATTEMPTS):
+        """Requeue tasks whose lease expired; returns how many"""
+        raise NotImplementedError
+
+    def counts(self):
+        """{stage: {status: count}}"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_pending ON tasks (status, stage, id);
+"""
+
+
+class SQLiteBroker(Broker):
+    """Broker backed by a SQLite file, for worker processes on one host"""
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        # Autocommit mode; claims use explicit IMMEDIATE transactions so two workers never get the same task
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args)
+
+    def submit(self, stage, payload):
+        now = time.time()
+        cursor = self._execute('INSERT INTO tasks (stage, payload, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                               (stage, json.dumps(payload, ensure_ascii=False), now, now))
+        return cursor.lastrowid
+
+    def claim(self, stages, worker, lease=LEASE_SECONDS):
+        stages = list(stages)
+        placeholders = ', '.join('?' * len(stages))
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    f"SELECT * FROM tasks WHERE status = 'pending' AND stage IN ({placeholders}) ORDER BY id LIMIT 1",
+                    stages).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = 'running', worker = ?, lease_until = ?, updated_at = ? "
+                        "WHERE id = ?", (worker, now + lease, now, row['id']))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return {'id': row['id'], 'stage': row['stage'], 'payload': json.loads(row['payload']),
+                'attempts': row['attempts']}
+
+    def renew(self, task_id, lease=LEASE_SECONDS):
+        now = time.time()
+        self._execute("UPDATE tasks SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                      (now + lease, now, task_id))
+
+    @staticmethod
+    def _owned(task_id, worker):
+        """WHERE clause (and its arguments) matching a task still running under `worker`"""
+        if worker is None:
+            return "id = ? AND status = 'running'", (task_id,)
+        return "id = ? AND status = 'running' AND worker = ?", (task_id, worker)
+
+    def complete(self, task_id, next_stage=None, payload=None, worker=None):
+        now = time.time()
+        where, args = self._owned(task_id, worker)
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self.conn.execute(f"UPDATE tasks SET status = 'done', error = NULL, updated_at = ? "
+                                           f"WHERE {where}", (now,) + args)
+                owned = cursor.rowcount == 1
+                if owned and next_stage is not None:
+                    self.conn.execute('INSERT INTO tasks (stage, payload, created_at, updated_at) '
+                                      'VALUES (?, ?, ?, ?)',
+                                      (next_stage, json.dumps(payload, ensure_ascii=False), now, now))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return owned
+
+    def fail(self, task_id, error, worker=None):
+        where, args = self._owned(task_id, worker)
+        cursor = self._execute(f"UPDATE tasks SET status = 'failed', error = ?, updated_at = ? WHERE {where}",
+                               (error, time.time()) + args)
+        return cursor.rowcount == 1
+
+    def release(self, task_id):
+        self._execute("UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, updated_at = ? "
+                      "WHERE id = ? AND status = 'running'", (time.time(), task_id))
+
+    def requeue_expired(self, max_attempts=MAX_ATTEMPTS):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute(
+                    "UPDATE tasks SET status = 'failed', error = 'Worker lost too many times', updated_at = ? "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts + 1 >= ?", (now, now, max_attempts))
+                cursor = self.conn.execute(
+                    "UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, "
+                    "attempts = attempts + 1, updated_at = ? WHERE status = 'running' AND lease_until < ?",
+                    (now, now))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if cursor.rowcount:
+            logger.info(f'Requeued {cursor.rowcount} tasks with expired leases')
+        return cursor.rowcount
+
+    def counts(self):
+        counts = {}
+        rows = self._execute('SELECT stage, status, COUNT(*) AS n FROM tasks GROUP BY stage, status').fetchall()
+        for row in rows:
+            counts.setdefault(row['stage'], {})[row['status']] = row['n']
+        return counts
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisBroker(Broker):
+    """
+    Broker on a Redis server, for workers spread over several hosts.
+    Only plain list, hash and sorted set commands (and WATCH/MULTI) are used, so any client
+    with the redis-py interface works, including an in-process stand-in such as fakeredis.
+
+    A claim moves the task id from the stage queue to the stage's processing list in one
+    command (LMOVE), so a worker dying right after the claim cannot lose the task: ids in a
+    processing list without a lease get one from requeue_expired and are requeued when it expires.
+
+    Args:
+        client: redis.Redis-compatible client
+        prefix: Key prefix, so several batches can share one server
+    """
+
+    def __init__(self, client, prefix='linly'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix='linly'):
+        import redis
+        return cls(redis.Redis.from_url(url), prefix)
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def _task(self, task_id):
+        data = {_text(key): _text(value) for key, value in self.client.hgetall(self._key('task', str(task_id))).items()}
+        return data or None
+
+    def _enqueue(self, pipe, stage, payload):
+        task_id = self.client.incr(self._key('next_id'))
+        pipe.hset(self._key('task', str(task_id)), mapping={
+            'stage': stage, 'payload': json.dumps(payload, ensure_ascii=False), 'status': 'pending',
+            'attempts': 0, 'created_at': time.time()})
+        pipe.sadd(self._key('stages'), stage)
+        pipe.lpush(self._key('queue', stage), task_id)
+        return task_id
+
+    def submit(self, stage, payload):
+        pipe = self.client.pipeline()
+        task_id = self._enqueue(pipe, stage, payload)
+        pipe.execute()
+        return task_id
+
+    def claim(self, stages, worker, lease=LEASE_SECONDS):
+        for stage in stages:
+            task_id = _text(self.client.lmove(self._key('queue', stage), self._key('processing', stage),
+                                              'RIGHT', 'LEFT'))
+            if task_id is None:
+                continue
+            pipe = self.client.pipeline()
+            pipe.zadd(self._key('running'), {task_id: time.time() + lease})
+            pipe.hset(self._key('task', task_id), mapping={'status': 'running', 'worker': worker})
+            pipe.execute()
+            task = self._task(task_id)
+            return {'id': int(task_id), 'stage': task['stage'], 'payload': json.loads(task['payload']),
+                    'attempts': int(task['attempts'])}
+        return None
+
+    def renew(self, task_id, lease=LEASE_SECONDS):
+        self.client.zadd(self._key('running'), {str(task_id): time.time() + lease}, xx=True)
+
+    def _finish(self, task_id, worker, status, error=None, next_stage=None, payload=None):
+        """Finish a task that is still leased (to `worker`, if given) in one transaction"""
+        from redis.exceptions import WatchError
+
+        task_id = str(task_id)
+        task_key = self._key('task', task_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(task_key, self._key('running'))
+                    task = {_text(key): _text(value) for key, value in pipe.hgetall(task_key).items()}
+                    if (task.get('status') != 'running' or pipe.zscore(self._key('running'), task_id) is None
+                            or (worker is not None and task.get('worker') != worker)):
+                        pipe.reset()
+                        return False
+                    pipe.multi()
+                    pipe.zrem(self._key('running'), task_id)
+                    pipe.lrem(self._key('processing', task['stage']), 0, task_id)
+                    pipe.hset(task_key, mapping={'status': status, 'error': error or ''})
+                    if next_stage is not None:
+                        self._enqueue(pipe, next_stage, payload)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    # A lease was renewed or the task changed meanwhile; check again
+                    continue
+
+    def complete(self, task_id, next_stage=None, payload=None, worker=None):
+        return self._finish(task_id, worker, 'done', next_stage=next_stage, payload=payload)
+
+    def fail(self, task_id, error, worker=None):
+        return self._finish(task_id, worker, 'failed', error)
+
+    def release(self, task_id):
+        task = self._task(task_id)
+        if task is None or task.get('status') != 'running':
+            return
+        pipe = self.client.pipeline()
+        pipe.zrem(self._key('running'), str(task_id))
+        pipe.lrem(self._key('processing', task['stage']), 0, task_id)
+        pipe.hset(self._key('task', str(task_id)), mapping={'status': 'pending', 'worker': ''})
+        pipe.rpush(self._key('queue', task['stage']), task_id)
+        pipe.execute()
+
+    def _lease_orphans(self, lease=LEASE_SECONDS):
+        """Give a lease to claimed ids that never got one (the claiming worker died right after LMOVE)"""
+        for stage in self.client.smembers(self._key('stages')):
+            stage = _text(stage)
+            for task_id in self.client.lrange(self._key('processing', stage), 0, -1):
+                task_id = _text(task_id)
+                if self.client.zscore(self._key('running'), task_id) is None:
+                    # NX: a claim completing meanwhile sets its own lease, which wins
+                    self.client.zadd(self._key('running'), {task_id: time.time() + lease}, nx=True)
+
+    def requeue_expired(self, max_attempts=MAX_ATTEMPTS):
+        self._lease_orphans()
+        requeued = 0
+        for task_id in self.client.zrangebyscore(self._key('running'), 0, time.time()):
+            task_id = _text(task_id)
+            # Only one node requeues a given task
+            if not self.client.zrem(self._key('running'), task_id):
+                continue
+            task = self._task(task_id)
+            if task is None:
+                continue
+            attempts = int(task['attempts']) + 1
+            pipe = self.client.pipeline()
+            pipe.lrem(self._key('processing', task['stage']), 0, task_id)
+            if attempts >= max_attempts:
+                pipe.hset(self._key('task', task_id), mapping={'status': 'failed',
+                                                               'error': 'Worker lost too many times'})
+            else:
+                pipe.hset(self._key('task', task_id), mapping={'status': 'pending', 'worker': '',
+                                                               'attempts': attempts})
+                pipe.rpush(self._key('queue', task['stage']), task_id)
+                requeued += 1
+            pipe.execute()
+        if requeued:
+            logger.info(f'Requeued {requeued} tasks with expired leases')
+        return requeued
+
+    def counts(self):
+        counts = {}
+        for key in self.client.scan_iter(match=self._key('task', '*')):
+            task = {_text(k): _text(v) for k, v in self.client.hgetall(key).items()}
+            stage_counts = counts.setdefault(task['stage'], {})
+            stage_counts[task['status']] = stage_counts.get(task['status'], 0) + 1
+        return counts
+
+
+def open_broker(url, root_folder='videos'):
+    """
+    Broker for a URL: 'redis://host:6379/0', 'sqlite:///path/broker.sqlite3', a plain path,
+    or None for broker.sqlite3 in the output root.
+    """
+    if not url:
+        return SQLiteBroker(os.path.join(root_folder, BROKER_NAME))
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker.from_url(url)
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SQLiteBroker(url)
+
+
+def _under_root(path, root_folder):
+    """`path` relative to root_folder if it lies inside it, else unchanged"""
+    root = os.path.abspath(root_folder)
+    if os.path.commonpath([root, os.path.abspath(path)]) == root:
+        return os.path.relpath(os.path.abspath(path), root)
+    return path
+
+
+def _job_payload(job, root_folder=None):
+    """
+    Broker payload of a job dict. Paths are stored relative to the output root and the
+    settings carry `root_folder` (the submitter's root) instead of this node's.
+    """
+    node_root = job['settings']['root_folder']
+    info = job['info']
+    if isinstance(info, str):
+        info = _under_root(info, node_root)
+    folder = os.path.relpath(os.path.abspath(job['folder']), os.path.abspath(node_root)) if job['folder'] else None
+    settings = dict(job['settings'], root_folder=root_folder or node_root)
+    return {'info': info, 'settings': settings, 'folder': folder, 'stage': job['stage'],
+            'output_video': _under_root(job['output_video'], node_root) if job['output_video'] else None}
+
+
+def _payload_job(payload, root_folder=None):
+    """Job dict of a broker payload, resolving paths against this node's output root"""
+    from .do_everything import new_job
+
+    settings = dict(payload['settings'])
+    if root_folder:
+        settings['root_folder'] = root_folder
+
+    def resolve(path):
+        return path if os.path.isabs(path) else os.path.join(settings['root_folder'], path)
+
+    info = payload['info']
+    if isinstance(info, str):
+        info = resolve(info)
+    job = new_job(info, settings)
+    job['folder'] = resolve(payload['folder']) if payload['folder'] else None
+    job['stage'] = payload['stage']
+    job['output_video'] = resolve(payload['output_video']) if payload['output_video'] else None
+    return job
+
+
+def submit_videos(broker, infos, settings):
+    """Queue videos at the first stage; returns the task ids"""
+    from .do_everything import VIDEO_STAGES
+
+    first_stage = VIDEO_STAGES[0][0]
+    task_ids = []
+    for info in infos:
+        job = {'info': info, 'settings': settings, 'folder': None, 'stage': '', 'output_video': None}
+        task_ids.append(broker.submit(first_stage, _job_payload(job)))
+    logger.info(f'Queued {len(task_ids)} videos for {first_stage}')
+    return task_ids
+
+
+def _renew_lease(broker, task_id, lease, stop_event):
+    while not stop_event.wait(lease / 3):
+        try:
+            broker.renew(task_id, lease)
+        except Exception as e:
+            logger.warning(f'Failed to renew lease of task {task_id}: {e}')
+
+
+def run_worker(broker, stages, root_folder=None, worker=None, max_retries=3, poll_interval=2.0,
+               lease=LEASE_SECONDS, stop_event=None, idle_exit=False, progress_callback=None):
+    """
+    Serve `stages` from the broker until stopped.
+
+    Args:
+        broker: Broker to take tasks from
+        stages: Stage names this node can run, e.g. ['translate', 'synthesize']
+        root_folder: This node's path of the shared output root; defaults to the submitter's
+        worker: Worker name recorded on claimed tasks; defaults to host:pid
+        idle_exit: Return once no task for these stages is pending
+        progress_callback: Called as progress_callback(event, task, message) after each task
+
+    Returns:
+        (tasks done, tasks failed)
+    """
+    from .do_everything import VIDEO_STAGES, run_stage
+
+    stage_keys = [key for key, _, _, _ in VIDEO_STAGES]
+    unknown = [stage for stage in stages if stage not in stage_keys]
+    if unknown:
+        raise ValueError(f'Unknown stages: {", ".join(unknown)}')
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    stop_event = stop_event or threading.Event()
+    done = failed = 0
+    logger.info(f'Worker {worker} serving stages: {", ".join(stages)}')
+
+    while not stop_event.is_set():
+        broker.requeue_expired()
+        task = broker.claim(stages, worker, lease)
+        if task is None:
+            if idle_exit:
+                break
+            stop_event.wait(poll_interval)
+            continue
+
+        stage = task['stage']
+        renew_stop = threading.Event()
+        renewer = threading.Thread(target=_renew_lease, args=(broker, task['id'], lease, renew_stop), daemon=True)
+        renewer.start()
+        try:
+            job = _payload_job(task['payload'], root_folder)
+            job = run_stage(stage, job, max_retries)
+        except KeyboardInterrupt:
+            broker.release(task['id'])
+            raise
+        except Exception as e:
+            error_msg = f'{stage} failed: {str(e)}\n{traceback.format_exc()}'
+            logger.error(f'Task {task["id"]} {error_msg}')
+            if not broker.fail(task['id'], error_msg, worker):
+                logger.warning(f'Task {task["id"]} was requeued after its lease expired, not marking it failed')
+            failed += 1
+            if progress_callback:
+                progress_callback('task_failed', task, error_msg)
+            continue
+        finally:
+            renew_stop.set()
+            renewer.join()
+
+        index = stage_keys.index(stage)
+        next_stage = stage_keys[index + 1] if index + 1 < len(stage_keys) else None
+        if not broker.complete(task['id'], next_stage, _job_payload(job, task['payload']['settings']['root_folder']),
+                               worker):
+            # Another worker owns the task now and will hand it on; queueing it here would run it twice
+            logger.warning(f'Task {task["id"]} was requeued after its lease expired, dropping this result')
+            continue
+        done += 1
+        if progress_callback:
+            progress_callback('task_done', task, job['output_video'] if next_stage is None else next_stage)
+    return done, failed
@@ -1,36 +1,29 @@
 import json
 import os
+import threading
 import time
 import traceback
+from functools import partial
 
-import torch
 from loguru import logger
 from .step000_video_downloader import get_info_list_from_url, download_single_video, get_target_folder
-from .step010_demucs_vr import separate_all_audio_under_folder, init_demucs, release_model
+from .step010_demucs_vr import SHIFTS, separate_all_audio_under_folder, init_demucs
+from .model_manager import model_registry
+from .metrics import VideoMetrics, count as count_metric, serve_prometheus, write_prometheus
 from .step020_asr import transcribe_all_audio_under_folder
-from .step021_asr_whisperx import init_whisperx, init_diarize
-from .step022_asr_funasr import init_funasr
 from .step030_translation import translate_all_transcript_under_folder
 from .step040_tts import generate_all_wavs_under_folder
-from .step042_tts_xtts import init_TTS
-from .step043_tts_cosyvoice import init_cosyvoice
 from .step050_synthesize_video import synthesize_all_video_under_folder
+from .pipeline import PipelineStage, StagePipeline
+from .job_store import JobStore
+from . import backends
+from .manifest import index_folder
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Track model initialization status
-models_initialized = {
-    'demucs': False,
-    'xtts': False,
-    'cosyvoice': False,
-    'whisperx': False,
-    'diarize': False,
-    'funasr': False
-}
-
-
 def get_available_gpu_memory():
     """Get the current available GPU memory size (GB)"""
     try:
+        import torch
         if torch.cuda.is_available():
             # Get available memory for the current device
             free_memory = torch.cuda.get_device_properties(0).total_memory - torch.cuda.memory_allocated(0)
@@ -42,54 +35,214 @@ def get_available_gpu_memory():
 
 def initialize_models(tts_method, asr_method, diarization):
     """
-    Initialize the required models.
-    Only initialize models on first call to avoid reloading.
+    Preload the required models into the model registry.
+    Models that are already resident are not loaded again; models that do not fit the
+    memory budget are evicted least recently used first and reloaded on demand.
     """
-    # Use global state to track initialized models
-    global models_initialized
+    # Only the selected backends are imported, each on first use
+    initializers = [('Demucs', init_demucs)]
+    if tts_method in ('xtts', 'cosyvoice'):
+        initializers.append((tts_method, backends.get('tts', tts_method).initialize))
+    if asr_method in ('WhisperX', 'FunASR'):
+        initializers.append((asr_method, backends.get('asr', asr_method).initialize))
+        if asr_method == 'WhisperX' and diarization:
+            initializers.append(('Diarize', backends.get('diarization', 'pyannote').initialize))
 
     with ThreadPoolExecutor() as executor:
-        try:
-            # Demucs model initialization
-            if not models_initialized['demucs']:
-                executor.submit(init_demucs)
-                models_initialized['demucs'] = True
-                logger.info("Demucs model initialization complete")
-            else:
-                logger.info("Demucs model already initialized, skipping")
-
-            # TTS model initialization
-            if tts_method == 'xtts' and not models_initialized['xtts']:
-                executor.submit(init_TTS)
-                models_initialized['xtts'] = True
-                logger.info("XTTS model initialization complete")
-            elif tts_method == 'cosyvoice' and not models_initialized['cosyvoice']:
-                executor.submit(init_cosyvoice)
-                models_initialized['cosyvoice'] = True
-                logger.info("CosyVoice model initialization complete")
-
-            # ASR model initialization
-            if asr_method == 'WhisperX':
-                if not models_initialized['whisperx']:
-                    executor.submit(init_whisperx)
-                    models_initialized['whisperx'] = True
-                    logger.info("WhisperX model initialization complete")
-                if diarization and not models_initialized['diarize']:
-                    executor.submit(init_diarize)
-                    models_initialized['diarize'] = True
-                    logger.info("Diarize model initialization complete")
-            elif asr_method == 'FunASR' and not models_initialized['funasr']:
-                executor.submit(init_funasr)
-                models_initialized['funasr'] = True
-                logger.info("FunASR model initialization complete")
+        futures = [(name, executor.submit(init)) for name, init in initializers]
+        for name, future in futures:
+            try:
+                future.result()
+                logger.info(f"{name} model initialization complete")
+            except Exception as e:
+                # The stage loads the model again on first use, so this is not fatal here
+                stack_trace = traceback.format_exc()
+                logger.warning(f"{name} model initialization failed: {str(e)}\n{stack_trace}")
+    logger.info(f"Resident models: {model_registry.loaded()}")
+
+
+# Processing stages in order: (key, progress message, progress weight, failure label)
+VIDEO_STAGES = [
+    ('download', "Downloading video...", 10, 'Video download'),
+    ('separate', "Voice separation...", 15, 'Voice separation'),
+    ('asr', "AI speech recognition...", 20, 'Speech recognition'),
+    ('translate', "Subtitle translation...", 25, 'Subtitle translation'),
+    ('tts', "AI voice synthesis...", 20, 'Voice synthesis'),
+    ('synthesize', "Video synthesis...", 10, 'Video synthesis'),
+]
+
+
+def download_stage(job, settings):
+    """Resolve the video folder, downloading the video if needed"""
+    info = job['info']
+    if isinstance(info, str) and info.endswith('.mp4'):
+        job['folder'] = os.path.dirname(info)
+        # os.rename(info, os.path.join(folder, 'download.mp4'))
+        return job
+
+    folder = get_target_folder(info, settings['root_folder'])
+    if folder is None:
+        raise Exception(f'Failed to get video target folder: {info["title"]}')
+
+    folder = download_single_video(info, settings['root_folder'], settings['resolution'])
+    if folder is None:
+        raise Exception(f'Failed to download video: {info["title"]}')
+
+    job['folder'] = folder
+    logger.info(f'Processing video: {folder}')
+    return job
+
+
+def separate_stage(job, settings):
+    status, vocals_path, _ = separate_all_audio_under_folder(
+        job['folder'], model_name=settings['demucs_model'], device=settings['device'], progress=True,
+        shifts=settings['shifts'])
+    logger.info(f'Voice separation complete: {vocals_path}')
+    return job
+
+
+def asr_stage(job, settings):
+    status, result_json = transcribe_all_audio_under_folder(
+        job['folder'], asr_method=settings['asr_method'], whisper_model_name=settings['whisper_model'],
+        device=settings['device'], batch_size=settings['batch_size'], diarization=settings['diarization'],
+        min_speakers=settings['whisper_min_speakers'],
+        max_speakers=settings['whisper_max_speakers'])
+    logger.info(f'Speech recognition complete: {status}')
+    return job
+
+
+def translate_stage(job, settings):
+    status, summary, translation = translate_all_transcript_under_folder(
+        job['folder'], method=settings['translation_method'],
+        target_language=settings['translation_target_language'])
+    logger.info(f'Subtitle translation complete: {status}')
+    return job
+
+
+def tts_stage(job, settings):
+    status, synth_path, _ = generate_all_wavs_under_folder(
+        job['folder'], method=settings['tts_method'], target_language=settings['tts_target_language'],
+        voice=settings['voice'])
+    logger.info(f'Voice synthesis complete: {synth_path}')
+    return job
+
+
+def synthesize_stage(job, settings):
+    status, output_video = synthesize_all_video_under_folder(
+        job['folder'], subtitles=settings['subtitles'], speed_up=settings['speed_up'], fps=settings['fps'],
+        resolution=settings['target_resolution'], background_music=settings['background_music'],
+        bgm_volume=settings['bgm_volume'], video_volume=settings['video_volume'])
+    job['output_video'] = output_video
+    logger.info(f'Video synthesis complete: {output_video}')
+    return job
+
+
+stage_functions = {
+    'download': download_stage,
+    'separate': separate_stage,
+    'asr': asr_stage,
+    'translate': translate_stage,
+    'tts': tts_stage,
+    'synthesize': synthesize_stage,
+}
 
-        except Exception as e:
-            stack_trace = traceback.format_exc()
-            logger.error(f"Model initialization failed: {str(e)}\n{stack_trace}")
-            # Reset initialization status on error
-            models_initialized = {key: False for key in models_initialized}
-            release_model()  # Release loaded models
-            raise
+
+def make_settings(root_folder, resolution,
+                  demucs_model, device, shifts,
+                  asr_method, whisper_model, batch_size, diarization, whisper_min_speakers, whisper_max_speakers,
+                  translation_method, translation_target_language,
+                  tts_method, tts_target_language, voice,
+                  subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
+                  target_resolution):
+    """Collect the per-video processing parameters into one dict shared by all stages"""
+    return dict(
+        root_folder=root_folder, resolution=resolution,
+        demucs_model=demucs_model, device=device, shifts=shifts,
+        asr_method=asr_method, whisper_model=whisper_model, batch_size=batch_size, diarization=diarization,
+        whisper_min_speakers=whisper_min_speakers, whisper_max_speakers=whisper_max_speakers,
+        translation_method=translation_method, translation_target_language=translation_target_language,
+        tts_method=tts_method, tts_target_language=tts_target_language, voice=voice,
+        subtitles=subtitles, speed_up=speed_up, fps=fps, background_music=background_music,
+        bgm_volume=bgm_volume, video_volume=video_volume, target_resolution=target_resolution,
+    )
+
+
+def import_local_video(video_path, root_folder):
+    """Copy a local video into its own folder under root_folder as download.mp4"""
+    import shutil
+    folder = os.path.join(root_folder, os.path.splitext(os.path.basename(video_path))[0])
+    os.makedirs(folder, exist_ok=True)
+    new_file_path = os.path.join(folder, 'download.mp4')
+    # Keep an identical earlier copy so its cached stages stay valid
+    if not (os.path.exists(new_file_path) and os.path.getsize(new_file_path) == os.path.getsize(video_path)):
+        shutil.copy(video_path, new_file_path)
+    return new_file_path
+
+
+def job_store_path(root_folder):
+    return os.path.join(root_folder, 'jobs.sqlite3')
+
+
+def new_job(info, settings, job_store=None):
+    """Create the job dict passed between stages, resuming from the job store when possible"""
+    job = {'id': None, 'info': info, 'folder': None, 'stage': '', 'output_video': None, 'settings': settings}
+    if job_store is not None:
+        job_id = job_store.add_job(info, settings)
+        stored = job_store.get_job(job_id)
+        job.update(id=job_id, folder=stored['folder'], stage=stored['stage'], output_video=stored['output_video'])
+        if job['stage']:
+            logger.info(f'Resuming job {job_id} after stage {job["stage"]}: {job["folder"]}')
+    duration = info.get('duration') if isinstance(info, dict) else None
+    job['metrics'] = VideoMetrics(job['folder'], audio_seconds=duration)
+    return job
+
+
+def stage_done(job, stage):
+    """Whether `stage` was already completed by an earlier run of this job"""
+    stage_keys = [key for key, _, _, _ in VIDEO_STAGES]
+    if not job['stage'] or job['folder'] is None:
+        return False
+    return stage_keys.index(stage) <= stage_keys.index(job['stage'])
+
+
+def run_stage(stage, job, max_retries=3, job_store=None):
+    """
+    Run one stage of a job, retrying only this stage on failure.
+    Completed stages are recorded in the job store so a restart resumes after them.
+    """
+    metrics = job['metrics']
+    if stage_done(job, stage):
+        logger.info(f'Skipping {stage}, already completed: {job["folder"]}')
+        metrics.skip(stage)
+        return job
+
+    try:
+        with metrics.stage(stage):
+            for attempt in range(max_retries):
+                try:
+                    job = stage_functions[stage](job, job['settings'])
+                    job['stage'] = stage
+                    if job_store is not None:
+                        job_store.complete_stage(job['id'], stage, job['folder'], job['output_video'])
+                    return job
+                except Exception as e:
+                    stack_trace = traceback.format_exc()
+                    error_msg = f'{str(e)}\n{stack_trace}'
+                    logger.error(f'{stage} failed (attempt {attempt + 1}/{max_retries}): {error_msg}')
+                    if job_store is not None:
+                        job_store.record_failure(job['id'], error_msg)
+                    if attempt == max_retries - 1:
+                        raise
+                    count_metric('retries')
+                    logger.info(f'Retrying {stage} ({attempt + 2}/{max_retries})...')
+    finally:
+        metrics.folder = job['folder']
+        try:
+            metrics.save()
+            write_prometheus(job['settings']['root_folder'])
+        except OSError as e:
+            logger.warning(f'Failed to write metrics: {e}')
+        index_folder(job['settings']['root_folder'], job['folder'])
 
 
 def process_video(info, root_folder, resolution,
@@ -98,165 +251,155 @@ def process_video(info, root_folder, resolution,
                   translation_method, translation_target_language,
                   tts_method, tts_target_language, voice,
                   subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
-                  target_resolution, max_retries, progress_callback=None):
+                  target_resolution, max_retries, progress_callback=None, job_store=None):
     """
     Complete process for handling a single video, with progress callback function
 
     Args:
         progress_callback: Callback function for reporting progress and status, format: progress_callback(progress_percent, status_message)
+        job_store: Optional JobStore; completed stages are recorded there and skipped when the job is resumed
     """
-    local_time = time.localtime()
-
-    # Define progress stages and weights
-    stages = [
-        ("Downloading video...", 10),  # 10%
-        ("Voice separation...", 15),  # 15%
-        ("AI speech recognition...", 20),  # 20%
-        ("Subtitle translation...", 25),  # 25%
-        ("AI voice synthesis...", 20),  # 20%
-        ("Video synthesis...", 10)  # 10%
-    ]
-
-    current_stage = 0
-    progress_base = 0
+    settings = make_settings(root_folder, resolution,
+                             demucs_model, device, shifts,
+                             asr_method, whisper_model, batch_size, diarization, whisper_min_speakers,
+                             whisper_max_speakers,
+                             translation_method, translation_target_language,
+                             tts_method, tts_target_language, voice,
+                             subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
+                             target_resolution)
+    job = new_job(info, settings, job_store)
+    return run_job(job, max_retries, progress_callback, job_store)
+
+
+def run_job(job, max_retries, progress_callback=None, job_store=None):
+    """
+    Run all remaining stages of a job in order
 
+    Returns:
+        (success, output_video, message)
+    """
     # Report initial progress
     if progress_callback:
         progress_callback(0, "Preparing to process...")
+    if job_store is not None:
+        job_store.mark_running(job['id'])
 
-    for retry in range(max_retries):
+    progress_base = 0
+    for stage, stage_name, stage_weight, failure_label in VIDEO_STAGES:
+        if progress_callback:
+            progress_callback(progress_base, stage_name)
         try:
-            # Report entering download stage
-            stage_name, stage_weight = stages[current_stage]
-            if progress_callback:
-                progress_callback(progress_base, stage_name)
-
-            if isinstance(info, str) and info.endswith('.mp4'):
-                folder = os.path.dirname(info)
-                # os.rename(info, os.path.join(folder, 'download.mp4'))
-            else:
-                folder = get_target_folder(info, root_folder)
-                if folder is None:
-                    error_msg = f'Failed to get video target folder: {info["title"]}'
-                    logger.warning(error_msg)
-                    return False, None, error_msg
-
-                folder = download_single_video(info, root_folder, resolution)
-                if folder is None:
-                    error_msg = f'Failed to download video: {info["title"]}'
-                    logger.warning(error_msg)
-                    return False, None, error_msg
-
-            logger.info(f'Processing video: {folder}')
-
-            # Complete download stage, enter voice separation stage
-            current_stage += 1
-            progress_base += stage_weight
-            stage_name, stage_weight = stages[current_stage]
-            if progress_callback:
-                progress_callback(progress_base, stage_name)
+            job = run_stage(stage, job, max_retries, job_store)
+        except Exception as e:
+            stack_trace = traceback.format_exc()
+            error_msg = f'{failure_label} failed: {str(e)}\n{stack_trace}'
+            logger.error(error_msg)
+            if job_store is not None:
+                job_store.mark_failed(job['id'], error_msg)
+            return False, None, error_msg
+        progress_base += stage_weight
 
-            try:
-                status, vocals_path, _ = separate_all_audio_under_folder(
-                    folder, model_name=demucs_model, device=device, progress=True, shifts=shifts)
-                logger.info(f'Voice separation complete: {vocals_path}')
-            except Exception as e:
-                stack_trace = traceback.format_exc()
-                error_msg = f'Voice separation failed: {str(e)}\n{stack_trace}'
-                logger.error(error_msg)
-                return False, None, error_msg
-
-            # Complete voice separation stage, enter speech recognition stage
-            current_stage += 1
-            progress_base += stage_weight
-            stage_name, stage_weight = stages[current_stage]
-            if progress_callback:
-                progress_callback(progress_base, stage_name)
+    if job_store is not None:
+        job_store.mark_done(job['id'])
 
-            try:
-                status, result_json = transcribe_all_audio_under_folder(
-                    folder, asr_method=asr_method, whisper_model_name=whisper_model, device=device,
-                    batch_size=batch_size, diarization=diarization,
-                    min_speakers=whisper_min_speakers,
-                    max_speakers=whisper_max_speakers)
-                logger.info(f'Speech recognition complete: {status}')
-            except Exception as e:
-                stack_trace = traceback.format_exc()
-                error_msg = f'Speech recognition failed: {str(e)}\n{stack_trace}'
-                logger.error(error_msg)
-                return False, None, error_msg
-
-            # Complete speech recognition stage, enter subtitle translation stage
-            current_stage += 1
-            progress_base += stage_weight
-            stage_name, stage_weight = stages[current_stage]
-            if progress_callback:
-                progress_callback(progress_base, stage_name)
+    # Complete all stages, report 100% progress
+    if progress_callback:
+        progress_callback(100, "Processing complete!")
 
-            try:
-                status, summary, translation = translate_all_transcript_under_folder(
-                    folder, method=translation_method, target_language=translation_target_language)
-                logger.info(f'Subtitle translation complete: {status}')
-            except Exception as e:
-                stack_trace = traceback.format_exc()
-                error_msg = f'Subtitle translation failed: {str(e)}\n{stack_trace}'
-                logger.error(error_msg)
-                return False, None, error_msg
-
-            # Complete subtitle translation stage, enter voice synthesis stage
-            current_stage += 1
-            progress_base += stage_weight
-            stage_name, stage_weight = stages[current_stage]
-            if progress_callback:
-                progress_callback(progress_base, stage_name)
+    return True, job['output_video'], "Processing successful"
 
-            try:
-                status, synth_path, _ = generate_all_wavs_under_folder(
-                    folder, method=tts_method, target_language=tts_target_language, voice=voice)
-                logger.info(f'Voice synthesis complete: {synth_path}')
-            except Exception as e:
-                stack_trace = traceback.format_exc()
-                error_msg = f'Voice synthesis failed: {str(e)}\n{stack_trace}'
-                logger.error(error_msg)
-                return False, None, error_msg
-
-            # Complete voice synthesis stage, enter video synthesis stage
-            current_stage += 1
-            progress_base += stage_weight
-            stage_name, stage_weight = stages[current_stage]
-            if progress_callback:
-                progress_callback(progress_base, stage_name)
 
-            try:
-                status, output_video = synthesize_all_video_under_folder(
-                    folder, subtitles=subtitles, speed_up=speed_up, fps=fps, resolution=target_resolution,
-                    background_music=background_music, bgm_volume=bgm_volume, video_volume=video_volume)
-                logger.info(f'Video synthesis complete: {output_video}')
-            except Exception as e:
-                stack_trace = traceback.format_exc()
-                error_msg = f'Video synthesis failed: {str(e)}\n{stack_trace}'
-                logger.error(error_msg)
-                return False, None, error_msg
+def run_jobs_pipelined(jobs, max_workers=3, max_retries=3, progress_callback=None, job_store=None):
+    """
+    Process several jobs with a stage-level pipeline.
 
-            # Complete all stages, report 100% progress
-            if progress_callback:
-                progress_callback(100, "Processing complete!")
+    While one video is in translation or TTS, the next ones can already be downloading
+    and separating. Network-bound stages get `max_workers` threads; stages that share a
+    single in-process model (ASR, TTS, local LLM translation) get one. Separation gets
+    `max_workers` threads too: concurrent videos share batches in the Demucs scheduler.
 
-            return True, output_video, "Processing successful"
-        except Exception as e:
-            stack_trace = traceback.format_exc()
-            error_msg = f'Error processing video {info["title"] if isinstance(info, dict) else info}: {str(e)}\n{stack_trace}'
-            logger.error(error_msg)
-            if retry < max_retries - 1:
-                logger.info(f'Attempting retry {retry + 2}/{max_retries}...')
-            else:
-                return False, None, error_msg
+    Returns:
+        List of (info, success, output_video, error_msg) in input order
+    """
+    io_workers = max(1, int(max_workers))
+    local_llm = any(job['settings']['translation_method'] == 'LLM' for job in jobs)
+    stage_workers = {
+        'download': io_workers,
+        'separate': io_workers,
+        'asr': 1,
+        'translate': 1 if local_llm else io_workers,
+        'tts': 1,
+        'synthesize': io_workers,
+    }
+    stages = [PipelineStage(stage, partial(run_stage, stage, max_retries=max_retries, job_store=job_store),
+                            stage_workers[stage])
+              for stage, _, _, _ in VIDEO_STAGES]
+
+    total_steps = len(jobs) * len(stages)
+    completed_steps = [0]
+    lock = threading.Lock()
+
+    def advance(message):
+        with lock:
+            completed_steps[0] += 1
+            percent = int(completed_steps[0] * 100 / total_steps)
+        if progress_callback:
+            progress_callback(percent, message)
+
+    def on_stage_done(index, job, stage):
+        if stage == VIDEO_STAGES[-1][0] and job_store is not None:
+            job_store.mark_done(job['id'])
+        advance(f'[{index + 1}/{len(jobs)}] {stage} complete')
+
+    def on_item_failed(index, job, stage, error_msg):
+        if job_store is not None:
+            job_store.mark_failed(job['id'], error_msg)
+        # Count the skipped stages as done so overall progress still reaches 100%
+        skipped = len(stages) - [s.name for s in stages].index(stage)
+        for _ in range(skipped):
+            advance(f'[{index + 1}/{len(jobs)}] {stage} failed')
+
+    if job_store is not None:
+        for job in jobs:
+            job_store.mark_running(job['id'])
+    pipeline = StagePipeline(stages, queue_size=io_workers,
+                             on_stage_done=on_stage_done, on_item_failed=on_item_failed)
+    results = pipeline.run(jobs)
+    return [(job['info'], error_msg is None, job['output_video'], error_msg or 'Processing successful')
+            for job, error_msg in results]
+
+
+def resume_jobs(root_folder, max_workers=3, max_retries=3, progress_callback=None):
+    """
+    Resume every unfinished job recorded under root_folder, each from its last completed stage.
+    Jobs left running by a crashed process are picked up again.
 
-    return False, None, f"Maximum retry count reached: {max_retries}"
+    Returns:
+        List of (info, success, output_video, error_msg)
+    """
+    job_store = JobStore(job_store_path(root_folder))
+    serve_prometheus()
+    try:
+        job_store.requeue_interrupted()
+        jobs = []
+        for stored in job_store.list_jobs('pending'):
+            job = new_job(stored['info'], stored['settings'], job_store)
+            jobs.append(job)
+        if not jobs:
+            logger.info(f'No unfinished jobs under {root_folder}')
+            return []
+
+        logger.info(f'Resuming {len(jobs)} unfinished jobs under {root_folder}')
+        for settings in {json.dumps(job['settings'], sort_keys=True, default=str) for job in jobs}:
+            settings = json.loads(settings)
+            initialize_models(settings['tts_method'], settings['asr_method'], settings['diarization'])
+        return run_jobs_pipelined(jobs, max_workers, max_retries, progress_callback, job_store)
+    finally:
+        job_store.close()
 
 
 def do_everything(root_folder, url, num_videos=5, resolution='1080p',
-                  demucs_model='htdemucs_ft', device='auto', shifts=5,
+                  demucs_model='htdemucs_ft', device='auto', shifts=SHIFTS,
                   asr_method='WhisperX', whisper_model='large', batch_size=32, diarization=False,
                   whisper_min_speakers=None, whisper_max_speakers=None,
                   translation_method='LLM', translation_target_language='English',
@@ -270,6 +413,7 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
     Args:
         progress_callback: Callback function for reporting progress and status, format: progress_callback(progress_percent, status_message)
     """
+    job_store = None
     try:
         success_list = []
         fail_list = []
@@ -300,32 +444,16 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
             logger.error(f"Model initialization failed: {str(e)}\n{stack_trace}")
             return f"Model initialization failed: {str(e)}", None
 
+        # Record every video and its completed stages so an interrupted batch can be resumed
+        job_store = JobStore(job_store_path(root_folder))
+        # Expose stage metrics over HTTP when METRICS_PORT is set
+        serve_prometheus()
+
         out_video = None
         if url.endswith('.mp4'):
             try:
-                import shutil
-                # Get the original video filename (without path)
-                original_file_name = os.path.basename(url)
-
-                # Remove file extension, generate folder name
-                new_folder_name = os.path.splitext(original_file_name)[0]
-
-                # Build complete path for the new folder
-                new_folder_path = os.path.join(root_folder, new_folder_name)
-
-                # Create the folder under root_folder
-                os.makedirs(new_folder_path, exist_ok=True)
-
-                # Build complete path for the original file
-                original_file_path = os.path.join(root_folder, original_file_name)
-
-                # Build complete path for the new location
-                new_file_path = os.path.join(new_folder_path, "download.mp4")
-
-                # Move the video file to the newly created folder and rename it
-                shutil.copy(original_file_path, new_file_path)
-                # Create the folder under root_folder
-                os.makedirs(new_folder_path, exist_ok=True)
+                # The uploaded file sits in root_folder; give it its own folder as download.mp4
+                new_file_path = import_local_video(os.path.join(root_folder, os.path.basename(url)), root_folder)
 
                 success, output_video, error_msg = process_video(
                     new_file_path, root_folder, resolution,
@@ -334,7 +462,7 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
                     translation_method, translation_target_language,
                     tts_method, tts_target_language, voice,
                     subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
-                    target_resolution, max_retries, progress_callback
+                    target_resolution, max_retries, progress_callback, job_store
                 )
 
                 if success:
@@ -354,12 +482,16 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
                     progress_callback(10, "获取视频信息中...")
 
                 for video_info in get_info_list_from_url(urls, num_videos):
+                    if video_info is None:
+                        logger.warning('Skipping unavailable video in playlist')
+                        continue
                     videos_info.append(video_info)
 
                 if not videos_info:
                     return "获取视频信息失败，请检查URL是否正确", None
 
-                for info in videos_info:
+                if len(videos_info) == 1:
+                    info = videos_info[0]
                     try:
                         success, output_video, error_msg = process_video(
                             info, root_folder, resolution,
@@ -369,24 +501,35 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
                             translation_method, translation_target_language,
                             tts_method, tts_target_language, voice,
                             subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
-                            target_resolution, max_retries, progress_callback
+                            target_resolution, max_retries, progress_callback, job_store
                         )
-
-                        if success:
-                            success_list.append(info)
-                            out_video = output_video
-                            logger.info(f"成功处理视频: {info['title'] if isinstance(info, dict) else info}")
-                        else:
-                            fail_list.append(info)
-                            error_details.append(f"{info['title'] if isinstance(info, dict) else info}: {error_msg}")
-                            logger.error(
-                                f"处理视频失败: {info['title'] if isinstance(info, dict) else info}, 错误: {error_msg}")
+                        results = [(info, success, output_video, error_msg)]
                     except Exception as e:
                         stack_trace = traceback.format_exc()
+                        results = [(info, False, None, f'{str(e)}\n{stack_trace}')]
+                else:
+                    # Several videos: overlap downloads, separation, ASR, translation and TTS across videos
+                    settings = make_settings(root_folder, resolution,
+                                             demucs_model, device, shifts,
+                                             asr_method, whisper_model, batch_size, diarization,
+                                             whisper_min_speakers, whisper_max_speakers,
+                                             translation_method, translation_target_language,
+                                             tts_method, tts_target_language, voice,
+                                             subtitles, speed_up, fps, background_music, bgm_volume,
+                                             video_volume, target_resolution)
+                    jobs = [new_job(info, settings, job_store) for info in videos_info]
+                    results = run_jobs_pipelined(jobs, max_workers, max_retries, progress_callback, job_store)
+
+                for info, success, output_video, error_msg in results:
+                    if success:
+                        success_list.append(info)
+                        out_video = output_video
+                        logger.info(f"成功处理视频: {info['title'] if isinstance(info, dict) else info}")
+                    else:
                         fail_list.append(info)
-                        error_details.append(f"{info['title'] if isinstance(info, dict) else info}: {str(e)}")
+                        error_details.append(f"{info['title'] if isinstance(info, dict) else info}: {error_msg}")
                         logger.error(
-                            f"处理视频出错: {info['title'] if isinstance(info, dict) else info}, 错误: {str(e)}\n{stack_trace}")
+                            f"处理视频失败: {info['title'] if isinstance(info, dict) else info}, 错误: {error_msg}")
             except Exception as e:
                 stack_trace = traceback.format_exc()
                 logger.error(f"获取视频列表失败: {str(e)}\n{stack_trace}")
@@ -408,6 +551,9 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
         error_msg = f"处理过程中发生错误: {str(e)}\n{stack_trace}"
         logger.error(error_msg)
         return error_msg, None
+    finally:
+        if job_store is not None:
+            job_store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+# Keys of a yt-dlp info dict needed to (re)download a video and name its folder
+INFO_KEYS = ['id', 'title', 'uploader', 'upload_date', 'webpage_url', 'duration']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL UNIQUE,
+    info TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    folder TEXT,
+    stage TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    output_video TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def slim_info(info):
+    """Reduce a video info dict to what is needed to resume the job later"""
+    if isinstance(info, dict):
+        return {key: info[key] for key in INFO_KEYS if key in info}
+    return info
+
+
+def job_key(info):
+    if isinstance(info, dict):
+        return info.get('webpage_url') or info.get('id') or info.get('title')
+    return os.path.abspath(info)
+
+
+class JobStore:
+    """
+    Persistent record of every video job: its inputs, settings, last completed stage,
+    attempt count and last error. Backed by SQLite so an interrupted batch can resume
+    each video from the stage where it stopped.
+    """
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, sql, args=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, args)
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['info'] = json.loads(job['info'])
+        job['settings'] = json.loads(job['settings'])
+        return job
+
+    def add_job(self, info, settings):
+        """
+        Register a video, or return the existing job for it.
+        An existing job whose settings changed starts over from the first stage;
+        the artifact cache makes the unchanged stages cheap to replay.
+        """
+        key = job_key(info)
+        now = time.time()
+        settings_json = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+        existing = self.get_job_by_key(key)
+        if existing is None:
+            cursor = self._execute(
+                'INSERT INTO jobs (job_key, info, settings, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(slim_info(info), ensure_ascii=False), settings_json, now, now))
+            return cursor.lastrowid
+
+        if json.dumps(existing['settings'], sort_keys=True, ensure_ascii=False, default=str) != settings_json:
+            logger.info(f'Settings changed for job {existing["id"]}, restarting from the first stage')
+            self._execute(
+                "UPDATE jobs SET settings = ?, stage = '', status = 'pending', attempts = 0, error = NULL, "
+                "updated_at = ? WHERE id = ?", (settings_json, now, existing['id']))
+        elif existing['status'] == 'done':
+            # A finished video is checked again from the start (cheap, stages are cached)
+            self._execute("UPDATE jobs SET stage = '', status = 'pending', updated_at = ? WHERE id = ?",
+                          (now, existing['id']))
+        elif existing['status'] == 'failed':
+            # A failed video resumes after its last completed stage
+            self._execute("UPDATE jobs SET status = 'pending', attempts = 0, updated_at = ? WHERE id = ?",
+                          (now, existing['id']))
+        return existing['id']
+
+    def get_job(self, job_id):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def get_job_by_key(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM jobs WHERE job_key = ?', (key,)).fetchone()
+        return self._row_to_job(row)
+
+    def list_jobs(self, status=None):
+        with self.lock:
+            if status is None:
+                rows = self.conn.execute('SELECT * FROM jobs ORDER BY id').fetchall()
+            else:
+                rows = self.conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id', (status,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def requeue_interrupted(self):
+        """Jobs left 'running' by a crashed process go back to 'pending'"""
+        cursor = self._execute("UPDATE jobs SET status = 'pending', updated_at = ? WHERE status = 'running'",
+                               (time.time(),))
+        if cursor.rowcount:
+            logger.info(f'Requeued {cursor.rowcount} interrupted jobs')
+        return cursor.rowcount
+
+    def mark_running(self, job_id):
+        self._execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def complete_stage(self, job_id, stage, folder=None, output_video=None):
+        self._execute(
+            'UPDATE jobs SET stage = ?, folder = COALESCE(?, folder), output_video = COALESCE(?, output_video), '
+            'attempts = 0, error = NULL, updated_at = ? WHERE id = ?',
+            (stage, folder, output_video, time.time(), job_id))
+
+    def record_failure(self, job_id, error):
+        self._execute('UPDATE jobs SET attempts = attempts + 1, error = ?, updated_at = ? WHERE id = ?',
+                      (error, time.time(), job_id))
+
+    def mark_done(self, job_id):
+        self._execute("UPDATE jobs SET status = 'done', error = NULL, updated_at = ? WHERE id = ?",
+                      (time.time(), job_id))
+
+    def mark_failed(self, job_id, error):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                      (error, time.time(), job_id))
@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+from loguru import logger
+
+from .artifact_cache import MANIFEST_NAME, load_manifest
+from .metrics import timed
+
+INDEX_NAME = '.index.sqlite3'
+# Files whose presence marks a directory as a video folder
+VIDEO_FILES = ('download.mp4', MANIFEST_NAME, 'audio.wav', 'audio_vocals.wav', 'transcript.json',
+               'translation.json')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    dir_mtime_ns INTEGER NOT NULL,
+    artifacts TEXT NOT NULL,
+    stages TEXT NOT NULL,
+    probe TEXT,
+    updated_at REAL NOT NULL
+)
+"""
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_ffprobe_missing = False
+
+
+def ffprobe(path):
+    """Duration, container and stream metadata of a media file; None if ffprobe is unavailable or fails"""
+    global _ffprobe_missing
+    if _ffprobe_missing:
+        return None
+    command = ['ffprobe', '-v', 'error', '-of', 'json',
+               '-show_entries', 'format=duration,size,bit_rate,format_name:'
+                                'stream=codec_type,codec_name,width,height,r_frame_rate,sample_rate,channels',
+               path]
+    try:
+        with timed('ffmpeg', 'ffprobe'):
+            result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+    except FileNotFoundError:
+        logger.warning('ffprobe not found, video metadata will not be indexed')
+        _ffprobe_missing = True
+        return None
+    except subprocess.TimeoutExpired:
+        logger.warning(f'ffprobe timed out on {path}')
+        return None
+    if result.returncode != 0:
+        logger.warning(f'ffprobe failed on {path}: {result.stderr.strip()}')
+        return None
+
+    data = json.loads(result.stdout or '{}')
+    fmt = data.get('format', {})
+    probe = {
+        'duration': float(fmt['duration']) if fmt.get('duration') else None,
+        'size': int(fmt['size']) if fmt.get('size') else None,
+        'bit_rate': int(fmt['bit_rate']) if fmt.get('bit_rate') else None,
+        'format': fmt.get('format_name'),
+    }
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind in ('video', 'audio') and kind not in probe:
+            probe[kind] = {key: value for key, value in stream.items() if key != 'codec_type'}
+    return probe
+
+
+def _artifact_entries(folder, entries=None):
+    """{name: {'size', 'mtime_ns', 'dir'}} for the direct children of a video folder"""
+    if entries is None:
+        entries = list(os.scandir(folder))
+    artifacts = {}
+    for entry in entries:
+        if entry.name.startswith('.') and entry.name != MANIFEST_NAME:
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        artifacts[entry.name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'dir': entry.is_dir()}
+    return artifacts
+
+
+class ProjectIndex:
+    """
+    Index of the video folders under an output root: the artifacts each one contains,
+    the completion status of its cached stages and ffprobe metadata of the source video.
+
+    The index lives in `root/.index.sqlite3`. `update_folder` refreshes a single folder in
+    O(1) and is called after every stage; `rescan` picks up folders changed outside the tool
+    by only relisting directories whose modification time changed since the last scan.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(self.root, INDEX_NAME), check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(_SCHEMA)
+
+    @classmethod
+    def for_root(cls, root):
+        """Shared index instance for an output root"""
+        root = os.path.abspath(root)
+        with _indexes_lock:
+            if root not in _indexes:
+                _indexes[root] = cls(root)
+            return _indexes[root]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _relpath(self, folder):
+        return os.path.relpath(os.path.abspath(folder), self.root)
+
+    def _row(self, relpath):
+        with self.lock:
+            return self.conn.execute('SELECT * FROM folders WHERE path = ?', (relpath,)).fetchone()
+
+    def _row_to_entry(self, row):
+        return {
+            'folder': os.path.join(self.root, row['path']),
+            'artifacts': json.loads(row['artifacts']),
+            'stages': json.loads(row['stages']),
+            'probe': json.loads(row['probe']) if row['probe'] else None,
+            'updated_at': row['updated_at'],
+        }
+
+    def update_folder(self, folder, entries=None):
+        """Re-index one video folder"""
+        folder = os.path.abspath(folder)
+        relpath = self._relpath(folder)
+        if not os.path.isdir(folder):
+            self.remove(folder)
+            return None
+        dir_mtime_ns = os.stat(folder).st_mtime_ns
+        artifacts = _artifact_entries(folder, entries)
+        stages = {}
+        if MANIFEST_NAME in artifacts:
+            for stage, record in load_manifest(folder)['stages'].items():
+                stages[stage] = 'complete' if record.get('complete') else 'incomplete'
+
+        previous = self._row(relpath)
+        probe = None
+        video = artifacts.get('download.mp4')
+        if video is not None:
+            previous_video = json.loads(previous['artifacts']).get('download.mp4') if previous else None
+            if previous is not None and previous['probe'] and previous_video and \
+                    previous_video['size'] == video['size'] and previous_video['mtime_ns'] == video['mtime_ns']:
+                probe = json.loads(previous['probe'])
+            else:
+                probe = ffprobe(os.path.join(folder, 'download.mp4'))
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO folders (path, dir_mtime_ns, artifacts, stages, probe, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (relpath, dir_mtime_ns, json.dumps(artifacts), json.dumps(stages),
+                 json.dumps(probe) if probe is not None else None, time.time()))
+        return {'folder': folder, 'artifacts': artifacts, 'stages': stages, 'probe': probe}
+
+    def remove(self, folder):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM folders WHERE path = ?', (self._relpath(folder),))
+
+    def rescan(self, full=False):
+        """
+        Bring the index up to date with the file system.
+        Known video folders whose directory mtime is unchanged are not relisted unless `full`;
+        folders that disappeared are dropped.
+
+        Returns:
+            (number of folders re-indexed, number removed)
+        """
+        with self.lock:
+            known = {row['path']: row['dir_mtime_ns']
+                     for row in self.conn.execute('SELECT path, dir_mtime_ns FROM folders')}
+        seen = set()
+        updated = 0
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            relpath = self._relpath(path)
+            if path != self.root and relpath in known and not full:
+                try:
+                    if os.stat(path).st_mtime_ns == known[relpath]:
+                        seen.add(relpath)
+                        continue
+                except OSError:
+                    continue
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            names = {entry.name for entry in entries}
+            if path != self.root and names.intersection(VIDEO_FILES):
+                # Video folders do not nest; their subdirectories (wavs, SPEAKER) are artifacts
+                self.update_folder(path, entries)
+                seen.add(relpath)
+                updated += 1
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                    stack.append(entry.path)
+
+        removed = [relpath for relpath in known if relpath not in seen]
+        if removed:
+            with self.lock, self.conn:
+                self.conn.executemany('DELETE FROM folders WHERE path = ?', [(relpath,) for relpath in removed])
+        if updated or removed:
+            logger.info(f'Index of {self.root}: {updated} folders updated, {len(removed)} removed')
+        return updated, len(removed)
+
+    def get(self, folder):
+        row = self._row(self._relpath(folder))
+        return self._row_to_entry(row) if row is not None else None
+
+    def folders(self, has=None, missing=None, incomplete_stage=None):
+        """
+        Indexed video folders, optionally only those containing artifact `has`, lacking
+        artifact `missing`, or whose cached stage `incomplete_stage` has not completed.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM folders ORDER BY path').fetchall()
+        result = []
+        for row in rows:
+            entry = self._row_to_entry(row)
+            if has is not None and has not in entry['artifacts']:
+                continue
+            if missing is not None and missing in entry['artifacts']:
+                continue
+            if incomplete_stage is not None and entry['stages'].get(incomplete_stage) == 'complete':
+                continue
+            result.append(entry['folder'])
+        return result
+
+
+def video_folders(folder, artifact):
+    """
+    Video folders to process under `folder` that contain `artifact`.
+    A video folder is returned directly without any scan; for an output root the project
+    index is rescanned incrementally instead of walking every folder.
+    """
+    if os.path.exists(os.path.join(folder, artifact)):
+        return [folder]
+    if any(os.path.exists(os.path.join(folder, name)) for name in VIDEO_FILES):
+        return []
+    if not os.path.isdir(folder):
+        return []
+    index = ProjectIndex.for_root(folder)
+    index.rescan()
+    return index.folders(has=artifact)
+
+
+def index_folder(root, folder):
+    """Refresh the index entry of one video folder under root after it changed"""
+    if not folder or not os.path.isdir(folder):
+        return
+    if os.path.commonpath([os.path.abspath(root), os.path.abspath(folder)]) != os.path.abspath(root):
+        return
+    try:
+        ProjectIndex.for_root(root).update_folder(folder)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f'Failed to index {folder}: {e}')
@@ -0,0 +1,147 @@
+"""
+ffmpeg as a managed subprocess: commands are checked and raise FFmpegError with ffmpeg's
+own message, outputs are written to a .part file and renamed when complete, and decoded
+PCM is streamed from a pipe straight into NumPy buffers instead of a temporary WAV.
+"""
+import os
+import subprocess
+import threading
+import wave
+
+import numpy as np
+
+from .manifest import ffprobe
+from .metrics import timed
+
+FFMPEG = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+_BASE_ARGS = ['-nostdin', '-hide_banner', '-loglevel', 'error', '-y']
+# Frames read from the decoder pipe at a time
+BLOCK_FRAMES = 1 << 16
+
+
+class FFmpegError(Exception):
+    """An ffmpeg command failed; carries the exit status and ffmpeg's error output"""
+
+    def __init__(self, command, returncode, stderr):
+        self.command = command
+        self.returncode = returncode
+        self.stderr = stderr
+        message = stderr.strip().splitlines()[-1] if stderr.strip() else 'no error output'
+        super().__init__(f'ffmpeg exited with status {returncode}: {message}')
+
+
+def _part_path(path):
+    root, ext = os.path.splitext(path)
+    return f'{root}.part{ext}'
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def run_ffmpeg(args, name='ffmpeg', output=None):
+    """
+    Run ffmpeg with `args` (without the binary) and wait for it. If `output` is given it is
+    the last argument; ffmpeg writes to a .part file next to it that replaces `output` only
+    after a successful exit, so an interrupted run never leaves a truncated artifact behind.
+    """
+    args = list(args)
+    if output is not None:
+        part = _part_path(output)
+        args[-1] = part
+    command = [FFMPEG] + _BASE_ARGS + args
+    with timed('ffmpeg', name):
+        try:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except BaseException:
+            if output is not None:
+                _remove(part)
+            raise
+    if result.returncode != 0:
+        if output is not None:
+            _remove(part)
+        raise FFmpegError(command, result.returncode, result.stderr.decode('utf-8', errors='replace'))
+    if output is not None:
+        os.replace(part, output)
+    return output
+
+
+def extract_audio(media_path, audio_path, sample_rate=44100, channels=2):
+    """Write the audio track of `media_path` as a 16-bit wav"""
+    return run_ffmpeg(['-i', media_path, '-vn', '-acodec', 'pcm_s16le', '-ar', str(sample_rate),
+                       '-ac', str(channels), audio_path], 'extract_audio', output=audio_path)
+
+
+def _audio_format(path):
+    probe = ffprobe(path) or {}
+    audio = probe.get('audio')
+    if not audio:
+        raise FFmpegError([path], 1, f'No audio stream found in {path}')
+    return int(audio['sample_rate']), int(audio['channels'])
+
+
+def decode_audio(path, sample_rate=None, channels=None, wav_path=None):
+    """
+    Decode the audio of any media file through an ffmpeg pipe into a float32 array of shape
+    (channels, frames) at `sample_rate` with `channels` (the source format if None). With
+    `wav_path` the same PCM is written to a 16-bit wav while it streams in, so extracting a
+    track and loading it costs one decode. Returns (samples, sample_rate); torch callers can
+    wrap the array with torch.from_numpy without a copy.
+    """
+    if sample_rate is None or channels is None:
+        source_rate, source_channels = _audio_format(path)
+        sample_rate = sample_rate or source_rate
+        channels = channels or source_channels
+    command = [FFMPEG] + _BASE_ARGS + ['-i', path, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+                                       '-ar', str(sample_rate), '-ac', str(channels), '-']
+    writer = None
+    if wav_path is not None:
+        part = _part_path(wav_path)
+        writer = wave.open(part, 'wb')
+        writer.setnchannels(channels)
+        writer.setsampwidth(2)
+        writer.setframerate(sample_rate)
+
+    blocks = []
+    stderr = []
+    with timed('ffmpeg', 'decode'):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Drain stderr on the side so a chatty ffmpeg cannot block on a full pipe
+        drain = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        drain.start()
+        block_bytes = BLOCK_FRAMES * channels * 2
+        try:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                if writer is not None:
+                    writer.writeframes(data)
+                blocks.append(np.frombuffer(data, dtype=np.int16))
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            if writer is not None:
+                writer.close()
+                _remove(part)
+            raise
+        finally:
+            process.stdout.close()
+            drain.join()
+            process.stderr.close()
+
+    if writer is not None:
+        writer.close()
+    if returncode != 0:
+        if writer is not None:
+            _remove(part)
+        raise FFmpegError(command, returncode, b''.join(stderr).decode('utf-8', errors='replace'))
+    if writer is not None:
+        os.replace(part, wav_path)
+
+    pcm = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int16)
+    samples = np.empty((channels, len(pcm) // channels), dtype=np.float32)
+    np.multiply(pcm[:samples.size].reshape(-1, channels).T, 1 / 32768.0, out=samples, casting='unsafe')
+    return samples, sample_rate
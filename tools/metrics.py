@@ -0,0 +1,343 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+import wave
+from contextlib import contextmanager
+
+from loguru import logger
+
+from .model_manager import model_registry, process_rss
+
+METRICS_NAME = 'metrics.json'
+PROMETHEUS_NAME = 'metrics.prom'
+# Interval of the background sampler measuring peak memory while a stage runs
+SAMPLE_INTERVAL = float(os.getenv('METRICS_SAMPLE_INTERVAL', '0.2'))
+
+# Metrics of the video whose stage is running in the current thread
+_current = contextvars.ContextVar('video_metrics', default=None)
+
+# Process-wide totals behind the Prometheus exposition
+_totals_lock = threading.Lock()
+_stage_totals = {}
+_call_totals = {}
+_counter_totals = {}
+
+
+def audio_duration(path):
+    """Duration of a wav file in seconds, read from its header; None if unknown"""
+    try:
+        with wave.open(path, 'rb') as f:
+            return f.getnframes() / float(f.getframerate())
+    except (OSError, EOFError, wave.Error):
+        return None
+
+
+def _gpu_memory():
+    # Only look at the GPU once something imported torch; importing it here would cost seconds
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    try:
+        return torch.cuda.memory_allocated()
+    except Exception:
+        return None
+
+
+class PeakSampler:
+    """Track the peak RSS and GPU memory of the process while a block of code runs"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_rss = process_rss()
+        self.peak_gpu = _gpu_memory()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, process_rss())
+        gpu = _gpu_memory()
+        if gpu is not None:
+            self.peak_gpu = max(self.peak_gpu or 0, gpu)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self._sample()
+        return False
+
+
+class VideoMetrics:
+    """
+    Timing and resource usage of one video, stage by stage.
+
+    Each stage records its wall time, the audio duration it processed, the real-time
+    factor (wall time / audio duration), peak RSS and GPU memory, retries, artifact cache
+    results and the backend calls (TTS lines, LLM requests, ffmpeg runs) made while it ran.
+    """
+
+    def __init__(self, folder=None, audio_seconds=None):
+        self.folder = folder
+        self.audio_seconds = audio_seconds
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def _stage_record(self, name):
+        return self.stages.setdefault(name, {
+            'status': 'running', 'wall_seconds': 0.0, 'audio_seconds': None, 'realtime_factor': None,
+            'peak_rss_bytes': None, 'peak_gpu_bytes': None, 'counters': {}, 'calls': {},
+        })
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a stage; backend calls and counters inside the block are attributed to it"""
+        with self.lock:
+            record = self._stage_record(name)
+            record['status'] = 'running'
+        token = _current.set((self, name))
+        t_start = time.time()
+        status = 'failed'
+        try:
+            with PeakSampler() as sampler:
+                yield record
+            status = 'done'
+        finally:
+            _current.reset(token)
+            wall_seconds = time.time() - t_start
+            if self.folder:
+                seconds = audio_duration(os.path.join(self.folder, 'audio.wav'))
+                if seconds:
+                    self.audio_seconds = seconds
+            with self.lock:
+                record['status'] = status
+                record['wall_seconds'] = wall_seconds
+                record['audio_seconds'] = self.audio_seconds
+                record['realtime_factor'] = wall_seconds / self.audio_seconds if self.audio_seconds else None
+                record['peak_rss_bytes'] = sampler.peak_rss
+                record['peak_gpu_bytes'] = sampler.peak_gpu
+            _add_stage_totals(name, record)
+            logger.info(f'{name} took {wall_seconds:.2f}s'
+                        + (f' (RTF {record["realtime_factor"]:.3f})' if record['realtime_factor'] else ''))
+
+    def skip(self, name):
+        with self.lock:
+            if name not in self.stages:
+                self._stage_record(name)['status'] = 'skipped'
+
+    def add_call(self, stage, kind, backend, seconds, ok):
+        with self.lock:
+            calls = self._stage_record(stage)['calls']
+            call = calls.setdefault(f'{kind}/{backend}' if backend else kind,
+                                    {'count': 0, 'errors': 0, 'seconds': 0.0})
+            call['count'] += 1
+            call['seconds'] += seconds
+            if not ok:
+                call['errors'] += 1
+
+    def add_count(self, stage, counter, n=1):
+        with self.lock:
+            counters = self._stage_record(stage)['counters']
+            counters[counter] = counters.get(counter, 0) + n
+
+    def to_dict(self):
+        with self.lock:
+            stages = json.loads(json.dumps(self.stages))
+        measured = [record for record in stages.values() if record['status'] in ('done', 'failed')]
+        total_seconds = sum(record['wall_seconds'] for record in measured)
+        return {
+            'folder': self.folder,
+            'updated_at': time.time(),
+            'audio_seconds': self.audio_seconds,
+            'wall_seconds': total_seconds,
+            'realtime_factor': total_seconds / self.audio_seconds if self.audio_seconds else None,
+            'stages': stages,
+        }
+
+    def save(self, folder=None):
+        """
+        Write metrics.json into the video folder. Stages skipped in this run (already
+        completed earlier) keep the measurements recorded by the run that did them.
+        """
+        folder = folder or self.folder
+        if not folder or not os.path.isdir(folder):
+            return None
+        path = os.path.join(folder, METRICS_NAME)
+        data = self.to_dict()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    previous = json.load(f)
+                for name, record in previous.get('stages', {}).items():
+                    if data['stages'].get(name, {}).get('status', 'skipped') == 'skipped':
+                        data['stages'][name] = record
+            except (OSError, ValueError) as e:
+                logger.warning(f'Ignoring unreadable {path}: {e}')
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+
+def current():
+    """(VideoMetrics, stage name) of the stage running in this thread, or None"""
+    return _current.get()
+
+
+@contextmanager
+def timed(kind, backend=''):
+    """
+    Time a backend call such as one TTS line ('tts'), one LLM request ('llm') or one ffmpeg
+    run ('ffmpeg'). The call is attributed to the current stage and to the process totals.
+    """
+    t_start = time.time()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        seconds = time.time() - t_start
+        context = _current.get()
+        if context is not None:
+            metrics, stage = context
+            metrics.add_call(stage, kind, backend, seconds, ok)
+        with _totals_lock:
+            total = _call_totals.setdefault((kind, backend), {'count': 0, 'errors': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] += seconds
+            if not ok:
+                total['errors'] += 1
+
+
+def count(counter, n=1):
+    """Increment a counter (e.g. 'retries', 'cache_hit') of the current stage"""
+    context = _current.get()
+    stage = ''
+    if context is not None:
+        metrics, stage = context
+        metrics.add_count(stage, counter, n)
+    with _totals_lock:
+        _counter_totals[(stage, counter)] = _counter_totals.get((stage, counter), 0) + n
+
+
+def _add_stage_totals(name, record):
+    with _totals_lock:
+        total = _stage_totals.setdefault(name, {
+            'done': 0, 'failed': 0, 'seconds': 0.0, 'audio_seconds': 0.0,
+            'peak_rss_bytes': 0, 'peak_gpu_bytes': 0,
+        })
+        total[record['status']] = total.get(record['status'], 0) + 1
+        total['seconds'] += record['wall_seconds']
+        if record['status'] == 'done' and record['audio_seconds']:
+            total['audio_seconds'] += record['audio_seconds']
+        total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record['peak_rss_bytes'] or 0)
+        total['peak_gpu_bytes'] = max(total['peak_gpu_bytes'], record['peak_gpu_bytes'] or 0)
+
+
+def _labels(**labels):
+    text = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for key, value in labels.items())
+    return '{' + text + '}' if text else ''
+
+
+def render_prometheus():
+    """Process totals in the Prometheus text exposition format"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(**labels)} {value}')
+
+    with _totals_lock:
+        stages = {name: dict(total) for name, total in _stage_totals.items()}
+        calls = {key: dict(total) for key, total in _call_totals.items()}
+        counters = dict(_counter_totals)
+
+    metric('linly_stage_runs_total', 'counter', 'Stage runs by final status',
+           [({'stage': name, 'status': status}, total.get(status, 0))
+            for name, total in stages.items() for status in ('done', 'failed')])
+    metric('linly_stage_seconds_total', 'counter', 'Wall time spent in each stage',
+           [({'stage': name}, total['seconds']) for name, total in stages.items()])
+    metric('linly_stage_audio_seconds_total', 'counter', 'Audio duration processed by each stage',
+           [({'stage': name}, total['audio_seconds']) for name, total in stages.items()])
+    metric('linly_stage_realtime_factor', 'gauge', 'Stage wall time divided by the audio duration processed',
+           [({'stage': name}, total['seconds'] / total['audio_seconds'])
+            for name, total in stages.items() if total['audio_seconds']])
+    metric('linly_stage_peak_rss_bytes', 'gauge', 'Peak process RSS observed while the stage ran',
+           [({'stage': name}, total['peak_rss_bytes']) for name, total in stages.items()])
+    metric('linly_stage_peak_gpu_bytes', 'gauge', 'Peak allocated GPU memory observed while the stage ran',
+           [({'stage': name}, total['peak_gpu_bytes']) for name, total in stages.items()])
+    metric('linly_stage_events_total', 'counter', 'Retries and artifact cache results per stage',
+           [({'stage': stage, 'event': counter}, value) for (stage, counter), value in counters.items()])
+    metric('linly_backend_calls_total', 'counter', 'Backend calls (TTS lines, LLM requests, ffmpeg runs)',
+           [({'kind': kind, 'backend': backend}, total['count']) for (kind, backend), total in calls.items()])
+    metric('linly_backend_errors_total', 'counter', 'Backend calls that raised',
+           [({'kind': kind, 'backend': backend}, total['errors']) for (kind, backend), total in calls.items()])
+    metric('linly_backend_seconds_total', 'counter', 'Wall time spent in backend calls',
+           [({'kind': kind, 'backend': backend}, total['seconds']) for (kind, backend), total in calls.items()])
+
+    models = model_registry.metrics()['models']
+    metric('linly_model_loads_total', 'counter', 'Model loads into the model registry',
+           [({'model': name}, stats['loads']) for name, stats in models.items()])
+    metric('linly_model_hits_total', 'counter', 'Model requests served by an already resident model',
+           [({'model': name}, stats['hits']) for name, stats in models.items()])
+    metric('linly_model_evictions_total', 'counter', 'Models evicted from the model registry',
+           [({'model': name}, stats['evictions']) for name, stats in models.items()])
+    metric('linly_model_load_seconds_total', 'counter', 'Time spent loading models',
+           [({'model': name}, stats['load_seconds']) for name, stats in models.items()])
+    metric('linly_model_resident_bytes', 'gauge', 'Measured size of resident models',
+           [({'model': name}, stats['size_bytes'] if stats['resident'] else 0) for name, stats in models.items()])
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(folder):
+    """Write metrics.prom into folder, e.g. for the node_exporter textfile collector"""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, PROMETHEUS_NAME)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+    return path
+
+
+_server = None
+
+
+def serve_prometheus(port=None):
+    """Serve render_prometheus() over HTTP on `port` (default: METRICS_PORT); once per process"""
+    global _server
+    port = port if port is not None else os.getenv('METRICS_PORT')
+    if _server is not None or not port:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer(('0.0.0.0', int(port)), Handler)
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f'Serving Prometheus metrics on port {port}')
+    return _server
@@ -0,0 +1,327 @@
+import gc
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from loguru import logger
+
+GB = 1024 ** 3
+
+
+def _torch():
+    """torch if something already imported it; no model can be resident before that"""
+    return sys.modules.get('torch')
+
+
+def _env_gb(name):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return None
+    return float(value) * GB
+
+
+def process_rss():
+    """Resident set size of this process in bytes, 0 if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return 0
+
+
+def _is_cuda(device):
+    return str(device).startswith('cuda')
+
+
+def _used_memory(device):
+    """Memory in use on `device`, used to measure what a model load cost"""
+    torch = _torch()
+    if _is_cuda(device) and torch is not None and torch.cuda.is_available():
+        try:
+            free, total = torch.cuda.mem_get_info()
+            return total - free
+        except Exception:
+            return torch.cuda.memory_allocated()
+    return process_rss()
+
+
+def estimate_model_bytes(obj, depth=2):
+    """Size of the torch parameters and buffers reachable from obj (wrappers included)"""
+    torch = _torch()
+    if torch is None or obj is None:
+        return 0
+    modules = []
+
+    def collect(value, level):
+        if isinstance(value, torch.nn.Module):
+            modules.append(value)
+            return
+        if level <= 0:
+            return
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item, level - 1)
+        elif hasattr(value, '__dict__'):
+            for item in vars(value).values():
+                collect(item, level - 1)
+
+    collect(obj, depth)
+    seen = set()
+    total = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) in seen:
+                continue
+            seen.add(id(tensor))
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _Entry:
+    def __init__(self, name, model, device, size_bytes, unload):
+        self.name = name
+        self.model = model
+        self.device = device
+        self.size_bytes = size_bytes
+        self.unload = unload
+        self.refs = 0
+        self.last_used = time.time()
+        # Set by invalidate() while in use: unloaded on the last release, never handed out again
+        self.stale = False
+
+
+class ModelRegistry:
+    """
+    Process-wide owner of every loaded model.
+
+    Models are loaded on first use, kept resident across jobs, and evicted least
+    recently used first when a RAM or VRAM budget would be exceeded. A model that a
+    stage is currently using (see `use`) is reference counted and never evicted.
+
+    Budgets come from MODEL_RAM_BUDGET_GB / MODEL_VRAM_BUDGET_GB; without them the VRAM
+    budget is 90% of the GPU and RAM is not limited. Families of interchangeable models
+    (e.g. alignment models, one per language) can also be capped by count with `limit`.
+    """
+
+    def __init__(self, ram_budget=None, vram_budget=None):
+        self.ram_budget = ram_budget if ram_budget is not None else _env_gb('MODEL_RAM_BUDGET_GB')
+        self.vram_budget = vram_budget if vram_budget is not None else _env_gb('MODEL_VRAM_BUDGET_GB')
+
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+        self.load_lock = threading.Lock()
+        self.loading = set()
+        # Sizes measured on earlier loads, used to make room before loading again
+        self.known_sizes = {}
+        self.stats = {}
+        # Maximum number of resident models per name prefix, see `limit`
+        self.pool_limits = {}
+
+    def _stats(self, name):
+        return self.stats.setdefault(name, {'loads': 0, 'hits': 0, 'evictions': 0, 'load_seconds': 0.0})
+
+    def _budget(self, device):
+        if not _is_cuda(device):
+            return self.ram_budget
+        if self.vram_budget is None:
+            torch = _torch()
+            if torch is not None and torch.cuda.is_available():
+                self.vram_budget = torch.cuda.get_device_properties(0).total_memory * 0.9
+        return self.vram_budget
+
+    def _resident(self, device):
+        cuda = _is_cuda(device)
+        return sum(entry.size_bytes for entry in self.entries.values() if _is_cuda(entry.device) == cuda)
+
+    def _make_room(self, device, needed, keep=None):
+        """Evict idle models, least recently used first, until `needed` more bytes fit the budget"""
+        budget = self._budget(device)
+        if budget is None:
+            return
+        for name in list(self.entries.keys()):
+            if self._resident(device) + needed <= budget:
+                return
+            entry = self.entries[name]
+            if name == keep or entry.refs > 0 or _is_cuda(entry.device) != _is_cuda(device):
+                continue
+            self._evict_entry(entry, reason='budget')
+        if self._resident(device) + needed > budget:
+            logger.warning(f'Model budget exceeded on {device}: '
+                           f'{(self._resident(device) + needed) / GB:.2f} GB > {budget / GB:.2f} GB, '
+                           f'all resident models are in use')
+
+    def _trim_pool(self, name):
+        """Before loading `name`, evict idle models sharing a limited prefix with it, least recently used first"""
+        for prefix, max_models in self.pool_limits.items():
+            if not name.startswith(prefix):
+                continue
+            pool = [entry for key, entry in self.entries.items() if key.startswith(prefix)]
+            excess = len(pool) + 1 - max_models
+            for entry in pool:
+                if excess <= 0:
+                    break
+                if entry.refs > 0:
+                    continue
+                self._evict_entry(entry, reason=f'{prefix} pool limit')
+                excess -= 1
+
+    def limit(self, prefix, max_models):
+        """Keep at most `max_models` models whose name starts with prefix resident (e.g. one per language)"""
+        with self.lock:
+            self.pool_limits[prefix] = max(1, int(max_models))
+
+    def _evict_entry(self, entry, reason):
+        self.entries.pop(entry.name, None)
+        if entry.unload is not None:
+            try:
+                entry.unload(entry.model)
+            except Exception as e:
+                logger.warning(f'Failed to unload {entry.name}: {e}')
+        entry.model = None
+        self._stats(entry.name)['evictions'] += 1
+        logger.info(f'Evicted model {entry.name} ({entry.size_bytes / GB:.2f} GB, {reason})')
+        gc.collect()
+        torch = _torch()
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def acquire(self, name, loader, device='cpu', unload=None):
+        """
+        Return the model registered as `name`, loading it with `loader()` if needed,
+        and hold a reference to it until `release(name)`.
+        """
+        with self.cond:
+            while True:
+                entry = self.entries.get(name)
+                if entry is not None and not entry.stale:
+                    entry.refs += 1
+                    entry.last_used = time.time()
+                    self.entries.move_to_end(name)
+                    self._stats(name)['hits'] += 1
+                    return entry.model
+                if entry is None and name not in self.loading:
+                    break
+                # Loading in another thread, or a stale copy still held by its users
+                self.cond.wait()
+            self.loading.add(name)
+
+        try:
+            # Loads are serialised so memory deltas can be attributed to one model
+            with self.load_lock:
+                with self.lock:
+                    self._trim_pool(name)
+                    self._make_room(device, self.known_sizes.get(name, 0))
+                logger.info(f'Loading model {name} on {device}')
+                used_before = _used_memory(device)
+                t_start = time.time()
+                model = loader()
+                load_seconds = time.time() - t_start
+                size_bytes = max(_used_memory(device) - used_before, estimate_model_bytes(model), 0)
+        except BaseException:
+            with self.cond:
+                self.loading.discard(name)
+                self.cond.notify_all()
+            raise
+
+        with self.cond:
+            entry = _Entry(name, model, device, size_bytes, unload)
+            entry.refs = 1
+            self.entries[name] = entry
+            self.known_sizes[name] = size_bytes
+            stats = self._stats(name)
+            stats['loads'] += 1
+            stats['load_seconds'] += load_seconds
+            self.loading.discard(name)
+            self._make_room(device, 0, keep=name)
+            self.cond.notify_all()
+        logger.info(f'Loaded model {name} ({size_bytes / GB:.2f} GB) in {load_seconds:.2f}s')
+        return model
+
+    def release(self, name):
+        with self.cond:
+            entry = self.entries.get(name)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+                entry.last_used = time.time()
+                if entry.stale and entry.refs == 0:
+                    self._evict_entry(entry, reason='invalidated')
+                    self.cond.notify_all()
+
+    @contextmanager
+    def use(self, name, loader, device='cpu', unload=None):
+        """Hold a model for the duration of a with-block so it cannot be evicted meanwhile"""
+        model = self.acquire(name, loader, device, unload)
+        try:
+            yield model
+        finally:
+            self.release(name)
+
+    def preload(self, name, loader, device='cpu', unload=None):
+        """Load a model without keeping a reference, so it stays resident until evicted"""
+        model = self.acquire(name, loader, device, unload)
+        self.release(name)
+        return model
+
+    def get(self, name):
+        with self.lock:
+            entry = self.entries.get(name)
+            return entry.model if entry is not None else None
+
+    def is_loaded(self, name):
+        with self.lock:
+            return name in self.entries
+
+    def loaded(self, prefix=''):
+        with self.lock:
+            return [name for name in self.entries if name.startswith(prefix)]
+
+    def evict(self, prefix):
+        """Evict all idle models whose name starts with prefix"""
+        with self.lock:
+            for name in self.loaded(prefix):
+                entry = self.entries[name]
+                if entry.refs > 0:
+                    logger.warning(f'Not evicting {name}, still in use')
+                    continue
+                self._evict_entry(entry, reason='requested')
+
+    def invalidate(self, prefix):
+        """
+        Make the next acquire of models whose name starts with prefix load a fresh copy (e.g.
+        after a model failed). Idle models are evicted now; models in use are unloaded once
+        their last user releases them, and acquire waits for that instead of reusing them.
+        """
+        with self.lock:
+            for name in self.loaded(prefix):
+                entry = self.entries[name]
+                if entry.refs > 0:
+                    logger.info(f'Model {name} is in use, reloading it once released')
+                    entry.stale = True
+                else:
+                    self._evict_entry(entry, reason='invalidated')
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'ram_budget_bytes': self.ram_budget,
+                'vram_budget_bytes': self.vram_budget,
+                'models': {
+                    name: dict(stats,
+                               resident=name in self.entries,
+                               size_bytes=self.known_sizes.get(name, 0),
+                               refs=self.entries[name].refs if name in self.entries else 0)
+                    for name, stats in self.stats.items()
+                },
+            }
+
+
+model_registry = ModelRegistry()
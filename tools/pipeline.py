@@ -0,0 +1,125 @@
+import queue
+import threading
+import traceback
+
+from loguru import logger
+
+# Sentinel that tells a stage worker there is no more input
+_DONE = object()
+
+
+class PipelineStage:
+    """
+    One step of a StagePipeline.
+
+    Args:
+        name: Stage name, used for logging and error reporting
+        fn: Callable taking an item and returning the item handed to the next stage
+        workers: Number of threads serving this stage
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+
+
+class StagePipeline:
+    """
+    Run items through a sequence of stages, each with its own worker pool.
+
+    Stages are connected by bounded queues, so item N+1 can be in an early
+    stage (e.g. downloading) while item N is still in a later one (e.g. TTS).
+    Wall-clock time for many items approaches the slowest stage times N
+    instead of the sum of all stages times N.
+
+    An item that raises in a stage is dropped from the pipeline and its error
+    is reported; the remaining items keep flowing.
+    """
+
+    def __init__(self, stages, queue_size=2, on_stage_done=None, on_item_failed=None):
+        """
+        Args:
+            stages: List of PipelineStage in processing order
+            queue_size: Maximum number of items waiting in front of each stage
+            on_stage_done: Optional callback(index, item, stage_name) after a stage succeeds
+            on_item_failed: Optional callback(index, item, stage_name, error_msg) when a stage fails
+        """
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.on_stage_done = on_stage_done
+        self.on_item_failed = on_item_failed
+
+    def run(self, items):
+        """
+        Process all items and block until every item has left the pipeline.
+
+        Returns:
+            List of (item, error_msg) in input order. error_msg is None on success,
+            item is the output of the last stage (or the last good value on failure).
+        """
+        items = list(items)
+        results = [(item, None) for item in items]
+        if not items or not self.stages:
+            return results
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining_workers = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+
+        def notify(callback, *args):
+            if callback is None:
+                return
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.warning(f'Pipeline callback failed: {e}')
+
+        def worker(stage_index):
+            stage = self.stages[stage_index]
+            in_queue = queues[stage_index]
+            is_last = stage_index == len(self.stages) - 1
+            while True:
+                entry = in_queue.get()
+                if entry is _DONE:
+                    with lock:
+                        remaining_workers[stage_index] -= 1
+                        finished = remaining_workers[stage_index] == 0
+                    # The last worker of a stage closes the next stage
+                    if finished and not is_last:
+                        for _ in range(self.stages[stage_index + 1].workers):
+                            queues[stage_index + 1].put(_DONE)
+                    return
+
+                index, item = entry
+                try:
+                    item = stage.fn(item)
+                except Exception as e:
+                    error_msg = f'{stage.name} failed: {str(e)}\n{traceback.format_exc()}'
+                    logger.error(error_msg)
+                    results[index] = (item, error_msg)
+                    notify(self.on_item_failed, index, item, stage.name, error_msg)
+                    continue
+
+                results[index] = (item, None)
+                notify(self.on_stage_done, index, item, stage.name)
+                if not is_last:
+                    queues[stage_index + 1].put((index, item))
+
+        threads = []
+        for stage_index, stage in enumerate(self.stages):
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(target=worker, args=(stage_index,),
+                                          name=f'pipeline-{stage.name}-{worker_index}', daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # Feed the first stage; blocks while the first queue is full
+        for index, item in enumerate(items):
+            queues[0].put((index, item))
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        return results
@@ -1,20 +1,124 @@
-import shutil
-from demucs.pretrained import get_model
-from demucs.audio import save_audio
+import contextvars
 import os
+import sys
+import threading
+import wave
 from loguru import logger
 import time
-from .utils import save_wav, normalize_wav
-import torch
-import gc
-import torchaudio
-from pathlib import Path
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .artifact_cache import cached_stage
+from .model_manager import model_registry, process_rss
+from .metrics import PeakSampler, current as current_metrics, timed
+from .manifest import video_folders
+from .media_io import extract_audio, run_ffmpeg
+
+# Separation runs on windows of this length, cross-faded over the overlap
+CHUNK_SECONDS = float(os.getenv('DEMUCS_CHUNK_SECONDS', '60'))
+OVERLAP_SECONDS = float(os.getenv('DEMUCS_OVERLAP_SECONDS', '2'))
+# Default size of the shift ensemble: every window is separated from this many randomly shifted
+# copies and the results are averaged. This is the quality/speed trade-off: separation time grows
+# linearly with max(1, shifts), and 0 or 1 separates each window once. The shifts setting of the
+# GUI and the CLI overrides it per run.
+SHIFTS = int(os.getenv('DEMUCS_SHIFTS', '5'))
+# Largest time shift of the shift ensemble, as in Demucs
+SHIFT_SECONDS = 0.5
+# Memory knob only: shifted copies per forward pass, 0 runs all shifts of a chunk in one batch.
+# Lower it if the batch does not fit in memory; the output and the total compute stay the same.
+SHIFT_BATCH = int(os.getenv('DEMUCS_SHIFT_BATCH', '0'))
+# Most windows (from any number of videos) separated in one batch, and the share of the free
+# memory a batch may use
+BATCH_WINDOWS = int(os.getenv('DEMUCS_BATCH_WINDOWS', '8'))
+MEMORY_FRACTION = float(os.getenv('DEMUCS_MEMORY_FRACTION', '0.5'))
+# Weight of the previous estimate when a new per-window memory cost is measured, so one
+# unusual batch or out-of-memory error does not pin the batch size for the whole process
+WINDOW_COST_DECAY = 0.5
+# How often a waiting caller checks that the scheduler thread is still alive, in seconds
+SCHEDULER_POLL_SECONDS = 5
+# Music gating: windows without background music skip Demucs, the mix is taken as vocals.
+# A window has music when its quietest frames (between words) still carry energy within
+# MUSIC_FLOOR_DB of the loud frames, and that floor is tonal (spectral peaks MUSIC_TONALITY_DB
+# above the local spectral median) rather than noise or hum. Opt-in with DEMUCS_MUSIC_GATING=1:
+# the thresholds are heuristic, and a window wrongly judged music-free puts its music into
+# audio_vocals.wav, which feeds ASR and voice cloning.
+MUSIC_GATING = os.getenv('DEMUCS_MUSIC_GATING', '0') == '1'
+MUSIC_FLOOR_DB = float(os.getenv('DEMUCS_MUSIC_FLOOR_DB', '-35'))
+MUSIC_TONALITY_DB = float(os.getenv('DEMUCS_MUSIC_TONALITY_DB', '3'))
+_MUSIC_BANDS = ((50, 250), (250, 1000), (1000, 4000), (4000, 11000))
+# Opt-in faster CPU inference: int8 dynamic quantization, with DEMUCS_CPU_THREADS intra-op
+# threads (default: all cores). Ignored on GPU.
+CPU_QUANTIZE = os.getenv('DEMUCS_CPU_QUANTIZE', '0') == '1'
+CPU_THREADS = int(os.getenv('DEMUCS_CPU_THREADS', '0'))
+# Opt-in vocals-only separation (DEMUCS_TWO_STEMS=1): only the vocals specialists of a bag run
+# and audio_instruments.wav becomes the mix minus the vocals, instead of the sum of the drums,
+# bass and other stems. The separate stage is cached per mode.
+TWO_STEMS = os.getenv('DEMUCS_TWO_STEMS', '0') == '1'
+
+
+def resolve_device(device='auto'):
+    # torch and demucs are imported on first use so importing the pipeline stays fast
+    import torch
+    if device == 'auto':
+        return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return torch.device(device)
+
+
+def quantized(device='auto'):
+    """Whether Demucs runs with int8 dynamic quantization on this device (CPU only)"""
+    return CPU_QUANTIZE and resolve_device(device).type == 'cpu'
+
+
+def model_key(model_name, device='auto', two_stems=False):
+    """Name of a Demucs model in the model registry"""
+    suffix = (':vocals' if two_stems else '') + (':int8' if quantized(device) else '')
+    return f'demucs/{model_name}{suffix}@{resolve_device(device)}'
+
+
+def quantize_model(model):
+    """
+    int8 dynamic quantization of the Linear and LSTM layers (the transformer of HTDemucs,
+    the BLSTMs of HDemucs); convolutions stay float. Also sets the intra-op thread count.
+    """
+    import torch
+    threads = CPU_THREADS or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+    logger.info(f'Demucs quantized to int8 for CPU inference, {threads} threads')
+    return model
 
-# Global variables
-auto_device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-model = None
-model_loaded = False  # Added flag to track if model is loaded
-current_model_config = {}  # Added variable to store current model configuration
+
+def vocals_model(model):
+    """
+    The part of a Demucs model needed for vocals only.
+    A BagOfModels such as htdemucs_ft holds one specialist per source, weighted 1 for its own
+    source and 0 for the others; only the models with a non-zero vocals weight are kept.
+    Bags averaging every model over every source (mdx_extra) and single models are returned as is.
+    """
+    from demucs.apply import BagOfModels
+    if not isinstance(model, BagOfModels):
+        return model
+    vocals_index = model.sources.index('vocals')
+    keep = [i for i, weights in enumerate(model.weights) if weights[vocals_index] != 0]
+    if len(keep) == len(model.models):
+        return model
+    logger.info(f'Vocals only: running {len(keep)} of {len(model.models)} models of the bag')
+    if len(keep) == 1:
+        return model.models[keep[0]]
+    return BagOfModels([model.models[i] for i in keep], [model.weights[i] for i in keep], model.segment)
+
+
+def _model_loader(model_name, device, two_stems=False):
+    def loader():
+        from demucs.pretrained import get_model
+        model = get_model(model_name)
+        if two_stems:
+            model = vocals_model(model)
+        model.to(resolve_device(device))
+        model.eval()
+        if quantized(device):
+            model = quantize_model(model)
+        return model
+    return loader
 
 
 def init_demucs():
@@ -22,85 +126,545 @@ def init_demucs():
     Initialize Demucs model.
     If model is already initialized, return directly without reloading.
     """
-    global model, model_loaded
-    if not model_loaded:
-        model = load_model()
-        model_loaded = True
-    else:
-        logger.info("Demucs model already loaded, skipping initialization")
+    load_model(two_stems=TWO_STEMS)
 
 
 def load_model(model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True,
-               shifts: int = 5):
+               shifts: int = SHIFTS, two_stems: bool = TWO_STEMS):
     """
     Load Demucs model.
-    If model with same configuration is already loaded, return existing model without reloading.
+    If the model is already resident in the model registry, return it without reloading.
     """
-    global model, model_loaded, current_model_config
+    return model_registry.preload(model_key(model_name, device, two_stems),
+                                  _model_loader(model_name, device, two_stems), resolve_device(device))
+
 
-    if model is not None:
-        # Check if model needs to be reloaded (different configuration)
-        requested_config = {
-            'model_name': model_name,
-            'device': 'auto' if device == 'auto' else device,
-            'shifts': shifts
-        }
+def release_model():
+    """
+    Release model resources to prevent memory leaks
+    """
+    if model_registry.loaded('demucs/'):
+        logger.info('Releasing Demucs model resources...')
+        model_registry.evict('demucs/')
+        logger.info('Demucs model resources released')
 
-        if current_model_config == requested_config:
-            logger.info(f'Demucs model loaded with same configuration, reusing existing model')
-            return model
+
+def _to_float(frames, channels):
+    return (np.frombuffer(frames, dtype=np.int16).reshape(-1, channels).T / 32768.0).astype(np.float32)
+
+
+def _to_pcm(wav):
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+
+def _open_output(path, sample_rate):
+    writer = wave.open(path, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(2)
+    writer.setframerate(sample_rate)
+    return writer
+
+
+def _model_input(audio_path, model):
+    """
+    Path of a 16-bit wav at the model's sample rate and channel count.
+    audio.wav is extracted in that format already; anything else is converted once with ffmpeg.
+    """
+    with wave.open(audio_path, 'rb') as reader:
+        if reader.getframerate() == model.samplerate and reader.getnchannels() == model.audio_channels \
+                and reader.getsampwidth() == 2:
+            return audio_path
+    converted_path = audio_path[:-len('.wav')] + f'.{model.samplerate}.wav'
+    logger.info(f'Converting {audio_path} to {model.samplerate} Hz, {model.audio_channels} channels')
+    return run_ffmpeg(['-i', audio_path, '-acodec', 'pcm_s16le', '-ar', str(model.samplerate),
+                       '-ac', str(model.audio_channels), converted_path], 'resample', output=converted_path)
+
+
+def _mix_statistics(reader, block_frames):
+    """Mean and standard deviation of the mono mix, streamed so the track is never loaded at once"""
+    channels = reader.getnchannels()
+    total = count = 0.0
+    square_total = 0.0
+    reader.rewind()
+    while True:
+        frames = reader.readframes(block_frames)
+        if not frames:
+            break
+        mono = _to_float(frames, channels).mean(axis=0, dtype=np.float64)
+        total += mono.sum()
+        square_total += np.square(mono).sum()
+        count += mono.size
+    if not count:
+        return 0.0, 1.0
+    mean = total / count
+    std = max(float(np.sqrt(max(square_total / count - mean ** 2, 0.0))), 1e-8)
+    return float(mean), std
+
+
+def music_presence(wav, sample_rate, frame=2048):
+    """
+    Spectral features of background music in a window of audio (channels x samples).
+
+    Returns:
+        (floor_db, tonality_db): the 10th percentile energy of the loudest of four bands
+        relative to the 90th percentile of the total, and how far the spectral peaks of the
+        quietest fifth of the frames rise above the local median of the spectrum.
+    """
+    mono = wav.mean(axis=0) if wav.ndim > 1 else wav
+    hop = frame // 2
+    frames = (len(mono) - frame) // hop + 1
+    if frames < 8:
+        return -np.inf, 0.0
+    windows = np.lib.stride_tricks.sliding_window_view(mono, frame)[::hop][:frames]
+    spectrum = np.abs(np.fft.rfft(windows * np.hanning(frame).astype(np.float32), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frame, 1 / sample_rate)
+    loud = np.percentile(spectrum.sum(axis=1), 90) + 1e-12
+    floor_db = max(10 * np.log10(np.percentile(spectrum[:, (freqs >= lo) & (freqs < hi)].sum(axis=1), 10) / loud
+                                 + 1e-12)
+                   for lo, hi in _MUSIC_BANDS)
+
+    spectrum = spectrum[:, (freqs >= _MUSIC_BANDS[0][0]) & (freqs < _MUSIC_BANDS[-1][1])]
+    energy = spectrum.sum(axis=1)
+    quiet = spectrum[energy <= np.percentile(energy, 20)].mean(axis=0) + 1e-12
+    envelope = np.median(np.lib.stride_tricks.sliding_window_view(np.pad(quiet, 8, mode='edge'), 17), axis=1)
+    tonality_db = np.percentile(10 * np.log10(quiet / envelope), 99)
+    return float(floor_db), float(tonality_db)
+
+
+def has_music(wav, sample_rate):
+    floor_db, tonality_db = music_presence(wav, sample_rate)
+    return floor_db > MUSIC_FLOOR_DB and tonality_db > MUSIC_TONALITY_DB
+
+
+def _shift_offsets(shifts, max_shift, seed):
+    """Random time offsets of the shifted copies; seeded so a re-run gives the same output"""
+    if shifts <= 0:
+        return [0]
+    return np.random.default_rng(seed).integers(0, max_shift + 1, shifts).tolist()
+
+
+def _separate_windows(model, windows, device, shifts, seeds, two_stems=False):
+    """
+    Separate several windows of the normalized stereo mix in batched forward passes.
+
+    Every window is expanded into its `shifts` time-shifted copies (the shift trick of
+    Demucs: outputs of randomly shifted inputs are shifted back and averaged). All copies
+    of all windows are padded to one length and stacked on the batch dimension, so the
+    model runs ceil(windows * max(1, shifts) / SHIFT_BATCH) passes instead of one per copy.
+
+    Returns:
+        List of (vocals, instruments) mono arrays, instruments None with two_stems
+    """
+    import torch
+    import torch.nn.functional as F
+    from demucs.apply import apply_model
+
+    max_shift = int(SHIFT_SECONDS * model.samplerate) if shifts > 0 else 0
+    length = max(window.shape[-1] for window in windows)
+    copies = []
+    for index, (window, seed) in enumerate(zip(windows, seeds)):
+        mix = torch.from_numpy(np.ascontiguousarray(window))
+        padded = F.pad(mix, (max_shift, max_shift + length - mix.shape[-1]))
+        for offset in _shift_offsets(shifts, max_shift, seed):
+            copies.append((index, offset, padded[..., offset:offset + length + max_shift]))
+
+    batch_size = SHIFT_BATCH if SHIFT_BATCH > 0 else len(copies)
+    totals = [None] * len(windows)
+    counts = [0] * len(windows)
+    with torch.no_grad():
+        for start in range(0, len(copies), batch_size):
+            batch = copies[start:start + batch_size]
+            out = apply_model(model, torch.stack([copy for _, _, copy in batch]), shifts=0, split=True,
+                              overlap=0.25, progress=False, device=device)
+            for (index, offset, _), sources in zip(batch, out):
+                # Undo the shift: sample j of the window sits at j + max_shift - offset in the copy
+                sources = sources[..., max_shift - offset:max_shift - offset + length].cpu()
+                totals[index] = sources if totals[index] is None else totals[index] + sources
+                counts[index] += 1
+
+    vocals_index = model.sources.index('vocals')
+    results = []
+    for window, total, n in zip(windows, totals, counts):
+        sources = total[..., :window.shape[-1]] / n
+        vocals = sources[vocals_index]
+        if two_stems:
+            results.append((vocals.mean(dim=0).numpy(), None))
         else:
-            logger.info(f'Demucs model configuration changed, need to reload')
-            # Release existing model resources
-            release_model()
+            instruments = sources.sum(dim=0) - vocals
+            results.append((vocals.mean(dim=0).numpy(), instruments.mean(dim=0).numpy()))
+    return results
 
-    logger.info(f'Loading Demucs model: {model_name}')
-    t_start = time.time()
 
-    device_to_use = auto_device if device == 'auto' else device
-    model = get_model(model_name)
-    model.to(device_to_use)
+class _SeparationStream:
+    """
+    Windowed separation of one audio file: hands out windows of CHUNK_SECONDS that overlap
+    by OVERLAP_SECONDS, cross-fades the separated windows over their overlap and appends
+    the result to the output files as it is produced, so memory does not grow with duration.
+    Outputs are written to .part files and renamed when the last window is in.
+    """
 
-    # Store current model configuration
-    current_model_config = {
-        'model_name': model_name,
-        'device': 'auto' if device == 'auto' else device,
-        'shifts': shifts
-    }
+    def __init__(self, model, audio_path, vocal_output_path, instruments_output_path, shifts, two_stems,
+                 gating=False):
+        self.audio_path = audio_path
+        self.vocal_output_path = vocal_output_path
+        self.instruments_output_path = instruments_output_path
+        self.shifts = shifts
+        self.two_stems = two_stems
+        self.gating = gating
+        self.skipped_windows = 0
+        self.skipped_seconds = 0.0
+        self.input_path = _model_input(audio_path, model)
+        self.reader = wave.open(self.input_path, 'rb')
+        self.sample_rate = self.reader.getframerate()
+        self.channels = self.reader.getnchannels()
+        self.total_frames = self.reader.getnframes()
+        self.chunk_frames = max(int(CHUNK_SECONDS * self.sample_rate), 1)
+        self.overlap_frames = min(int(OVERLAP_SECONDS * self.sample_rate), self.chunk_frames // 2)
+        self.hop_frames = self.chunk_frames - self.overlap_frames
+        self.num_chunks = max(1, -(-max(self.total_frames - self.overlap_frames, 1) // self.hop_frames))
+        # Demucs normalizes the input by the statistics of the whole track
+        self.mean, self.std = _mix_statistics(self.reader, self.chunk_frames)
+        self.fade_in = np.linspace(0.0, 1.0, self.overlap_frames, dtype=np.float32)
+        self.vocals_writer = _open_output(vocal_output_path + '.part', self.sample_rate)
+        self.instruments_writer = _open_output(instruments_output_path + '.part', self.sample_rate)
+        self.read_position = 0
+        self.read_index = 0
+        self.written = 0
+        self.pending = None
+        self.metrics = current_metrics()
+        self.done = threading.Event()
+        self.error = None
+
+    @property
+    def exhausted(self):
+        """All windows have been handed out"""
+        return self.read_index >= self.num_chunks
+
+    def next_window(self):
+        """
+        (index, raw window, normalized window) of the next window to separate; the normalized
+        window is None when music gating found no music in it
+        """
+        self.reader.setpos(self.read_position)
+        chunk = _to_float(self.reader.readframes(self.chunk_frames), self.channels)
+        index = self.read_index
+        self.read_index += 1
+        self.read_position += self.hop_frames
+        if self.gating and not has_music(chunk, self.sample_rate):
+            return index, chunk, None
+        return index, chunk, (chunk - self.mean) / self.std
+
+    def write(self, chunk, vocals, instruments):
+        """
+        Append the separated window following the last one written; windows arrive in order.
+        A window without music (vocals None) passes through as vocals with silent instruments.
+        """
+        frames = chunk.shape[1]
+        if vocals is None:
+            vocals = chunk.mean(axis=0)
+            instruments = np.zeros_like(vocals)
+            self.skipped_windows += 1
+            self.skipped_seconds += frames / self.sample_rate
+        else:
+            vocals = vocals * self.std + self.mean
+            # The accompaniment is everything that is not vocals
+            instruments = chunk.mean(axis=0) - vocals if self.two_stems \
+                else instruments * self.std + self.mean
+        if self.pending is not None:
+            k = min(self.overlap_frames, frames)
+            fade_in = self.fade_in[:k]
+            vocals[:k] = self.pending[0][:k] * (1 - fade_in) + vocals[:k] * fade_in
+            instruments[:k] = self.pending[1][:k] * (1 - fade_in) + instruments[:k] * fade_in
+        self.written += 1
+        last = self.written >= self.num_chunks
+        keep = frames if last else frames - self.overlap_frames
+        self.vocals_writer.writeframes(_to_pcm(vocals[:keep]))
+        self.instruments_writer.writeframes(_to_pcm(instruments[:keep]))
+        self.pending = None if last else (vocals[keep:].copy(), instruments[keep:].copy())
+        if last:
+            self.close(success=True)
+
+    def close(self, success=False, error=None):
+        if self.done.is_set():
+            return
+        for f in (self.reader, self.vocals_writer, self.instruments_writer):
+            try:
+                f.close()
+            except Exception:
+                pass
+        for output_path in (self.vocal_output_path, self.instruments_output_path):
+            if success:
+                os.replace(output_path + '.part', output_path)
+            elif os.path.exists(output_path + '.part'):
+                # A failed separation leaves no partial output behind
+                os.remove(output_path + '.part')
+        if self.input_path != self.audio_path and os.path.exists(self.input_path):
+            os.remove(self.input_path)
+        self.error = error
+        self.done.set()
+
+
+def _free_memory(device):
+    """Memory currently available on `device` in bytes, None if unknown"""
+    torch = sys.modules.get('torch')
+    if str(device).startswith('cuda') and torch is not None and torch.cuda.is_available():
+        try:
+            return torch.cuda.mem_get_info(device)[0]
+        except Exception:
+            return None
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
 
-    model_loaded = True
-    t_end = time.time()
-    logger.info(f'Demucs model loaded successfully, took {t_end - t_start:.2f} seconds')
 
-    return model
+def _is_out_of_memory(error):
+    return isinstance(error, MemoryError) or 'out of memory' in str(error).lower()
 
 
-def release_model():
+class SeparationScheduler:
     """
-    Release model resources to prevent memory leaks
+    Separates the audio of several videos together.
+
+    Every call to `separate` (one per video, from any thread) registers a stream of windows
+    and blocks until its files are written. A single scheduler thread takes windows
+    round-robin from all waiting streams that use the same model and settings, runs them as
+    one batch through the model and writes each result back to its own stream. On a GPU
+    this keeps the batch dimension filled even for short clips.
+
+    The number of windows per batch adapts to memory: the first batch runs one window and
+    its peak memory growth gives the cost per window; later batches take as many windows as
+    fit in MEMORY_FRACTION of the free memory, up to BATCH_WINDOWS. The cost is a decaying
+    average of the measured batches. A batch that runs out of memory is retried at half the size.
     """
-    global model, model_loaded, current_model_config
 
-    if model is not None:
-        logger.info('Releasing Demucs model resources...')
-        # Remove reference
-        model = None
-        # Force garbage collection
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-
-        model_loaded = False
-        current_model_config = {}
-        logger.info('Demucs model resources released')
+    def __init__(self, max_windows=None, memory_fraction=None):
+        self.max_windows = max_windows or BATCH_WINDOWS
+        self.memory_fraction = memory_fraction or MEMORY_FRACTION
+        self.lock = threading.Condition()
+        self.streams = {}
+        self.window_cost = {}
+        self.thread = None
+        self.stats = {'batches': 0, 'windows': 0, 'audio_seconds': 0.0, 'seconds': 0.0, 'skipped_windows': 0,
+                      'skipped_seconds': 0.0}
+
+    def separate(self, audio_path, vocal_output_path, instruments_output_path, model_name='htdemucs_ft',
+                 device='auto', shifts=SHIFTS, two_stems=TWO_STEMS, gating=MUSIC_GATING):
+        """
+        Separate one file, sharing model batches with the other files being separated.
+        With gating, windows without background music are not sent to the model.
+        """
+        target_device = resolve_device(device)
+        key = (model_key(model_name, device, two_stems), shifts, two_stems)
+        loader = _model_loader(model_name, device, two_stems)
+        with model_registry.use(key[0], loader, target_device) as model:
+            stream = _SeparationStream(model, audio_path, vocal_output_path, instruments_output_path,
+                                       shifts, two_stems, gating)
+        stream.key = key
+        stream.loader = loader
+        stream.device = target_device
+        with self.lock:
+            self.streams.setdefault(key, []).append(stream)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='demucs-scheduler', daemon=True)
+                self.thread.start()
+            self.lock.notify_all()
+        while not stream.done.wait(SCHEDULER_POLL_SECONDS):
+            with self.lock:
+                alive = self.thread is not None and self.thread.is_alive()
+            if not alive:
+                stream.close(error=RuntimeError('Separation scheduler stopped before finishing this file'))
+        if stream.error is not None:
+            raise stream.error
+        return vocal_output_path, instruments_output_path
+
+    def _update_cost(self, key, cost):
+        previous = self.window_cost.get(key)
+        self.window_cost[key] = cost if previous is None else \
+            WINDOW_COST_DECAY * previous + (1 - WINDOW_COST_DECAY) * cost
+
+    def _batch_size(self, key, device):
+        cost = self.window_cost.get(key)
+        if cost is None:
+            return 1
+        free = _free_memory(device)
+        if free is None or cost <= 0:
+            return self.max_windows
+        return int(max(1, min(self.max_windows, free * self.memory_fraction // cost)))
+
+    def _take_windows(self, streams, size):
+        """
+        Up to `size` windows, round-robin over the streams. Reading runs music gating and can
+        fail on a broken file: that stream alone is failed and its windows are left out.
+        """
+        windows = []
+        while len(windows) < size:
+            active = [stream for stream in streams if not stream.exhausted and not stream.done.is_set()]
+            if not active:
+                break
+            for stream in active:
+                if len(windows) < size:
+                    try:
+                        windows.append((stream,) + stream.next_window())
+                    except Exception as e:
+                        logger.error(f'Reading {stream.audio_path} for separation failed: {e}')
+                        stream.close(error=e)
+        return [window for window in windows if not window[0].done.is_set()]
+
+    def _run(self):
+        while True:
+            with self.lock:
+                keys = [key for key, streams in self.streams.items() if streams]
+                if not keys:
+                    self.thread = None
+                    return
+                # Settings are served in the order they were first requested
+                key = keys[0]
+                streams = [stream for stream in self.streams[key] if not stream.done.is_set()]
+                if not streams:
+                    self.streams[key] = []
+                    continue
+            device = streams[0].device
+            windows = []
+            try:
+                windows = self._take_windows(streams, self._batch_size(key, device))
+                self._run_batch(key, streams[0].loader, device, windows)
+            except Exception as e:
+                failed = {id(stream): stream for stream, *_ in windows} or {id(stream): stream for stream in streams}
+                logger.error(f'Separation batch failed for {len(failed)} files: {e}')
+                for stream in failed.values():
+                    stream.close(error=e)
+            with self.lock:
+                self.streams[key] = [stream for stream in self.streams[key] if not stream.done.is_set()]
+
+    def _separate_batch(self, key, loader, device, windows):
+        """
+        Run windows through the model, halving the batch on out-of-memory errors.
+
+        Returns:
+            (windows separated, their results, seconds); windows that did not fit are
+            handed back to their streams to be read again
+        """
+        torch = sys.modules.get('torch')
+        cuda = str(device).startswith('cuda') and torch is not None and torch.cuda.is_available()
+        _, shifts, two_stems = key
+        t_start = time.time()
+        with model_registry.use(key[0], loader, device) as model:
+            if cuda:
+                torch.cuda.reset_peak_memory_stats(device)
+                memory_before = torch.cuda.memory_allocated(device)
+            while True:
+                try:
+                    with PeakSampler(interval=0.05) as sampler, timed('demucs', 'batch'):
+                        rss_before = sampler.peak_rss
+                        results = _separate_windows(model, [normalized for _, _, _, normalized in windows],
+                                                    device, shifts, [index for _, index, _, _ in windows],
+                                                    two_stems)
+                    break
+                except Exception as e:
+                    if not _is_out_of_memory(e) or len(windows) == 1:
+                        raise
+                    # Give back the second half and retry with fewer windows
+                    half = len(windows) // 2
+                    logger.warning(f'Separation batch of {len(windows)} windows ran out of memory, '
+                                   f'retrying with {half}')
+                    if cuda:
+                        torch.cuda.empty_cache()
+                    for stream, index, _, _ in windows[half:]:
+                        stream.read_index = min(stream.read_index, index)
+                        stream.read_position = min(stream.read_position, index * stream.hop_frames)
+                    windows = windows[:half]
+                    # At least what the failed batch implied; later measurements decay it again
+                    self.window_cost[key] = max(self.window_cost.get(key) or 0,
+                                                (_free_memory(device) or 0) * self.memory_fraction / half)
+            peak = torch.cuda.max_memory_allocated(device) - memory_before if cuda else sampler.peak_rss - rss_before
+        self._update_cost(key, peak / len(windows))
+        return windows, results, time.time() - t_start
+
+    def _run_batch(self, key, loader, device, windows):
+        torch = sys.modules.get('torch')
+        cuda = str(device).startswith('cuda') and torch is not None and torch.cuda.is_available()
+        to_separate = [window for window in windows if window[3] is not None]
+        results = {}
+        seconds = 0.0
+        if to_separate:
+            separated, outputs, seconds = self._separate_batch(key, loader, device, to_separate)
+            results = {(id(stream), index): output for (stream, index, _, _), output in zip(separated, outputs)}
+            # Windows handed back after an out-of-memory error are read again, with every later
+            # window of their stream
+            first_returned = {}
+            for stream, index, _, _ in to_separate[len(separated):]:
+                first_returned[id(stream)] = min(first_returned.get(id(stream), index), index)
+            windows = [window for window in windows
+                       if window[1] < first_returned.get(id(window[0]), window[1] + 1)]
+
+        audio_seconds = 0.0
+        per_stream = {}
+        for stream, index, chunk, normalized in windows:
+            vocals, instruments = results[(id(stream), index)] if normalized is not None else (None, None)
+            window_seconds = chunk.shape[1] / stream.sample_rate
+            record = per_stream.setdefault(id(stream), [stream, 0, 0.0])
+            if normalized is not None:
+                audio_seconds += window_seconds
+                record[1] += 1
+                record[2] += window_seconds
+            stream.write(chunk, vocals, instruments)
+        self.stats['batches'] += 1 if to_separate else 0
+        self.stats['windows'] += sum(record[1] for record in per_stream.values())
+        self.stats['audio_seconds'] += audio_seconds
+        self.stats['seconds'] += seconds
+
+        for stream, n, window_seconds in per_stream.values():
+            if stream.metrics is not None and n:
+                # Attribute the batch time to the videos in proportion to the audio they had in it
+                video_metrics, stage = stream.metrics
+                video_metrics.add_call(stage, 'demucs', 'batch', seconds * window_seconds / audio_seconds, True)
+                video_metrics.add_count(stage, 'demucs_chunks', n)
+            if stream.done.is_set() and stream.error is None and stream.gating:
+                self._report_gating(stream)
+        if to_separate:
+            gpu = f', GPU peak {torch.cuda.max_memory_allocated(device) / 1024 ** 2:.0f}MB' if cuda else ''
+            logger.info(f'Demucs batch of {len(results)} windows from {len(per_stream)} files: '
+                        f'{audio_seconds:.1f}s audio in {seconds:.2f}s '
+                        f'({audio_seconds / max(seconds, 1e-6):.1f}x realtime), '
+                        f'RSS {process_rss() / 1024 ** 2:.0f}MB{gpu}')
+
+    def _report_gating(self, stream):
+        """Log and record how much of a finished file music gating kept out of Demucs"""
+        total_seconds = stream.total_frames / stream.sample_rate
+        self.stats['skipped_windows'] += stream.skipped_windows
+        self.stats['skipped_seconds'] += stream.skipped_seconds
+        # Time saved, at the throughput separation has had so far
+        cost = self.stats['seconds'] / self.stats['audio_seconds'] if self.stats['audio_seconds'] else None
+        saved = stream.skipped_seconds * cost if cost is not None else None
+        logger.info(f'Music gating: {stream.skipped_windows}/{stream.num_chunks} windows '
+                    f'({stream.skipped_seconds / max(total_seconds, 1e-6):.0%} of the audio) had no music and '
+                    f'skipped Demucs' + (f', saving about {saved:.1f}s' if saved is not None else '')
+                    + f': {stream.audio_path}')
+        if stream.metrics is not None:
+            video_metrics, stage = stream.metrics
+            video_metrics.add_count(stage, 'music_gate_skipped_windows', stream.skipped_windows)
+            video_metrics.add_count(stage, 'music_gate_skipped_seconds', round(stream.skipped_seconds, 3))
+            if saved is not None:
+                video_metrics.add_count(stage, 'music_gate_saved_seconds', round(saved, 3))
+
+
+scheduler = SeparationScheduler()
 
 
 def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True,
-                   shifts: int = 5) -> None:
+                   shifts: int = SHIFTS, two_stems: bool = TWO_STEMS, gating: bool = MUSIC_GATING) -> None:
     """
-    Separate audio file using Demucs
+    Separate audio file using Demucs, chunk by chunk, into audio_vocals.wav and audio_instruments.wav.
+    Videos separated at the same time from different threads share model batches.
+
+    Args:
+        shifts: Randomly shifted copies averaged per window; time grows linearly with max(1, shifts)
+        two_stems: Only separate vocals and take the accompaniment as mix minus vocals.
+            For htdemucs_ft this runs one of the bag's four models instead of all of them.
+            Off unless DEMUCS_TWO_STEMS=1.
+        gating: Pass windows without background music through as vocals instead of separating them
     """
-    global model
     audio_path = os.path.join(folder, 'audio.wav')
     if not os.path.exists(audio_path):
         return None, None
@@ -112,69 +676,28 @@ def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = '
         logger.info(f'Audio already separated: {folder}')
         return vocal_output_path, instruments_output_path
 
-    logger.info(f'Separating audio: {folder}')
+    passes = max(1, shifts)
+    logger.info(f'Separating audio: {folder} ({passes} shifted cop{"ies" if passes > 1 else "y"} per chunk)')
+    key = model_key(model_name, device, two_stems)
 
     try:
-        # Ensure model is loaded with correct configuration
-        if not model_loaded or current_model_config.get('model_name') != model_name or \
-                (current_model_config.get('device') == 'auto') != (device == 'auto') or \
-                current_model_config.get('shifts') != shifts:
-            load_model(model_name, device, progress, shifts)
-
         t_start = time.time()
-        
-        # Load audio
-        wav, sr = torchaudio.load(audio_path)
-        wav = wav.mean(dim=0)  # Convert to mono if stereo
-        
-        # Resample if needed (Demucs expects 44.1kHz)
-        if sr != 44100:
-            wav = torchaudio.functional.resample(wav, sr, 44100)
-            sr = 44100
-            
-        # Move to device and add batch dimension
-        wav = wav.to(auto_device).unsqueeze(0)
-        
         try:
-            # Run separation
-            with torch.no_grad():
-                separated = model(wav[None])[0]
-                
-            t_end = time.time()
-            logger.info(f'Audio separation completed, took {t_end - t_start:.2f} seconds')
-            
-            # Get vocals and instruments
-            vocals = separated["vocals"].cpu().squeeze().numpy()
-            instruments = (separated["drums"] + separated["bass"] + separated["other"]).cpu().squeeze().numpy()
-            
-            # Save outputs
-            save_wav(vocals, vocal_output_path, sample_rate=44100)
-            logger.info(f'Vocals saved: {vocal_output_path}')
-
-            save_wav(instruments, instruments_output_path, sample_rate=44100)
-            logger.info(f'Instruments saved: {instruments_output_path}')
-            
-            return vocal_output_path, instruments_output_path
-            
+            scheduler.separate(audio_path, vocal_output_path, instruments_output_path, model_name, device,
+                               shifts, two_stems, gating)
         except Exception as e:
             logger.error(f'Audio separation failed: {e}')
-            # Try to reload model once when error occurs
-            release_model()
-            load_model(model_name, device, progress, shifts)
-            logger.info('Model reloaded, retrying separation...')
-            
-            with torch.no_grad():
-                separated = model(wav[None])[0]
-                
-            # Get vocals and instruments
-            vocals = separated["vocals"].cpu().squeeze().numpy()
-            instruments = (separated["drums"] + separated["bass"] + separated["other"]).cpu().squeeze().numpy()
-            
-            # Save outputs
-            save_wav(vocals, vocal_output_path, sample_rate=44100)
-            save_wav(instruments, instruments_output_path, sample_rate=44100)
-            
-            return vocal_output_path, instruments_output_path
+            # Retry once with a freshly loaded model, as soon as no other separation holds the old one
+            model_registry.invalidate(key)
+            logger.info('Reloading model, retrying separation...')
+            scheduler.separate(audio_path, vocal_output_path, instruments_output_path, model_name, device,
+                               shifts, two_stems, gating)
+
+        t_end = time.time()
+        logger.info(f'Audio separation completed, took {t_end - t_start:.2f} seconds')
+        logger.info(f'Vocals saved: {vocal_output_path}')
+        logger.info(f'Instruments saved: {instruments_output_path}')
+        return vocal_output_path, instruments_output_path
 
     except Exception as e:
         logger.error(f'Audio separation failed: {str(e)}')
@@ -196,35 +719,40 @@ def extract_audio_from_video(folder: str) -> bool:
         return True
     logger.info(f'Extracting audio from video: {folder}')
 
-    os.system(
-        f'ffmpeg -loglevel error -i "{video_path}" -vn -acodec pcm_s16le -ar 44100 -ac 2 "{audio_path}"')
-
-    time.sleep(1)
+    extract_audio(video_path, audio_path, 44100, 2)
     logger.info(f'音频提取完成: {folder}')
     return True
 
 
 def separate_all_audio_under_folder(root_folder: str, model_name: str = "htdemucs_ft", device: str = 'auto',
-                                    progress: bool = True, shifts: int = 5) -> None:
+                                    progress: bool = True, shifts: int = SHIFTS, two_stems: bool = TWO_STEMS,
+                                    gating: bool = MUSIC_GATING) -> None:
     """
     Separate all audio files under folder
     """
-    global model
     vocal_output_path, instruments_output_path = None, None
 
+    def separate_folder(subdir):
+        cached_stage(subdir, 'extract', ['download.mp4'], {'sample_rate': 44100, 'channels': 2},
+                     ['audio.wav'], lambda: extract_audio_from_video(subdir))
+        cached_stage(subdir, 'separate', ['audio.wav'],
+                     {'model_name': model_name, 'shifts': shifts, 'two_stems': two_stems,
+                      'chunk_seconds': CHUNK_SECONDS, 'overlap_seconds': OVERLAP_SECONDS,
+                      'music_gating': [MUSIC_FLOOR_DB, MUSIC_TONALITY_DB] if gating else None,
+                      'quantized': quantized(device)},
+                     ['audio_vocals.wav', 'audio_instruments.wav'],
+                     lambda: separate_audio(subdir, model_name, device, progress, shifts, two_stems, gating))
+
     try:
-        for subdir, dirs, files in os.walk(root_folder):
-            if 'download.mp4' not in files:
-                continue
-            if 'audio.wav' not in files:
-                extract_audio_from_video(subdir)
-            if 'audio_vocals.wav' not in files:
-                vocal_output_path, instruments_output_path = separate_audio(subdir, model_name, device, progress,
-                                                                          shifts)
-            elif 'audio_vocals.wav' in files and 'audio_instruments.wav' in files:
+        folders = video_folders(root_folder, 'download.mp4')
+        # Videos are separated concurrently so the scheduler can batch their windows together
+        with ThreadPoolExecutor(max_workers=max(1, min(len(folders), BATCH_WINDOWS))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, separate_folder, subdir)
+                       for subdir in folders]
+            for subdir, future in zip(folders, futures):
+                future.result()
                 vocal_output_path = os.path.join(subdir, 'audio_vocals.wav')
                 instruments_output_path = os.path.join(subdir, 'audio_instruments.wav')
-                logger.info(f'Audio already separated: {subdir}')
 
         logger.info(f'All audio separation completed: {root_folder}')
         return f'All audio separation completed: {root_folder}', vocal_output_path, instruments_output_path
@@ -1,13 +1,13 @@
 
 import os
-import torch
 import numpy as np
 from dotenv import load_dotenv
-from .step021_asr_whisperx import whisperx_transcribe_audio
-from .step022_asr_funasr import funasr_transcribe_audio
+from . import backends
 from .utils import save_wav
+from .artifact_cache import cached_stage, stage_pending
+from .manifest import video_folders
+from .audio_store import audio_store
 import json
-import librosa
 from loguru import logger
 load_dotenv()
 
@@ -37,7 +37,7 @@ def merge_segments(transcript, ending='!"\').:;?]}~！“”’）。：；？
 
 def generate_speaker_audio(folder, transcript):
     wav_path = os.path.join(folder, 'audio_vocals.wav')
-    audio_data, samplerate = librosa.load(wav_path, sr=24000)
+    audio_data, samplerate = audio_store.load(wav_path, 24000, 1)
     speaker_dict = dict()
     length = len(audio_data)
     delay = 0.05
@@ -58,23 +58,41 @@ def generate_speaker_audio(folder, transcript):
         save_wav(audio, speaker_file_path)
 
 
+def _asr_params(method, model_name, diarization, min_speakers, max_speakers):
+    params = {'method': method, 'diarization': diarization,
+              'min_speakers': min_speakers, 'max_speakers': max_speakers}
+    if method == 'WhisperX':
+        params['model_name'] = model_name
+    return params
+
 def transcribe_audio(method, folder, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True,min_speakers=None, max_speakers=None):
-    if os.path.exists(os.path.join(folder, 'transcript.json')):
-        logger.info(f'Transcript already exists in {folder}')
-        return True
-    
     wav_path = os.path.join(folder, 'audio_vocals.wav')
     if not os.path.exists(wav_path):
         return False
-    
+
+    def compute():
+        return _transcribe_audio(method, folder, model_name, download_root, device, batch_size, diarization,
+                                 min_speakers, max_speakers)
+
+    status, transcript = cached_stage(folder, 'asr', ['audio_vocals.wav'],
+                                      _asr_params(method, model_name, diarization, min_speakers, max_speakers),
+                                      ['transcript.json', 'SPEAKER'], compute)
+    if status != 'computed':
+        logger.info(f'Transcript already exists in {folder}')
+        return True
+    return transcript
+
+def _transcribe_audio(method, folder, model_name, download_root, device, batch_size, diarization, min_speakers, max_speakers):
+    wav_path = os.path.join(folder, 'audio_vocals.wav')
     logger.info(f'Transcribing {wav_path}')
     if device == 'auto':
+        import torch
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
     
     if method == 'WhisperX':
-        transcript = whisperx_transcribe_audio(wav_path, model_name, download_root, device, batch_size, diarization, min_speakers, max_speakers)
+        transcript = backends.get('asr', method)(wav_path, model_name, download_root, device, batch_size, diarization, min_speakers, max_speakers)
     elif method == 'FunASR':
-        transcript = funasr_transcribe_audio(wav_path, device, batch_size, diarization)
+        transcript = backends.get('asr', method)(wav_path, device, batch_size, diarization)
     else:
         logger.error('Invalid ASR method')
         raise ValueError('Invalid ASR method')
@@ -86,12 +104,33 @@ def transcribe_audio(method, folder, model_name: str = 'large', download_root='m
     generate_speaker_audio(folder, transcript)
     return transcript
 
+def group_by_language(roots, model_name='large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=False, min_speakers=None, max_speakers=None):
+    """
+    Order WhisperX video folders so that those in the same language are transcribed one after
+    another. The whisper pass of every folder that still needs transcribing runs here first
+    (its output is persisted and reused), so each alignment model is then loaded once.
+    """
+    params = _asr_params('WhisperX', model_name, diarization, min_speakers, max_speakers)
+    languages = {}
+    for root in roots:
+        if stage_pending(root, 'asr', ['audio_vocals.wav'], params, ['transcript.json', 'SPEAKER']):
+            languages[root] = backends.get('language', 'WhisperX')(
+                os.path.join(root, 'audio_vocals.wav'), model_name, download_root, device, batch_size)
+    if len(set(languages.values())) > 1:
+        logger.info(f'Grouping {len(languages)} videos by language: {sorted(set(languages.values()))}')
+    # Up-to-date folders first, then one group per language in order of first appearance
+    order = {language: i for i, language in reversed(list(enumerate(languages.values())))}
+    return sorted(roots, key=lambda root: order[languages[root]] + 1 if root in languages else 0)
+
 def transcribe_all_audio_under_folder(folder, asr_method, whisper_model_name: str = 'large', device='auto', batch_size=32, diarization=False, min_speakers=None, max_speakers=None):
     transcribe_json = None
-    for root, dirs, files in os.walk(folder):
-        if 'audio_vocals.wav' in files and 'transcript.json' not in files:
-            transcribe_json = transcribe_audio(asr_method, root, whisper_model_name, 'models/ASR/whisper', device, batch_size, diarization, min_speakers, max_speakers)
-        elif 'transcript.json' in files:
+    roots = list(video_folders(folder, 'audio_vocals.wav'))
+    if asr_method == 'WhisperX' and len(roots) > 1:
+        roots = group_by_language(roots, whisper_model_name, 'models/ASR/whisper', device, batch_size, diarization,
+                                  min_speakers, max_speakers)
+    for root in roots:
+        transcribe_audio(asr_method, root, whisper_model_name, 'models/ASR/whisper', device, batch_size, diarization, min_speakers, max_speakers)
+        if os.path.exists(os.path.join(root, 'transcript.json')):
             transcribe_json = json.load(open(os.path.join(root, 'transcript.json'), 'r', encoding='utf-8'))
 
             # logger.info(f'Transcript already exists in {root}')
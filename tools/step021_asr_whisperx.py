@@ -1,4 +1,6 @@
 import json
+import multiprocessing
+import threading
 import time
 import librosa
 import numpy as np
@@ -7,14 +9,46 @@ import os
 from loguru import logger
 import torch
 from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+from .model_manager import model_registry
+from .audio_store import audio_store
+from .artifact_cache import stage_key
+from .metrics import count as count_metric
 load_dotenv()
 
-whisper_model = None
-diarize_model = None
+# VAD settings the whisper model is loaded with; part of the key of the persisted segmentation
+VAD_OPTIONS = {'vad_onset': 0.500, 'vad_offset': 0.363}
+CHUNK_SIZE = 30
+# Reusable intermediate results kept next to the audio: VAD chunks with the detected language
+# (independent of the model size), and the raw per-segment decoding before alignment
+VAD_NAME = 'asr_vad.json'
+RAW_NAME = 'asr_raw.json'
+# Alignment models (one wav2vec2 checkpoint per language) kept resident at once
+ALIGN_MODEL_POOL_SIZE = int(os.getenv('ALIGN_MODEL_POOL_SIZE', 3))
+model_registry.limit('whisperx-align/', ALIGN_MODEL_POOL_SIZE)
+# Opt-in process-parallel CPU decoding: the VAD chunks of one file are split across
+# ASR_CPU_PROCESSES worker processes, each with its own int8 model and ASR_CPU_THREADS threads
+# (default: the cores divided among the workers). Ignored on GPU.
+CPU_PROCESSES = int(os.getenv('ASR_CPU_PROCESSES', '1'))
+CPU_THREADS = int(os.getenv('ASR_CPU_THREADS', '0'))
+# Tasks per worker process, so workers finishing early pick up more chunks
+CPU_TASKS_PER_PROCESS = 4
 
-align_model = None
-language_code = None
-align_metadata = None
+_cpu_pool = None
+_cpu_pool_key = None
+_cpu_pool_lock = threading.Lock()
+_worker_model = None
+
+def _resolve_device(device):
+    if device == 'auto':
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return device
+
+def _whisper_model_name(model_name, download_root):
+    if model_name == 'large':
+        pretrain_model = os.path.join(download_root,"faster-whisper-large-v3")
+        model_name = 'large-v3' if not os.path.isdir(pretrain_model) else pretrain_model
+    return model_name
 
 def init_whisperx():
     load_whisper_model()
@@ -22,74 +56,194 @@ def init_whisperx():
 
 def init_diarize():
     load_diarize_model()
+
+def whisper_model_key(model_name='large', download_root='models/ASR/whisper', device='auto'):
+    return f'whisperx/{_whisper_model_name(model_name, download_root)}@{_resolve_device(device)}'
+
+def _whisper_loader(model_name, download_root, device):
+    model_name = _whisper_model_name(model_name, download_root)
+    device = _resolve_device(device)
+    def loader():
+        logger.info(f'Loading WhisperX model: {model_name}')
+        if device=='cpu':
+            return whisperx.load_model(model_name, download_root=download_root, device=device, compute_type='int8',
+                                       vad_options=VAD_OPTIONS)
+        return whisperx.load_model(model_name, download_root=download_root, device=device, vad_options=VAD_OPTIONS)
+    return loader
     
 def load_whisper_model(model_name: str = 'large', download_root = 'models/ASR/whisper', device='auto'):
-    if model_name == 'large':
-        pretrain_model = os.path.join(download_root,"faster-whisper-large-v3")
-        model_name = 'large-v3' if not os.path.isdir(pretrain_model) else pretrain_model
-        
-    global whisper_model
-    if whisper_model is not None:
-        return
-    if device == 'auto':
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    logger.info(f'Loading WhisperX model: {model_name}')
-    t_start = time.time()
-    if device=='cpu':
-        whisper_model = whisperx.load_model(model_name, download_root=download_root, device=device, compute_type='int8')
-    else:
-        whisper_model = whisperx.load_model(model_name, download_root=download_root, device=device)
-    t_end = time.time()
-    logger.info(f'Loaded WhisperX model: {model_name} in {t_end - t_start:.2f}s')
+    return model_registry.preload(whisper_model_key(model_name, download_root, device),
+                                  _whisper_loader(model_name, download_root, device), _resolve_device(device))
+
+def align_model_key(language='en', device='auto'):
+    return f'whisperx-align/{language}@{_resolve_device(device)}'
+
+def _align_loader(language, device, model_dir):
+    device = _resolve_device(device)
+    def loader():
+        return whisperx.load_align_model(language_code=language, device=device, model_dir=model_dir)
+    return loader
 
 def load_align_model(language='en', device='auto', model_dir='models/ASR/whisper'):
-    global align_model, language_code, align_metadata
-    if align_model is not None and language_code == language:
-        return
-    if device == 'auto':
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    language_code = language
-    t_start = time.time()
-    align_model, align_metadata = whisperx.load_align_model(
-        language_code=language_code, device=device, model_dir = model_dir)
-    t_end = time.time()
-    logger.info(f'Loaded alignment model: {language_code} in {t_end - t_start:.2f}s')
+    return model_registry.preload(align_model_key(language, device), _align_loader(language, device, model_dir),
+                                  _resolve_device(device))
+
+def diarize_model_key(device='auto'):
+    return f'pyannote-diarize@{_resolve_device(device)}'
+
+def _diarize_loader(device):
+    device = _resolve_device(device)
+    def loader():
+        return whisperx.DiarizationPipeline(use_auth_token=os.getenv('HF_TOKEN'), device=device)
+    return loader
     
 def load_diarize_model(device='auto'):
-    global diarize_model
-    if diarize_model is not None:
-        return
-    if device == 'auto':
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
     t_start = time.time()
     try:
-        diarize_model = whisperx.DiarizationPipeline(use_auth_token=os.getenv('HF_TOKEN'), device=device)
-        t_end = time.time()
-        logger.info(f'Loaded diarization model in {t_end - t_start:.2f}s')
+        return model_registry.preload(diarize_model_key(device), _diarize_loader(device), _resolve_device(device))
     except Exception as e:
         t_end = time.time()
         logger.error(f"Failed to load diarization model in {t_end - t_start:.2f}s due to {str(e)}")
         logger.info("You have not set the HF_TOKEN, so the pyannote/speaker-diarization-3.1 model could not be downloaded.")
         logger.info("If you need to use the speaker diarization feature, please request access to the pyannote/speaker-diarization-3.1 model. Alternatively, you can choose not to enable this feature.")
+        return None
+
+def _cpu_threads(processes):
+    return CPU_THREADS or max(1, (os.cpu_count() or 1) // processes)
+
+def _init_cpu_worker(model_name, download_root, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = whisperx.load_model(model_name, download_root=download_root, device='cpu', compute_type='int8',
+                                        threads=threads, vad_options=VAD_OPTIONS)
+
+def _transcribe_cpu_chunks(audio_path, vad_segments, language, batch_size):
+    audio = np.load(audio_path, mmap_mode='c')
+    return _worker_model.transcribe(audio, batch_size=batch_size, language=language, chunk_size=CHUNK_SIZE,
+                                    vad_segments=vad_segments)['segments']
+
+def _cpu_pool_for(model_name, download_root, processes):
+    """Worker processes for model_name, started on first use and kept for the following files"""
+    global _cpu_pool, _cpu_pool_key
+    key = (model_name, download_root, processes, _cpu_threads(processes))
+    with _cpu_pool_lock:
+        if _cpu_pool_key != key:
+            if _cpu_pool is not None:
+                _cpu_pool.shutdown()
+            logger.info(f'Starting {processes} CPU transcription workers with {key[3]} threads each')
+            _cpu_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_cpu_worker, initargs=(model_name, download_root, key[3]))
+            _cpu_pool_key = key
+        return _cpu_pool
+
+def _transcribe_parallel(whisper_model, audio, wav_path, vad_segments, language, model_name, download_root, batch_size, processes=None):
+    """
+    Decode the VAD chunks of one file in CPU worker processes. Each worker decodes a
+    contiguous run of chunks exactly as transcribe() would; the runs are concatenated in
+    submission order, which is timestamp order.
+    """
+    processes = processes or CPU_PROCESSES
+    language = language or whisper_model.detect_language(audio)
+    # Workers map the 16 kHz audio from disk instead of receiving a copy per task
+    audio_path = os.path.join(os.path.dirname(wav_path), '.asr_audio.npy')
+    np.save(audio_path, audio)
+    per_task = max(1, min(batch_size, -(-len(vad_segments) // (processes * CPU_TASKS_PER_PROCESS))))
+    pool = _cpu_pool_for(_whisper_model_name(model_name, download_root), download_root, processes)
+    try:
+        futures = [pool.submit(_transcribe_cpu_chunks, audio_path, vad_segments[i:i + per_task], language, per_task)
+                   for i in range(0, len(vad_segments), per_task)]
+        segments = [segment for future in futures for segment in future.result()]
+    finally:
+        os.remove(audio_path)
+    return {'segments': segments, 'language': language}
+
+def _load_result(path, key):
+    """Content of a persisted result if it was produced under `key`"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f'Ignoring unreadable {path}: {e}')
+        return None
+    return result if result.get('key') == key else None
+
+def _save_result(path, result):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _transcribe_cached(audio, wav_path, model_name, download_root, device, batch_size):
+    """
+    Transcribe with the whisper model, reusing what earlier runs on the same audio persisted:
+    the raw segments when only alignment or diarization settings changed, otherwise the VAD
+    chunks and detected language so a different model size only redoes the decoding.
+    """
+    folder, audio_name = os.path.split(wav_path)
+    vad_path = os.path.join(folder, VAD_NAME)
+    raw_path = os.path.join(folder, RAW_NAME)
+    vad_key = stage_key(folder, 'asr-vad', [audio_name], dict(VAD_OPTIONS, chunk_size=CHUNK_SIZE))
+    compute_type = 'int8' if device == 'cpu' else 'float16'
+    raw_key = stage_key(folder, 'asr-raw', [audio_name], {'vad': vad_key, 'compute_type': compute_type,
+                                                          'model': _whisper_model_name(model_name, download_root)})
+
+    rec_result = _load_result(raw_path, raw_key)
+    if rec_result is not None:
+        logger.info(f'Reusing raw transcription from {raw_path}')
+        count_metric('asr_reuse')
+        return {'segments': rec_result['segments'], 'language': rec_result['language']}
+
+    vad = _load_result(vad_path, vad_key)
+    with model_registry.use(whisper_model_key(model_name, download_root, device),
+                            _whisper_loader(model_name, download_root, device), device) as whisper_model:
+        if vad is None:
+            vad = {'key': vad_key, 'segments': whisper_model.detect_speech(audio, CHUNK_SIZE), 'language': None}
+        else:
+            logger.info(f'Reusing VAD segments and language from {vad_path}')
+            count_metric('vad_reuse')
+        if device == 'cpu' and CPU_PROCESSES > 1 and len(vad['segments']) > 1:
+            rec_result = _transcribe_parallel(whisper_model, audio, wav_path, vad['segments'], vad['language'],
+                                              model_name, download_root, batch_size)
+        else:
+            rec_result = whisper_model.transcribe(audio, batch_size=batch_size, language=vad['language'],
+                                                  chunk_size=CHUNK_SIZE, vad_segments=vad['segments'])
+    if vad['language'] is None:
+        vad['language'] = rec_result['language']
+        _save_result(vad_path, vad)
+    _save_result(raw_path, {'key': raw_key, 'model': model_name, **rec_result})
+    return rec_result
+
+def transcription_language(wav_path, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32):
+    """
+    Language of the speech in wav_path. Runs (and persists) the whisper pass if no earlier run
+    did, so a following whisperx_transcribe_audio only aligns.
+    """
+    device = _resolve_device(device)
+    audio, _ = audio_store.load(wav_path, whisperx.audio.SAMPLE_RATE, 1)
+    return _transcribe_cached(audio, wav_path, model_name, download_root, device, batch_size)['language']
 
 def whisperx_transcribe_audio(wav_path, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True,min_speakers=None, max_speakers=None):
-    if device == 'auto':
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    load_whisper_model(model_name, download_root, device)
-    rec_result = whisper_model.transcribe(wav_path, batch_size=batch_size)
+    device = _resolve_device(device)
+    # Decoded once at 16 kHz mono and shared by transcription, alignment and diarization
+    audio, _ = audio_store.load(wav_path, whisperx.audio.SAMPLE_RATE, 1)
+    rec_result = _transcribe_cached(audio, wav_path, model_name, download_root, device, batch_size)
     
     if rec_result['language'] == 'nn':
         logger.warning(f'No language detected in file: {wav_path}')
         return False
     
-    load_align_model(rec_result['language'])
-    rec_result = whisperx.align(rec_result['segments'], align_model, align_metadata,
-                                wav_path, device, return_char_alignments=False)
+    language = rec_result['language']
+    with model_registry.use(align_model_key(language, device),
+                            _align_loader(language, device, download_root), device) as (align_model, align_metadata):
+        rec_result = whisperx.align(rec_result['segments'], align_model, align_metadata,
+                                    audio, device, return_char_alignments=False)
     
     if diarization:
-        load_diarize_model(device)
-        if diarize_model:
-            diarize_segments = diarize_model(wav_path,min_speakers=min_speakers, max_speakers=max_speakers)
+        if load_diarize_model(device) is not None:
+            with model_registry.use(diarize_model_key(device), _diarize_loader(device), device) as diarize_model:
+                diarize_segments = diarize_model(audio,min_speakers=min_speakers, max_speakers=max_speakers)
             rec_result = whisperx.assign_word_speakers(diarize_segments, rec_result)
         else:
             logger.warning("Diarization model not loaded, skipping speaker diarization")
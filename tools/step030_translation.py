@@ -6,12 +6,10 @@ import re
 from dotenv import load_dotenv
 import time
 from loguru import logger
-from tools.step031_translation_openai import openai_response
-from tools.step032_translation_llm import llm_response
-from tools.step033_translation_translator import translator_response
-from tools.step034_translation_ernie import ernie_response
-from tools.step035_translation_qwen import qwen_response
-from tools.step036_translation_ollama import ollama_response
+from tools import backends
+from tools.metrics import timed
+from tools.artifact_cache import cached_stage
+from tools.manifest import video_folders
 
 load_dotenv()
 import traceback
@@ -153,9 +151,9 @@ def summarize(info, transcript, target_language='English', method = 'LLM'):
     
     if method in ['Google Translate', 'Bing Translate']:
         full_description = f'{info_message}\n{transcript}\n{info_message}\n'
-        translation = translator_response(full_description, target_language)
+        translation = backends.get('translation', method)(full_description, target_language)
         return {
-                'title': translator_response(info['title'], target_language),
+                'title': backends.get('translation', method)(info['title'], target_language),
                 'author': info['uploader'],
                 'summary': translation,
                 'language': target_language
@@ -176,20 +174,15 @@ def summarize(info, transcript, target_language='English', method = 'LLM'):
                 {'role': 'system', 'content': f'You are a expert in the field of this video. Please summarize the video in JSON format.\n```json\n{{"title": "the title of the video", "summary", "the summary of the video"}}\n```'},
                 {'role': 'user', 'content': full_description+retry_message},
             ]
-            if method == 'LLM':
-                response = llm_response(messages)
-            elif method == 'OpenAI':
-                response = openai_response(messages)
-            elif method == 'Ernie':
-                system_content = messages[0]['content']
-                user_messages = messages[1:]
-                response = ernie_response(user_messages, system=system_content)
-            elif method == '阿里云-通义千问':
-                response = qwen_response(messages)
-            elif method == 'Ollama':  # Adding support for Ollama
-                response = ollama_response(messages)
-            else:
-                raise Exception('Invalid method')
+            with timed('llm', method):
+                if method == 'Ernie':
+                    # Ernie takes the system prompt separately from the messages
+                    system_content = messages[0]['content']
+                    user_messages = messages[1:]
+                    response = backends.get('translation', method)(user_messages, system=system_content)
+                else:
+                    # Unknown methods raise in backends.get
+                    response = backends.get('translation', method)(messages)
             summary = response.replace('\n', '')
             if '视频标题' in summary:
                 raise Exception("Contains '视频标题'")
@@ -271,9 +264,11 @@ def _translate(summary, transcript, target_language='English', method='LLM'):
 
         retry_message = 'Only translate the quoted sentence and give me the final translation.'
         if method == 'Google Translate':
-            translation = translator_response(text, to_language = target_language, translator_server='google')
+            with timed('translator', 'google'):
+                translation = backends.get('translation', method)(text, to_language = target_language, translator_server='google')
         elif method == 'Bing Translate':
-            translation = translator_response(text, to_language = target_language, translator_server='bing')
+            with timed('translator', 'bing'):
+                translation = backends.get('translation', method)(text, to_language = target_language, translator_server='bing')
         else:
             for retry in range(10):
                 messages = fixed_message + \
@@ -281,20 +276,15 @@ def _translate(summary, transcript, target_language='English', method='LLM'):
                                     'content': f'Translate:"{text}"'}]
                 # print(messages)
                 try:
-                    if method == 'LLM':
-                        response = llm_response(messages)
-                    elif method == 'OpenAI':
-                        response = openai_response(messages)
-                    elif method == 'Ernie':
-                        system_content = messages[0]['content']
-                        user_messages = messages[1:]
-                        response = ernie_response(user_messages, system=system_content)
-                    elif method == 'Qwen':
-                        response = qwen_response(messages)
-                    elif method == 'Ollama':  # Adding support for Ollama
-                        response = ollama_response(messages)
-                    else:
-                        raise Exception('Invalid method')
+                    with timed('llm', method):
+                        if method == 'Ernie':
+                            # Ernie takes the system prompt separately from the messages
+                            system_content = messages[0]['content']
+                            user_messages = messages[1:]
+                            response = backends.get('translation', method)(user_messages, system=system_content)
+                        else:
+                            # Unknown methods raise in backends.get
+                            response = backends.get('translation', method)(messages)
                     translation = response.replace('\n', '')
                     logger.info(f'Original text: {text}')
                     logger.info(f'Translation: {translation}')
@@ -315,10 +305,20 @@ def _translate(summary, transcript, target_language='English', method='LLM'):
     return full_translation
 
 def translate(method, folder, target_language='English'):
-    if os.path.exists(os.path.join(folder, 'translation.json')):
+    if not os.path.exists(os.path.join(folder, 'transcript.json')):
+        return False
+    inputs = ['transcript.json', 'download.info.json']
+    params = {'method': method, 'target_language': target_language}
+    status, result = cached_stage(folder, 'translate', inputs, params, ['summary.json', 'translation.json'],
+                                  lambda: _translate_folder(method, folder, target_language))
+    if status != 'computed':
         logger.info(f'Translation already exists in {folder}')
-        return True
-    
+        summary = json.load(open(os.path.join(folder, 'summary.json'), 'r', encoding='utf-8'))
+        transcript = json.load(open(os.path.join(folder, 'translation.json'), 'r', encoding='utf-8'))
+        return summary, transcript
+    return result
+
+def _translate_folder(method, folder, target_language):
     info_path = os.path.join(folder, 'download.info.json')
     # Not necessarily download.info.json
     if os.path.exists(info_path):
@@ -344,7 +344,7 @@ def translate(method, folder, target_language='English'):
         summary = summarize(info, transcript, target_language, method)
         if summary is None:
             logger.error(f'Failed to summarize {folder}')
-            return False
+            return None, None
         with open(summary_path, 'w', encoding='utf-8') as f:
             json.dump(summary, f, indent=2, ensure_ascii=False)
 
@@ -359,12 +359,8 @@ def translate(method, folder, target_language='English'):
 
 def translate_all_transcript_under_folder(folder, method, target_language):
     summary_json , translate_json = None, None
-    for root, dirs, files in os.walk(folder):
-        if 'transcript.json' in files and 'translation.json' not in files:
-            summary_json , translate_json = translate(method, root, target_language)
-        elif 'translation.json' in files:
-            summary_json = json.load(open(os.path.join(root, 'summary.json'), 'r', encoding='utf-8'))
-            translate_json = json.load(open(os.path.join(root, 'translation.json'), 'r', encoding='utf-8'))
+    for root in video_folders(folder, 'transcript.json'):
+        summary_json , translate_json = translate(method, root, target_language)
     print(summary_json, translate_json)
     return f'Translated all videos under {folder}',summary_json , translate_json
 
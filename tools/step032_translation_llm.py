@@ -6,18 +6,19 @@ import torch
 from dotenv import load_dotenv
 import time
 from loguru import logger
+from .model_manager import model_registry
 
 load_dotenv()
 
-model = None
-tokenizer = None
 model_name = os.getenv('MODEL_NAME', 'qwen/Qwen1.5-4B-Chat')
 if 'Qwen' not in model_name:
     model_name = 'qwen/Qwen1.5-4B-Chat'
 
-def init_llm_model(model_name):
-    global model, tokenizer
-    if 'Qwen' in model_name:
+def llm_model_key(model_name):
+    return f'llm/{model_name}'
+
+def _llm_loader(model_name):
+    def loader():
         from transformers import AutoModelForCausalLM, AutoTokenizer
         model_path = os.path.join('models/LLM', os.path.basename(model_name))
         pretrained_path = model_name if not os.path.isdir(model_path) else model_path
@@ -29,29 +30,35 @@ def init_llm_model(model_name):
         )
         tokenizer = AutoTokenizer.from_pretrained(pretrained_path)
         print('Finish Load model', pretrained_path)
+        return model, tokenizer
+    return loader
+
+def init_llm_model(model_name):
+    if 'Qwen' in model_name:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        model_registry.preload(llm_model_key(model_name), _llm_loader(model_name), device)
 
 def llm_response(messages, device='auto'):
-    if model is None:
-        init_llm_model(model_name)
     if 'Qwen' in model_name:
-        text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
         if device == 'auto':
             device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model_inputs = tokenizer([text], return_tensors="pt").to(device)
+        with model_registry.use(llm_model_key(model_name), _llm_loader(model_name), device) as (model, tokenizer):
+            text = tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            model_inputs = tokenizer([text], return_tensors="pt").to(device)
 
-        generated_ids = model.generate(
-            model_inputs.input_ids,
-            max_new_tokens=512
-        )
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
+            generated_ids = model.generate(
+                model_inputs.input_ids,
+                max_new_tokens=512
+            )
+            generated_ids = [
+                output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+            ]
 
-        response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+            response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
         return response
     return ''
 
@@ -1,18 +1,18 @@
 import json
 import os
 import re
-import librosa
 
 from loguru import logger
 import numpy as np
 
-from .utils import save_wav, save_wav_norm
-# from .step041_tts_bytedance import tts as bytedance_tts
-from .step042_tts_xtts import tts as xtts_tts
-from .step043_tts_cosyvoice import tts as cosyvoice_tts
-from .step044_tts_edge_tts import tts as edge_tts
+from .artifact_cache import cached_stage
+from .metrics import timed
+from .manifest import video_folders
+from .audio_store import audio_store
+from .timeline import Timeline, peak
+from . import backends
 from .cn_tx import TextNorm
-from audiostretchy.stretch import stretch_audio
+from .time_stretch import BATCH_LINES, output_length, stretch, stretch_batch
 normalizer = TextNorm()
 def preprocess_text(text):
     text = text.replace('AI', 'artificial intelligence')
@@ -23,24 +23,30 @@ def preprocess_text(text):
     return text
     
     
-def adjust_audio_length(wav_path, desired_length, sample_rate = 24000, min_speed_factor = 0.6, max_speed_factor = 1.1):
+def load_line(wav_path, sample_rate = 24000):
     try:
-        wav, sample_rate = librosa.load(wav_path, sr=sample_rate)
+        wav, sample_rate = audio_store.load(wav_path, sample_rate, 1)
     except Exception as e:
         if wav_path.endswith('.wav'):
             wav_path = wav_path.replace('.wav', '.mp3')
-        wav, sample_rate = librosa.load(wav_path, sr=sample_rate)
+        wav, sample_rate = audio_store.load(wav_path, sample_rate, 1)
+    # Each line is read once; keep it out of the store
+    audio_store.invalidate(wav_path)
+    return wav
+
+
+def speed_factor(current_length, desired_length, min_speed_factor = 0.6, max_speed_factor = 1.1):
+    factor = max(min(desired_length / current_length, max_speed_factor), min_speed_factor)
+    logger.info(f"Speed Factor {factor}")
+    return factor
+
+
+def adjust_audio_length(wav_path, desired_length, sample_rate = 24000, min_speed_factor = 0.6, max_speed_factor = 1.1):
+    wav = load_line(wav_path, sample_rate)
     current_length = len(wav)/sample_rate
-    speed_factor = max(
-        min(desired_length / current_length, max_speed_factor), min_speed_factor)
-    logger.info(f"Speed Factor {speed_factor}")
-    desired_length = current_length * speed_factor
-    if wav_path.endswith('.wav'):
-        target_path = wav_path.replace('.wav', f'_adjusted.wav')
-    elif wav_path.endswith('.mp3'):
-        target_path = wav_path.replace('.mp3', f'_adjusted.wav')
-    stretch_audio(wav_path, target_path, ratio=speed_factor, sample_rate=sample_rate)
-    wav, sample_rate = librosa.load(target_path, sr=sample_rate)
+    factor = speed_factor(current_length, desired_length, min_speed_factor, max_speed_factor)
+    desired_length = current_length * factor
+    wav = stretch(wav, factor, sample_rate)
     return wav[:int(desired_length*sample_rate)], desired_length
 
 tts_support_languages = {
@@ -55,6 +61,19 @@ tts_support_languages = {
 
 def generate_wavs(method, folder, target_language='English', voice = 'en-US-JennyNeural'):
     assert method in ['xtts', 'bytedance', 'cosyvoice', 'EdgeTTS']
+    inputs = ['translation.json', 'SPEAKER', 'audio_vocals.wav', 'audio_instruments.wav']
+    params = {'method': method, 'target_language': target_language}
+    if method == 'EdgeTTS':
+        params['voice'] = voice
+    outputs = ['wavs', 'audio_tts.wav', 'audio_combined.wav', 'translation.json']
+    status, result = cached_stage(folder, 'tts', inputs, params, outputs,
+                                  lambda: _generate_wavs(method, folder, target_language, voice))
+    if status != 'computed':
+        logger.info(f'Wavs already generated in {folder}')
+        return os.path.join(folder, 'audio_combined.wav'), os.path.join(folder, 'audio.wav')
+    return result
+
+def _generate_wavs(method, folder, target_language, voice):
     transcript_path = os.path.join(folder, 'translation.json')
     output_folder = os.path.join(folder, 'wavs')
     if not os.path.exists(output_folder):
@@ -72,72 +91,79 @@ def generate_wavs(method, folder, target_language='English', voice = 'en-US-Jenn
         logger.error(f'{method} does not support {target_language}')
         return f'{method} does not support {target_language}'
         
-    full_wav = np.zeros((0, ))
-    for i, line in enumerate(transcript):
-        speaker = line['speaker']
-        text = preprocess_text(line['translation'])
-        output_path = os.path.join(output_folder, f'{str(i).zfill(4)}.wav')
-        speaker_wav = os.path.join(folder, 'SPEAKER', f'{speaker}.wav')
-        # if num_speakers == 1:
-            # bytedance_tts(text, output_path, speaker_wav, voice_type='BV701_streaming')
-        
-        if method == 'bytedance':
-            bytedance_tts(text, output_path, speaker_wav, target_language = target_language)
-        elif method == 'xtts':
-            xtts_tts(text, output_path, speaker_wav, target_language = target_language)
-        elif method == 'cosyvoice':
-            cosyvoice_tts(text, output_path, speaker_wav, target_language = target_language)
-        elif method == 'EdgeTTS':
-            edge_tts(text, output_path, target_language = target_language, voice = voice)
-        start = line['start']
-        end = line['end']
-        length = end-start
-        last_end = len(full_wav)/24000
-        if start > last_end:
-            full_wav = np.concatenate((full_wav, np.zeros((int((start - last_end) * 24000), ))))
-        start = len(full_wav)/24000
-        line['start'] = start
-        if i < len(transcript) - 1:
-            next_line = transcript[i+1]
-            next_end = next_line['end']
-            end = min(start + length, next_end)
-        wav, length = adjust_audio_length(output_path, end-start)
-
-        full_wav = np.concatenate((full_wav, wav))
-        line['end'] = start + length
-        
-    vocal_wav, sr = librosa.load(os.path.join(folder, 'audio_vocals.wav'), sr=24000)
-    full_wav = full_wav / np.max(np.abs(full_wav)) * np.max(np.abs(vocal_wav))
-    save_wav(full_wav, os.path.join(folder, 'audio_tts.wav'))
+    sample_rate = 24000
+    with Timeline(os.path.join(folder, '.timeline.f32'), sample_rate) as timeline:
+        # Lines are synthesized and fitted to their slots BATCH_LINES at a time, so the group is
+        # stretched in one batched call
+        for group_start in range(0, len(transcript), BATCH_LINES):
+            wavs = []
+            for i in range(group_start, min(group_start + BATCH_LINES, len(transcript))):
+                line = transcript[i]
+                speaker = line['speaker']
+                text = preprocess_text(line['translation'])
+                output_path = os.path.join(output_folder, f'{str(i).zfill(4)}.wav')
+                speaker_wav = os.path.join(folder, 'SPEAKER', f'{speaker}.wav')
+                # if num_speakers == 1:
+                    # bytedance_tts(text, output_path, speaker_wav, voice_type='BV701_streaming')
+
+                tts = backends.get('tts', method)
+                with timed('tts', method):
+                    if method == 'bytedance':
+                        tts(text, output_path, speaker_wav)
+                    elif method in ('xtts', 'cosyvoice'):
+                        tts(text, output_path, speaker_wav, target_language = target_language)
+                    elif method == 'EdgeTTS':
+                        tts(text, output_path, target_language = target_language, voice = voice)
+                wavs.append(load_line(output_path, sample_rate))
+
+            # Each line's slot depends only on the stretched lengths before it, which the speed
+            # factors give without stretching: plan the group on a frame count that pads like
+            # the timeline, then stretch and append
+            frames = timeline.frames
+            starts, factors, sizes = [], [], []
+            for i, wav in enumerate(wavs, group_start):
+                line = transcript[i]
+                start = line['start']
+                starts.append(start)
+                end = line['end']
+                length = end-start
+                if start > frames / sample_rate:
+                    frames += int((start - frames / sample_rate) * sample_rate)
+                start = frames / sample_rate
+                line['start'] = start
+                if i < len(transcript) - 1:
+                    next_line = transcript[i+1]
+                    next_end = next_line['end']
+                    end = min(start + length, next_end)
+                current_length = len(wav)/sample_rate
+                factor = speed_factor(current_length, end-start)
+                length = current_length * factor
+                factors.append(factor)
+                sizes.append(int(length*sample_rate))
+                frames += min(sizes[-1], output_length(len(wav), factor))
+                line['end'] = start + length
+
+            # Padding to the original starts repeats the planned frame counts exactly
+            for start, wav, size in zip(starts, stretch_batch(wavs, factors, sample_rate), sizes):
+                timeline.pad_to(start)
+                timeline.append(wav[:size])
+
+        # The dubbed speech is scaled to the loudness peak of the original vocals
+        vocal_peak = peak(audio_store.stream(os.path.join(folder, 'audio_vocals.wav'), 24000, 1))
+        instruments = audio_store.stream(os.path.join(folder, 'audio_instruments.wav'), 24000, 1)
+        timeline.render(os.path.join(folder, 'audio_tts.wav'), os.path.join(folder, 'audio_combined.wav'),
+                        vocal_peak, instruments)
     with open(transcript_path, 'w', encoding='utf-8') as f:
         json.dump(transcript, f, indent=2, ensure_ascii=False)
-    
-    instruments_wav, sr = librosa.load(os.path.join(folder, 'audio_instruments.wav'), sr=24000)
-    len_full_wav = len(full_wav)
-    len_instruments_wav = len(instruments_wav)
-    
-    if len_full_wav > len_instruments_wav:
-        # If full_wav is longer, extend instruments_wav to the same length
-        instruments_wav = np.pad(
-            instruments_wav, (0, len_full_wav - len_instruments_wav), mode='constant')
-    elif len_instruments_wav > len_full_wav:
-        # If instruments_wav is longer, extend full_wav to the same length
-        full_wav = np.pad(
-            full_wav, (0, len_instruments_wav - len_full_wav), mode='constant')
-    combined_wav = full_wav + instruments_wav
-    # combined_wav /= np.max(np.abs(combined_wav))
-    save_wav_norm(combined_wav, os.path.join(folder, 'audio_combined.wav'))
     logger.info(f'Generated {os.path.join(folder, "audio_combined.wav")}')
     return os.path.join(folder, 'audio_combined.wav'), os.path.join(folder, 'audio.wav')
 
 def generate_all_wavs_under_folder(root_folder, method, target_language='English', voice = 'en-US-JennyNeural'):
     wav_combined, wav_ori = None, None
-    for root, dirs, files in os.walk(root_folder):
-        if 'translation.json' in files and 'audio_combined.wav' not in files:
-            wav_combined, wav_ori = generate_wavs(method, root, target_language, voice)
-        elif 'audio_combined.wav' in files:
-            wav_combined, wav_ori = os.path.join(root, 'audio_combined.wav'), os.path.join(root, 'audio.wav')
-            logger.info(f'Wavs already generated in {root}')
+    for root in video_folders(root_folder, 'translation.json'):
+        result = generate_wavs(method, root, target_language, voice)
+        if isinstance(result, tuple):
+            wav_combined, wav_ori = result
     return f'Generated all wavs under {root_folder}', wav_combined, wav_ori
 
 if __name__ == '__main__':
@@ -14,7 +14,6 @@ import numpy as np
 import requests
 from loguru import logger
 from dotenv import load_dotenv
-from pyannote.audio import Model, Inference
 from scipy.spatial.distance import cosine
 
 load_dotenv()
@@ -54,13 +53,21 @@ request_json = {
     }
 }
 
-embedding_model = Model.from_pretrained(
-    "pyannote/embedding", use_auth_token=os.getenv('HF_TOKEN'))
-embedding_inference = Inference(
-    embedding_model, window="whole")
+embedding_inference = None
+
+def get_embedding_inference():
+    """Load the pyannote speaker embedding model on first use"""
+    global embedding_inference
+    if embedding_inference is None:
+        from pyannote.audio import Model, Inference
+        embedding_model = Model.from_pretrained(
+            "pyannote/embedding", use_auth_token=os.getenv('HF_TOKEN'))
+        embedding_inference = Inference(
+            embedding_model, window="whole")
+    return embedding_inference
 
 def generate_embedding(wav_path):
-    embedding = embedding_inference(wav_path)
+    embedding = get_embedding_inference()(wav_path)
     return embedding
 
 def generate_speaker_to_voice_type(folder):
@@ -141,7 +148,7 @@ def get_available_speakers():
         while retry > 0:
             try:
                 tts('YouDub 是一个创新的开源工具，专注于将 YouTube 等平台的优质视频翻译和配音为中文版本。此工具融合了先进的 AI 技术，包括语音识别、大型语言模型翻译以及 AI 声音克隆技术，为中文用户提供具有原始 YouTuber 音色的中文配音视频。', output_path, None, voice_type=voice_type)
-                embedding = embedding_inference(output_path)
+                embedding = generate_embedding(output_path)
                 np.save(output_path.replace('.wav', '.npy'), embedding)
                 break
             except Exception as e:
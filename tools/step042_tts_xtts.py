@@ -5,34 +5,36 @@ import numpy as np
 import torch
 import time
 from .utils import save_wav
-model = None
+from .model_manager import model_registry
 
 '''
 Supported languages: Arabic: ar, Brazilian Portuguese: pt , Mandarin Chinese: zh-cn, Czech: cs, Dutch: nl, English: en, French: fr, German: de, Italian: it, Polish: pl, Russian: ru, Spanish: es, Turkish: tr, Japanese: ja, Korean: ko, Hungarian: hu, Hindi: hi
 '''
 def init_TTS():
     load_model()
-    
-def load_model(model_path="models/TTS/XTTS-v2", device='auto'):
-    global model
-    if model is not None:
-        return
 
-    if device=='auto':
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-          
-    logger.info(f'Loading TTS model from {model_path}')
-    t_start = time.time()
-    if os.path.isdir(model_path):
-        print(f"Loading TTS model from {model_path}")
-        model = TTS(
-            model_path = model_path,
-            config_path = os.path.join(model_path, 'config.json'),
-        ).to(device)
-    else:
-        model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-    t_end = time.time()
-    logger.info(f'TTS model loaded in {t_end - t_start:.2f}s')
+def resolve_device(device='auto'):
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return str(device)
+
+def model_key(model_path, device):
+    return f'xtts/{os.path.basename(model_path)}@{device}'
+
+def _model_loader(model_path, device):
+    def loader():
+        if os.path.isdir(model_path):
+            print(f"Loading TTS model from {model_path}")
+            return TTS(
+                model_path = model_path,
+                config_path = os.path.join(model_path, 'config.json'),
+            ).to(device)
+        return TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+    return loader
+
+def load_model(model_path="models/TTS/XTTS-v2", device='auto'):
+    device = resolve_device(device)
+    return model_registry.preload(model_key(model_path, device), _model_loader(model_path, device), device)
 
 # XTTS-v2 supports 17 languages: English (en), Spanish (es), French (fr), German (de), Italian (it), 
 # Portuguese (pt), Polish (pl), Turkish (tr), Russian (ru), Dutch (nl), Czech (cs), Arabic (ar), 
@@ -56,26 +58,24 @@ language_map = {
     'Korean': 'ko',
 }
 def tts(text, output_path, speaker_wav, model_name="models/TTS/XTTS-v2", device='auto', target_language='English'):
-    global model
     language = language_map[target_language]
     assert language in ['ar', 'pt', 'zh-cn', 'cs', 'nl', 'en', 'fr', 'de', 'it', 'pl', 'ru', 'es', 'tr', 'ja', 'ko', 'hu', 'hi']
     if os.path.exists(output_path):
         logger.info(f'TTS {text} 已存在')
         return
     
-    if model is None:
-        load_model(model_name, device)
-    
-    for retry in range(3):
-        try:
-            wav = model.tts(text, speaker_wav=speaker_wav, language=language)
-            wav = np.array(wav)
-            save_wav(wav, output_path)
-            logger.info(f'TTS {text}')
-            break
-        except Exception as e:
-            logger.warning(f'TTS {text} 失败')
-            logger.warning(e)
+    device = resolve_device(device)
+    with model_registry.use(model_key(model_name, device), _model_loader(model_name, device), device) as model:
+        for retry in range(3):
+            try:
+                wav = model.tts(text, speaker_wav=speaker_wav, language=language)
+                wav = np.array(wav)
+                save_wav(wav, output_path)
+                logger.info(f'TTS {text}')
+                break
+            except Exception as e:
+                logger.warning(f'TTS {text} 失败')
+                logger.warning(e)
 
 
 if __name__ == '__main__':
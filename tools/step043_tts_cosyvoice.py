@@ -11,7 +11,7 @@ from cosyvoice.cli.cosyvoice import CosyVoice
 from cosyvoice.utils.file_utils import load_wav
 import torchaudio
 from modelscope import snapshot_download
-model = None
+from .model_manager import model_registry
 
 def download_cosyvoice():
     snapshot_download('iic/CosyVoice-300M', local_dir='models/TTS/CosyVoice-300M')
@@ -19,20 +19,24 @@ def download_cosyvoice():
 def init_cosyvoice():
     load_model()
     
-def load_model(model_path="models/TTS/CosyVoice-300M", device='auto'):
-    global model
-    if model is not None:
-        return
+def resolve_device(device='auto'):
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return str(device)
+
+def model_key(model_path, device):
+    return f'cosyvoice/{os.path.basename(model_path)}@{device}'
+
+def _model_loader(model_path):
+    def loader():
+        if not os.path.exists(model_path):
+            download_cosyvoice()
+        return CosyVoice(model_path)
+    return loader
 
-    if device=='auto':
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    logger.info(f'Loading CoxyVoice model from {model_path}')
-    t_start = time.time()
-    if not os.path.exists(model_path):
-        download_cosyvoice()
-    model = CosyVoice(model_path)
-    t_end = time.time()
-    logger.info(f'CoxyVoice model loaded in {t_end - t_start:.2f}s')
+def load_model(model_path="models/TTS/CosyVoice-300M", device='auto'):
+    device = resolve_device(device)
+    return model_registry.preload(model_key(model_path, device), _model_loader(model_path), device)
     
 #  <|zh|><|en|><|jp|><|yue|><|ko|> for Chinese/English/Japanese/Cantonese/Korean
 language_map = {
@@ -44,26 +48,23 @@ language_map = {
 }
 
 def tts(text, output_path, speaker_wav, model_name="models/TTS/CosyVoice-300M", device='auto', target_language='English'):
-    global model
-    
     if os.path.exists(output_path):
         logger.info(f'TTS {text} 已存在')
         return
     
-    if model is None:
-        load_model(model_name, device)
-    
-    for retry in range(3):
-        try:
-            prompt_speech_16k = load_wav(speaker_wav, 16000)
-            output = model.inference_cross_lingual(f'<|{language_map[target_language]}|>{text}', prompt_speech_16k)
-            torchaudio.save(output_path, output['tts_speech'], 22050)
+    device = resolve_device(device)
+    with model_registry.use(model_key(model_name, device), _model_loader(model_name), device) as model:
+        for retry in range(3):
+            try:
+                prompt_speech_16k = load_wav(speaker_wav, 16000)
+                output = model.inference_cross_lingual(f'<|{language_map[target_language]}|>{text}', prompt_speech_16k)
+                torchaudio.save(output_path, output['tts_speech'], 22050)
 
-            logger.info(f'TTS {text}')
-            break
-        except Exception as e:
-            logger.warning(f'TTS {text} 失败')
-            logger.warning(e)
+                logger.info(f'TTS {text}')
+                break
+            except Exception as e:
+                logger.warning(f'TTS {text} 失败')
+                logger.warning(e)
 
 
 if __name__ == '__main__':
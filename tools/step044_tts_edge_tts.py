@@ -1,14 +1,10 @@
 import os
 from loguru import logger
 import numpy as np
-import torch
 import time
 from .utils import save_wav
 import sys
 
-import torchaudio
-model = None
-
 
 
 # Language codes for Chinese/English/Japanese/Cantonese/Korean
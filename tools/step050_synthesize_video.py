@@ -4,12 +4,16 @@ import os
 import shutil
 import string
 import subprocess
-import time
 import random
 import traceback
 
 from loguru import logger
 
+from .artifact_cache import cached_stage, file_digest
+from .metrics import timed
+from .manifest import video_folders
+from .media_io import FFmpegError, run_ffmpeg
+
 
 def split_text(input_data,
                punctuations=['，', '；', '：', '。', '？', '！', '\n', '"']):
@@ -88,7 +92,8 @@ def generate_srt(translation, srt_path, speed_up=1, max_line_char=30):
 def get_aspect_ratio(video_path):
     command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
                '-show_entries', 'stream=width,height', '-of', 'json', video_path]
-    result = subprocess.run(command, capture_output=True, text=True)
+    with timed('ffmpeg', 'ffprobe'):
+        result = subprocess.run(command, capture_output=True, text=True)
     dimensions = json.loads(result.stdout)['streams'][0]
     return dimensions['width'] / dimensions['height']
 
@@ -108,10 +113,23 @@ def convert_resolution(aspect_ratio, resolution='1080p'):
     return width, height
     
 def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='1080p', background_music=None, watermark_path=None, bgm_volume=0.5, video_volume=1.0):
-    # if os.path.exists(os.path.join(folder, 'video.mp4')):
-    #     logger.info(f'Video already synthesized in {folder}')
-    #     return
-    
+    if not os.path.exists(os.path.join(folder, 'translation.json')) or \
+            not os.path.exists(os.path.join(folder, 'audio_combined.wav')):
+        return
+    params = {
+        'subtitles': subtitles, 'speed_up': speed_up, 'fps': fps, 'resolution': resolution,
+        'background_music': file_digest(background_music) if background_music else None,
+        'watermark': file_digest(watermark_path) if watermark_path else None,
+        'bgm_volume': bgm_volume, 'video_volume': video_volume,
+    }
+    inputs = ['download.mp4', 'audio_combined.wav', 'translation.json']
+    cached_stage(folder, 'synthesize', inputs, params, ['video.mp4', 'subtitles.srt'],
+                 lambda: _synthesize_video(folder, subtitles, speed_up, fps, resolution, background_music,
+                                           watermark_path, bgm_volume, video_volume))
+    final_video = os.path.join(folder, 'video.mp4')
+    return final_video if os.path.exists(final_video) else None
+
+def _synthesize_video(folder, subtitles, speed_up, fps, resolution, background_music, watermark_path, bgm_volume, video_volume):
     translation_path = os.path.join(folder, 'translation.json')
     input_audio = os.path.join(folder, 'audio_combined.wav')
     input_video = os.path.join(folder, 'download.mp4')
@@ -143,7 +161,6 @@ def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='
     if watermark_path:
         watermark_filter = f";[2:v]scale=iw*0.15:ih*0.15[wm];[v][wm]overlay=W-w-10:H-h-10[v]"
         ffmpeg_command = [
-            'ffmpeg',
             '-i', input_video,
             '-i', input_audio,
             '-i', watermark_path,
@@ -160,7 +177,6 @@ def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='
         ]
     else:
         ffmpeg_command = [
-            'ffmpeg',
             '-i', input_video,
             '-i', input_audio,
             '-filter_complex', filter_complex,
@@ -174,14 +190,12 @@ def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='
             '-y',
             '-threads', '2',
         ]
-    subprocess.run(ffmpeg_command)
-    time.sleep(1)
+    run_ffmpeg(ffmpeg_command, 'encode')
 
     # Apply background music if specified
     if background_music:
         final_video_with_bgm = final_video.replace('.mp4', '_bgm.mp4')
         ffmpeg_command_bgm = [
-            'ffmpeg',
             '-i', final_video,                # Original video with audio
             '-i', background_music,           # Background music
             '-filter_complex', f'[0:a]volume={video_volume}[v0];[1:a]volume={bgm_volume}[v1];[v0][v1]amix=inputs=2:duration=first[a]',
@@ -193,10 +207,8 @@ def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='
             '-y',
             '-threads', '2'
         ]
-        subprocess.run(ffmpeg_command_bgm)
-        os.remove(final_video)
-        os.rename(final_video_with_bgm, final_video)
-        time.sleep(1)
+        run_ffmpeg(ffmpeg_command_bgm, 'mix_bgm')
+        os.replace(final_video_with_bgm, final_video)
     # Subtitles are not critical, so we can use try-catch
     try:
         if subtitles:
@@ -206,7 +218,6 @@ def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='
             if os.path.exists(final_video):
                 os.remove(final_video)
             os.rename(final_video_with_subtitles, final_video)
-            time.sleep(1)
     except Exception as e:
         logger.info(f"An error occurred: {e}")
         traceback.format_exc()
@@ -306,7 +317,6 @@ def add_subtitles(video_path, srt_path, output_path, subtitle_filter=None, metho
 
                 # Build command
                 command = [
-                    'ffmpeg',
                     '-i', f"{temp_video_path}",
                     '-vf', f"{filter_option}",
                     '-c:a', 'copy',
@@ -315,12 +325,10 @@ def add_subtitles(video_path, srt_path, output_path, subtitle_filter=None, metho
                     '-threads', '2',
                 ]
 
-                logger.info(f"Executing FFmpeg command: {' '.join(command)}")
+                logger.info(f"Executing FFmpeg command: ffmpeg {' '.join(command)}")
 
                 # Execute command
-                result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                stderr_output = result.stderr.decode('utf-8', errors='ignore')
-                logger.debug(f"FFmpeg output: {stderr_output}")
+                run_ffmpeg(command, 'subtitles')
 
                 # Check if output file was successfully generated
                 if os.path.exists(temp_output_path):
@@ -333,10 +341,9 @@ def add_subtitles(video_path, srt_path, output_path, subtitle_filter=None, metho
                     logger.error(f"FFmpeg executed successfully but output file not generated: {temp_output_path}")
                     return False
 
-            except subprocess.CalledProcessError as e:
+            except FFmpegError as e:
                 logger.error(f"FFmpeg command execution failed: {e}")
-                stderr_output = e.stderr.decode('utf-8', errors='ignore') if e.stderr else "No stderr output"
-                logger.error(f"FFmpeg error output: {stderr_output}")
+                logger.error(f"FFmpeg error output: {e.stderr}")
                 return False
 
             except Exception as e:
@@ -369,12 +376,11 @@ def add_subtitles(video_path, srt_path, output_path, subtitle_filter=None, metho
 def synthesize_all_video_under_folder(folder, subtitles=True, speed_up=1.00, fps=30, background_music=None, bgm_volume=0.5, video_volume=1.0, resolution='1080p', watermark_path="f_logo.png"):
     watermark_path = None if not os.path.exists(watermark_path) else watermark_path
     output_video = None
-    for root, dirs, files in os.walk(folder):
-        if 'download.mp4' in files:
-            output_video = synthesize_video(root, subtitles=subtitles,
-                            speed_up=speed_up, fps=fps, resolution=resolution,
-                            background_music=background_music,
-                            watermark_path=watermark_path, bgm_volume=bgm_volume, video_volume=video_volume)
+    for root in video_folders(folder, 'download.mp4'):
+        output_video = synthesize_video(root, subtitles=subtitles,
+                        speed_up=speed_up, fps=fps, resolution=resolution,
+                        background_music=background_music,
+                        watermark_path=watermark_path, bgm_volume=bgm_volume, video_volume=video_volume)
         # if 'download.mp4' in files and 'video.mp4' not in files:
         #     output_video = synthesize_video(root, subtitles=subtitles,
         #                      speed_up=speed_up, fps=fps, resolution=resolution,
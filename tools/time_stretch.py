@@ -0,0 +1,98 @@
+"""
+In-memory time stretching (WSOLA) for TTS lines. Frames of the input are overlap-added at a
+fixed synthesis hop; each frame is taken from near its nominal position at the offset whose
+waveform best continues the previous frame, which keeps pitch and avoids phasing. Many lines
+are stretched together: every step handles one frame of all lines at once, with the
+cross-correlations computed by batched FFTs.
+"""
+import numpy as np
+
+# Analysis frame and search tolerance, in seconds
+FRAME_SECONDS = 0.025
+TOLERANCE_SECONDS = 0.00625
+# Lines stretched together in one batch
+BATCH_LINES = 32
+
+
+def output_length(length, ratio):
+    """Number of samples stretch() returns for `length` input samples"""
+    return int(round(length * ratio))
+
+
+def stretch(wav, ratio, sample_rate=24000):
+    """Stretch mono audio so it lasts `ratio` times as long (ratio > 1 slows it down), keeping the pitch"""
+    return stretch_batch([wav], [ratio], sample_rate)[0]
+
+
+def stretch_batch(wavs, ratios, sample_rate=24000):
+    """Stretch each of `wavs` by the matching ratio; returns a list of float32 arrays"""
+    frame = max(int(FRAME_SECONDS * sample_rate) // 2 * 2, 4)
+    tolerance = max(int(TOLERANCE_SECONDS * sample_rate), 1)
+    wavs = [np.asarray(wav, dtype=np.float32).reshape(-1) for wav in wavs]
+    ratios = np.asarray(ratios, dtype=np.float64)
+    outputs = [None] * len(wavs)
+    todo = []
+    for i, (wav, ratio) in enumerate(zip(wavs, ratios)):
+        if ratio <= 0:
+            raise ValueError(f'Stretch ratio must be positive, got {ratio}')
+        if ratio == 1 or len(wav) < frame:
+            outputs[i] = wav.copy() if ratio == 1 else _resize(wav, output_length(len(wav), ratio))
+        else:
+            todo.append(i)
+    if not todo:
+        return outputs
+
+    # Lines of similar length go together so short lines do not run the frames of long ones
+    todo.sort(key=lambda i: output_length(len(wavs[i]), ratios[i]))
+    for group in range(0, len(todo), BATCH_LINES):
+        indices = todo[group:group + BATCH_LINES]
+        for i, wav in zip(indices, _wsola([wavs[i] for i in indices], ratios[indices], frame, tolerance)):
+            outputs[i] = wav
+    return outputs
+
+
+def _wsola(wavs, ratios, frame, tolerance):
+    hop = frame // 2
+    window = np.hanning(frame + 1)[:frame].astype(np.float32)
+    lengths = np.array([len(wav) for wav in wavs])
+    out_lengths = np.array([output_length(length, ratio) for length, ratio in zip(lengths, ratios)])
+    # Inputs padded so every frame and search region stays in bounds
+    pad = frame // 2 + tolerance
+    signal = np.zeros((len(wavs), lengths.max() + 2 * pad + frame + hop), dtype=np.float32)
+    for row, wav in enumerate(wavs):
+        signal[row, pad:pad + lengths[row]] = wav
+
+    frames = int(np.ceil(out_lengths.max() / hop)) + 1
+    analysis_hop = hop / ratios
+    fft_size = 1 << int(np.ceil(np.log2(frame + 2 * tolerance)))
+    offsets = np.arange(frame)
+    region_offsets = np.arange(frame + 2 * tolerance)
+    rows = np.arange(len(wavs))[:, None]
+    last = signal.shape[1] - frame - 2 * tolerance - 1
+
+    output = np.zeros((len(wavs), frames * hop + frame), dtype=np.float32)
+    window_sum = np.zeros(frames * hop + frame, dtype=np.float32)
+    delta = np.zeros(len(wavs), dtype=np.int64)
+    for k in range(frames):
+        nominal = np.round(k * analysis_hop).astype(np.int64) + tolerance
+        start = np.minimum(nominal + delta, last)
+        output[:, k * hop:k * hop + frame] += signal[rows, start[:, None] + offsets] * window
+        window_sum[k * hop:k * hop + frame] += window
+        # Natural continuation of this frame, matched against the next frame's search region
+        natural = signal[rows, np.minimum(start + hop, last)[:, None] + offsets]
+        next_nominal = np.round((k + 1) * analysis_hop).astype(np.int64)
+        region = signal[rows, np.minimum(next_nominal, last)[:, None] + region_offsets]
+        spectrum = np.fft.rfft(region, fft_size) * np.conj(np.fft.rfft(natural, fft_size))
+        correlation = np.fft.irfft(spectrum, fft_size)[:, :2 * tolerance + 1]
+        delta = np.argmax(correlation, axis=1) - tolerance
+
+    output /= np.maximum(window_sum, 1e-3)
+    return [output[row, frame // 2:frame // 2 + out_lengths[row]].copy() for row in range(len(wavs))]
+
+
+def _resize(wav, length):
+    """Lines shorter than one frame: linear resampling is indistinguishable at that length"""
+    if length == 0 or len(wav) == 0:
+        return np.zeros(length, dtype=np.float32)
+    positions = np.linspace(0, len(wav) - 1, length)
+    return np.interp(positions, np.arange(len(wav)), wav).astype(np.float32)
@@ -0,0 +1,112 @@
+"""
+Streaming assembly of the dubbed track. Lines are appended to a float32 scratch file at their
+timestamps, normalisation peaks are tracked as the audio is written, and the TTS track and
+its mix with the instruments are rendered block by block, so memory stays at a few seconds
+of audio however long the video is.
+"""
+import os
+import wave
+
+import numpy as np
+
+# Frames processed at a time when rendering
+BLOCK_FRAMES = 5 * 24000
+
+
+def _open_wav(path, sample_rate):
+    writer = wave.open(path, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(2)
+    writer.setframerate(sample_rate)
+    return writer
+
+
+def peak(blocks):
+    """Largest absolute sample over an iterable of blocks"""
+    return max((float(np.max(np.abs(block))) for block in blocks if block.size), default=0.0)
+
+
+class Timeline:
+    """Mono track built by padding with silence up to each line's start and appending its audio"""
+
+    def __init__(self, scratch_path, sample_rate=24000):
+        self.scratch_path = scratch_path
+        self.sample_rate = sample_rate
+        self.file = open(scratch_path, 'w+b')
+        self.frames = 0
+        self.peak = 0.0
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
+
+    def pad_to(self, start):
+        """Pad with silence up to `start` seconds if the track ends before it; returns the end in seconds"""
+        if start > self.duration:
+            silence = int((start - self.duration) * self.sample_rate)
+            while silence > 0:
+                n = min(silence, BLOCK_FRAMES)
+                self.file.write(np.zeros(n, dtype=np.float32).tobytes())
+                self.frames += n
+                silence -= n
+        return self.duration
+
+    def append(self, wav):
+        wav = np.asarray(wav, dtype=np.float32)
+        if wav.size:
+            self.peak = max(self.peak, float(np.max(np.abs(wav))))
+        self.file.write(wav.tobytes())
+        self.frames += len(wav)
+
+    def _read(self, start, frames):
+        self.file.seek(start * 4)
+        return np.frombuffer(self.file.read(frames * 4), dtype=np.float32)
+
+    def render(self, tts_path, combined_path, target_peak, instruments):
+        """
+        Write the track scaled to `target_peak` to tts_path, then its sum with the
+        `instruments` blocks, normalised to full scale, to combined_path. The mix is
+        written back into the scratch file first to find its peak.
+        """
+        gain = target_peak / self.peak if self.peak > 0 else 0.0
+        tts_frames = self.frames
+        combined_peak = 0.0
+        position = 0
+        with _open_wav(tts_path, self.sample_rate) as tts_writer:
+            def mix(block):
+                nonlocal position, combined_peak
+                tts = self._read(position, min(len(block), max(tts_frames - position, 0))) * gain
+                if len(tts):
+                    tts_writer.writeframes((tts * 32767).astype(np.int16).tobytes())
+                mixed = block.astype(np.float32)
+                mixed[:len(tts)] += tts
+                if mixed.size:
+                    combined_peak = max(combined_peak, float(np.max(np.abs(mixed))))
+                self.file.seek(position * 4)
+                self.file.write(mixed.tobytes())
+                position += len(mixed)
+
+            for block in instruments:
+                mix(block)
+            # Speech running past the end of the instruments
+            while position < tts_frames:
+                mix(np.zeros(min(BLOCK_FRAMES, tts_frames - position), dtype=np.float32))
+        self.file.flush()
+
+        scale = 32767 / max(0.01, combined_peak)
+        with _open_wav(combined_path, self.sample_rate) as combined_writer:
+            for start in range(0, position, BLOCK_FRAMES):
+                mixed = self._read(start, min(BLOCK_FRAMES, position - start))
+                combined_writer.writeframes((mixed * scale).astype(np.int16).tobytes())
+
+    def close(self):
+        self.file.close()
+        if os.path.exists(self.scratch_path):
+            os.remove(self.scratch_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False